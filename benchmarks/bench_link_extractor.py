@@ -0,0 +1,71 @@
+"""
+Compare the streaming link extractor with the former BeautifulSoup parser
+on a synthetic directory listing.
+
+    PYTHONPATH=. python benchmarks/bench_link_extractor.py [entries]
+
+Requires beautifulsoup4 (installed with the `dev` extra).
+"""
+
+import sys
+import time
+import tracemalloc
+from typing import Callable, List
+
+from bs4 import BeautifulSoup
+
+from migasfree_imports.utils import LISTING_CHUNK_SIZE, iter_links
+
+BASE_URL = 'http://mirror.example.com/pool/main'
+
+
+def make_listing(entries: int) -> bytes:
+    rows = [
+        f'<tr><td><a href="package-{i}_1.{i}-1_amd64.deb">package-{i}_1.{i}-1_amd64.deb</a></td>'
+        f'<td align="right">2024-01-01 00:00</td><td align="right">{i % 900 + 100}K</td></tr>'
+        for i in range(entries)
+    ]
+    html = (
+        '<html><head><title>Index of /pool/main</title></head><body><table>'
+        '<tr><th><a href="?C=N;O=D">Name</a></th></tr><tr><td><a href="/pool/">Parent Directory</a></td></tr>'
+        + ''.join(rows)
+        + '</table></body></html>'
+    )
+    return html.encode()
+
+
+def with_soup(listing: bytes) -> List[str]:
+    soup = BeautifulSoup(listing.decode(), 'html.parser')
+    return [link['href'] for link in soup.find_all('a', href=True)]
+
+
+def with_stream(listing: bytes) -> List[str]:
+    chunks = (listing[i : i + LISTING_CHUNK_SIZE] for i in range(0, len(listing), LISTING_CHUNK_SIZE))
+    return [href for href, _ in iter_links(chunks, BASE_URL, BASE_URL)]
+
+
+def measure(name: str, func: Callable[[bytes], List[str]], listing: bytes) -> None:
+    start = time.perf_counter()
+    links = func(listing)
+    elapsed = time.perf_counter() - start
+
+    # separate run: tracemalloc slows allocations down
+    tracemalloc.start()
+    func(listing)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f'{name:<14} {len(links):>8} links {elapsed:8.3f}s {peak / 1024 / 1024:8.1f} MB peak')
+
+
+def main() -> None:
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    listing = make_listing(entries)
+    print(f'Listing of {entries} entries ({len(listing) / 1024 / 1024:.1f} MB)')
+
+    measure('beautifulsoup', with_soup, listing)
+    measure('streaming', with_stream, listing)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,201 @@
+import argparse
+import functools
 import logging
+import os
 import sys
+from typing import Callable, List, Optional
 
-from .client import MigasfreeImport
-from .importer import MigasfreeImporter
+from .bundle import BundlePackageCache, export_bundle
+from .client import MigasfreeImport, parse_servers
+from .hedge import DEFAULT_BUDGET, DEFAULT_PERCENTILE, HedgePolicy
+from .importer import MigasfreeImporter, MultiServerImporter, ThreadedPackageCache, load_template
+from .index import PackageIndex
+from .loadtest import LoadTest, log_report, write_report
+from .scheduler import DEFAULT_MAX_TRANSFERS, parse_rate, scheduler
+from .trace import tracer
+from .utils import select_distro
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
-def main() -> None:
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='migasfree-import', description='Import projects into migasfree servers.')
+    parser.add_argument(
+        '--bundle',
+        default=os.getenv('MIGASFREE_IMPORT_BUNDLE'),
+        help='import packages and template from an offline bundle instead of the repositories',
+    )
+    parser.add_argument(
+        '--trace',
+        default=os.getenv('MIGASFREE_IMPORT_TRACE'),
+        help='write a Chrome trace-event timeline of the run (open it in Perfetto or chrome://tracing)',
+    )
+    parser.add_argument(
+        '--max-transfers',
+        type=int,
+        default=os.getenv('MIGASFREE_IMPORT_MAX_TRANSFERS', str(DEFAULT_MAX_TRANSFERS)),
+        help='maximum concurrent downloads and uploads (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--download-limit',
+        default=os.getenv('MIGASFREE_IMPORT_DOWNLOAD_LIMIT'),
+        help='download bandwidth cap in bytes per second, e.g. 500K or 10M (default: unlimited)',
+    )
+    parser.add_argument(
+        '--upload-limit',
+        default=os.getenv('MIGASFREE_IMPORT_UPLOAD_LIMIT'),
+        help='upload bandwidth cap in bytes per second, e.g. 500K or 10M (default: unlimited)',
+    )
+    parser.add_argument(
+        '--engine',
+        choices=('threads', 'asyncio'),
+        default=os.getenv('MIGASFREE_IMPORT_ENGINE', 'threads'),
+        help='import engine; asyncio needs aiohttp (pip install migasfree-imports[async]) (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--hedge',
+        action='store_true',
+        default=bool(os.getenv('MIGASFREE_IMPORT_HEDGE')),
+        help='send a duplicate of API reads that are slower than usual and use the first response',
+    )
+    parser.add_argument(
+        '--hedge-percentile',
+        type=float,
+        default=float(os.getenv('MIGASFREE_IMPORT_HEDGE_PERCENTILE', DEFAULT_PERCENTILE * 100)),
+        help='latency percentile after which a read is hedged (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--hedge-budget',
+        type=float,
+        default=float(os.getenv('MIGASFREE_IMPORT_HEDGE_BUDGET', DEFAULT_BUDGET * 100)),
+        help='maximum hedged reads, in percent of all reads (default: %(default)s)',
+    )
+    subparsers = parser.add_subparsers(dest='command')
+
+    export = subparsers.add_parser('export', help='write an offline import bundle of a distro base')
+    export.add_argument('--output', default='bundle.tar', help='bundle file (default: %(default)s)')
+
+    loadtest = subparsers.add_parser('loadtest', help='simulate concurrent importers to capacity-test a server')
+    loadtest.add_argument(
+        '--server', help='server to test, optionally as user:password@server (default: MIGASFREE_CLIENT_SERVER)'
+    )
+    loadtest.add_argument('--users', type=int, default=10, help='concurrent virtual importers (default: %(default)s)')
+    loadtest.add_argument(
+        '--iterations', type=int, default=10, help='iterations per virtual importer (default: %(default)s)'
+    )
+    loadtest.add_argument(
+        '--ramp-up', type=float, default=0.0, help='seconds to start all virtual importers (default: %(default)s)'
+    )
+    loadtest.add_argument('--package', help='package file uploaded in every iteration')
+    loadtest.add_argument('--report', default='loadtest.json', help='JSON report file (default: %(default)s)')
+
+    args = parser.parse_args(argv)
+    if args.command == 'loadtest' and args.users < 1:
+        parser.error('--users must be at least 1')
+    if args.max_transfers < 1:
+        parser.error('--max-transfers must be at least 1')
+    if not 0 < args.hedge_percentile < 100:
+        parser.error('--hedge-percentile must be between 0 and 100')
+    if args.hedge_budget < 0:
+        parser.error('--hedge-budget must not be negative')
+    try:
+        args.download_limit = parse_rate(args.download_limit)
+        args.upload_limit = parse_rate(args.upload_limit)
+    except ValueError as e:
+        parser.error(str(e))
+
+    return args
+
+
+def hedge_policy(args: argparse.Namespace) -> Optional[Callable[[], HedgePolicy]]:
+    """Factory of the hedge policy of each server, None if hedging is off."""
+    if not args.hedge:
+        return None
+
+    return functools.partial(HedgePolicy, percentile=args.hedge_percentile / 100, budget=args.hedge_budget / 100)
+
+
+def run_import(args: argparse.Namespace) -> None:
+    index_path = os.getenv('MIGASFREE_IMPORT_INDEX')
+    index = PackageIndex(index_path) if index_path else None
+
+    servers = parse_servers(os.getenv('MIGASFREE_CLIENT_SERVER', ''))
+    hedge = hedge_policy(args)
+    packages = BundlePackageCache(args.bundle) if args.bundle else None
+    template = packages.template if packages else None
+
+    clients: List[MigasfreeImport] = []
+    try:
+        if args.engine == 'asyncio':
+            from . import aio  # optional: only needed by the asyncio engine
+
+            bundle = ThreadedPackageCache(packages) if packages else None
+            aio.run(servers, index, hedge=hedge, template=template, packages=bundle)
+            return
+
+        # each server logs in from its own import, so an unreachable one does not stop the others
+        for server in servers or [{}]:
+            clients.append(MigasfreeImport(index=index, hedge=hedge() if hedge else None, authenticate=False, **server))
+
+        if len(clients) > 1:
+            MultiServerImporter(clients, template, packages=packages).run()
+        else:
+            importer = MigasfreeImporter(clients[0], template, packages=packages)
+            importer.run()
+    finally:
+        if packages:
+            packages.clear()
+            packages.close()
+        for client in clients:
+            if client.hedge:
+                client.hedge.log(client.server)
+
+
+def run_export(args: argparse.Namespace) -> None:
+    template = load_template()
+    distro = select_distro(template['distros'])
+    export_bundle(template, distro, args.output)
+
+
+def run_loadtest(args: argparse.Namespace) -> None:
+    servers = parse_servers(args.server or os.getenv('MIGASFREE_CLIENT_SERVER', ''))
+    if not servers:
+        raise ValueError('MIGASFREE_CLIENT_SERVER environment variable not set.')
+
+    load_test = LoadTest(
+        users=args.users, iterations=args.iterations, ramp_up=args.ramp_up, package=args.package, **servers[0]
+    )
+    report = load_test.run()
+    log_report(report)
+    write_report(report, args.report)
+    logger.info('Report written to %s', args.report)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
     """
     Main entry point for the script.
     """
+    args = parse_args(argv)
+    if args.trace:
+        tracer.enable()
+    scheduler.configure(args.max_transfers, args.download_limit, args.upload_limit)
+
     try:
-        client = MigasfreeImport()
-        importer = MigasfreeImporter(client)
-        importer.run()
+        if args.command == 'loadtest':
+            run_loadtest(args)
+        elif args.command == 'export':
+            run_export(args)
+        else:
+            run_import(args)
     except Exception as e:
         logger.error('An error occurred during the import process: %s', e)
         sys.exit(1)
+    finally:
+        if args.trace:
+            tracer.write(args.trace)
+            logger.info('Trace written to %s', args.trace)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,560 @@
+"""
+asyncio engine: aiohttp transports for the import engine of `importer`
+(`AsyncMigasfreeImporter`), so it crawls, downloads and talks to every
+server from a single event loop instead of calling the requests based
+`MigasfreeImport` and `PackageCache` from worker threads.
+
+Requires aiohttp (`pip install migasfree-imports[async]`).
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import shutil
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
+from urllib.parse import unquote
+
+import aiohttp
+
+from .checksums import (
+    PARSE_ERRORS,
+    Checksums,
+    IntegrityError,
+    is_checksum_file,
+    lookup,
+    parse_checksums,
+    select_checksum_files,
+)
+from .client import RESPONSE_ERRORS, AsyncSingleFlight, MigasfreeImportBase, SingleFlight, UploadBody
+from .hedge import HedgePolicy
+from .importer import PACKAGES_PATH, AsyncMigasfreeImporter, AsyncMultiServerImporter, ThreadedPackageCache
+from .index import PackageIndex
+from .progress import progress
+from .scheduler import scheduler, transfers
+from .trace import tracer
+from .utils import (
+    EXTENSIONS,
+    LISTING_CHUNK_SIZE,
+    ListingParser,
+    VerifiedDownload,
+    content_length,
+    package_directory,
+    select_packages,
+)
+
+DEFAULT_MAX_REQUESTS = 32
+DEFAULT_MAX_CRAWLS = 64
+
+HTTP_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+logger = logging.getLogger(__name__)
+
+
+def form_fields(data: Optional[Dict[str, Any]]) -> List[Tuple[str, str]]:
+    """Encode form data or query params the way requests does: lists are repeated keys, None values are dropped."""
+    fields = []
+    for key, value in (data or {}).items():
+        for item in value if isinstance(value, (list, tuple)) else [value]:
+            if item is not None:
+                fields.append((key, str(item)))
+
+    return fields
+
+
+def form_data(
+    data: Optional[Union[Dict[str, Any], UploadBody]] = None, files: Optional[Dict[str, Any]] = None
+) -> Union[List[Tuple[str, str]], aiohttp.FormData, AsyncIterator[bytes], None]:
+    """
+    Request body: urlencoded `data`, multipart when there are `files`
+    (`{name: (filename, file, mime)}`), or the chunks of an `UploadBody`.
+    """
+    if isinstance(data, UploadBody):
+        return data.async_chunks()
+
+    if not files:
+        return form_fields(data) if data else None
+
+    form = aiohttp.FormData(form_fields(data))
+    for name, (filename, file, content_type) in files.items():
+        form.add_field(name, file, filename=filename, content_type=content_type)
+
+    return form
+
+
+class AsyncMigasfreeImport(MigasfreeImportBase):
+    """
+    asyncio counterpart of `MigasfreeImport`, with the same methods as coroutines.
+
+    Use it as an async context manager: it opens the HTTP session and gets a
+    token if none is given (unless `authenticate` is off: then the first
+    `login` gets it). At most `max_requests` API requests are in flight.
+    """
+
+    def __init__(
+        self,
+        server: Optional[str] = None,
+        token: Optional[str] = None,
+        index: Optional[PackageIndex] = None,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        max_requests: int = DEFAULT_MAX_REQUESTS,
+        hedge: Optional[HedgePolicy] = None,
+        authenticate: bool = True,
+    ) -> None:
+        super().__init__(server, token, index, username, password, hedge)
+        self.authenticate = authenticate
+        self.single_flight = AsyncSingleFlight()
+        self.max_requests = max_requests
+        self.session: Optional[aiohttp.ClientSession] = None
+        self._requests: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self) -> 'AsyncMigasfreeImport':
+        # concurrency is bounded by the semaphore, not by the connection pool
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0, ssl=False))
+        self._requests = asyncio.Semaphore(self.max_requests)
+        try:
+            if self.authenticate and not self.token:
+                await self.get_token()
+        except BaseException:
+            await self.close()
+            raise
+
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def get_token(self) -> str:
+        """Retrieve an authentication token from the server."""
+        status, body = await self._send('POST', self.get_url('/token-auth/'), json=self.credentials())
+        return self._accept_token(status, body.decode(errors='replace'), lambda: json.loads(body))
+
+    async def login(self) -> str:
+        """Return the authentication token, retrieving it if the client has none yet."""
+        return self.token or await self.get_token()
+
+    async def _send(self, method: str, url: str, **kwargs: Any) -> Tuple[int, bytes]:
+        """Send an HTTP request (the single point where the client touches the network)."""
+        async with self._requests, self.session.request(method, url, **kwargs) as response:
+            return response.status, await response.read()
+
+    async def _request(self, method: str, endpoint: str, **kwargs: Any) -> Dict[str, Any]:
+        """Helper method to make HTTP requests: `_call`, but error responses are logged and give {}."""
+        try:
+            return await self._call(method, endpoint, **kwargs)
+        except RESPONSE_ERRORS as e:
+            return self._failed(e)
+
+    async def _call(
+        self,
+        method: str,
+        endpoint: str,
+        data: Optional[Union[Dict[str, Any], UploadBody]] = None,
+        params: Optional[Dict[str, Any]] = None,
+        files: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        json: Optional[Dict[str, Any]] = None,
+    ) -> Any:
+        """
+        Send a request and return its decoded JSON body. Raises `requests.HTTPError` for error responses.
+
+        `data` is sent as a form (multipart with `files`), `json` as a JSON body.
+        """
+        url = self.get_url(endpoint)
+        with tracer.span(f'{method} {endpoint}', 'http', server=self.server) as span:
+            status, body = await self._send(
+                method,
+                url,
+                headers={**self.headers, **(headers or {})},
+                data=form_data(data, files),
+                json=json,
+                params=form_fields(params),
+            )
+            span.update(status=status, bytes=len(body))
+
+        return self.decode(url, status, body)
+
+    async def get(self, endpoint: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        GET request; identical concurrent requests share a single network call (and its result).
+
+        With a hedge policy, slow requests are hedged (see `_hedged_get`).
+        """
+        if self.hedge:
+            return await self.single_flight.do(
+                SingleFlight.key('GET', endpoint, params), lambda: self._hedged_get(endpoint, params)
+            )
+
+        return await self.single_flight.do(
+            SingleFlight.key('GET', endpoint, params), lambda: self._request('GET', endpoint, params=params)
+        )
+
+    async def _timed_get(self, endpoint: str, params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """GET that raises on error responses; only the latency of successful (not cancelled) ones is learned."""
+        start = time.perf_counter()
+        response = await self._call('GET', endpoint, params=params)
+        self.hedge.record(time.perf_counter() - start)
+        return response
+
+    async def _hedged_get(self, endpoint: str, params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        GET that sends a duplicate request when there is no response within the
+        hedge delay (if the hedge budget allows it) and returns the first
+        successful response. The slower request is cancelled.
+
+        An error response does not win: the other request is waited for. If
+        both fail, the result is that of `_request`.
+        """
+        try:
+            return await self._first_get(endpoint, params)
+        except RESPONSE_ERRORS as e:
+            return self._failed(e)
+
+    async def _first_get(self, endpoint: str, params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        delay = self.hedge.delay()
+        if delay is None:
+            return await self._timed_get(endpoint, params)
+
+        first = asyncio.ensure_future(self._timed_get(endpoint, params))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done or not self.hedge.acquire():
+            return await first
+
+        logger.debug('Hedging GET %s after %.3fs', endpoint, delay)
+        second = asyncio.ensure_future(self._timed_get(endpoint, params))
+        pending = {first, second}
+        try:
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    if not future.exception():
+                        if future is second:
+                            self.hedge.won()
+                        return future.result()
+                if not pending:
+                    return future.result()  # both failed: raise the last error
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def get_all(self, endpoint: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Retrieve every element of a paginated list endpoint."""
+        elements: List[Dict[str, Any]] = []
+        page = 1
+
+        while True:
+            response = await self.get(endpoint, params={**(params or {}), 'page': page})
+            if isinstance(response, list):
+                return response
+
+            elements.extend(response.get('results', []))
+            if not response.get('next'):
+                return elements
+
+            page += 1
+
+    async def post(
+        self,
+        endpoint: str,
+        data: Optional[Union[Dict[str, Any], UploadBody]] = None,
+        files: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Dict[str, Any]:
+        response = await self._request('POST', endpoint, data=data, files=files, headers=headers)
+        self._log_created(endpoint, response)
+        return response
+
+    async def patch(
+        self,
+        endpoint: str,
+        data: Optional[Dict[str, Any]] = None,
+        files: Optional[Dict[str, Any]] = None,
+        json: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        return await self._request('PATCH', endpoint, data=data, files=files, json=json)
+
+    async def put(self, endpoint: str, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return await self._request('PUT', endpoint, data=data)
+
+    async def get_or_post(
+        self,
+        endpoint: str,
+        params: Optional[Dict[str, Any]] = None,
+        data: Optional[Dict[str, Any]] = None,
+        files: Optional[Dict[str, Any]] = None,
+    ) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+        """
+        Return the elements matching `params`, creating one with `data` if there is none.
+
+        Concurrent calls with the same endpoint and params are collapsed, so
+        they do not create twin objects.
+        """
+
+        async def get_or_post() -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+            element = await self.get(endpoint, params=params)
+            if element:
+                return element.get('results', element)
+
+            return [await self.post(endpoint, data=data, files=files)]
+
+        return await self.single_flight.do(SingleFlight.key('GET_OR_POST', endpoint, params), get_or_post)
+
+    async def upload_package(self, file_path: str, project_id: int, store_id: int) -> Dict[str, Any]:
+        """
+        Upload a package file to the server.
+
+        If a package index is set, packages with the same content already uploaded
+        to this server, project and store are not uploaded again, as long as
+        the server still has them.
+        """
+        entry, package_id = self._indexed_upload(file_path, project_id, store_id)
+        if package_id is not None:
+            # the server may have deleted the package since it was uploaded
+            try:
+                package = await self._call('GET', f'/api/v1/token/packages/{package_id}/')
+            except RESPONSE_ERRORS:
+                package = None
+            uploaded = self._confirm_upload(file_path, entry, project_id, store_id, package_id, package)
+            if uploaded:
+                return uploaded
+
+        progress.status(f'Uploading {file_path}')
+        url = '/api/v1/token/packages/'
+        form = {'project': project_id, 'store': store_id}
+
+        with tracer.span('upload', 'transfer', file=file_path, server=self.server) as span, open(
+            file_path, 'rb'
+        ) as file:
+            body = UploadBody(form, 'files', file)
+            span['bytes'] = body.size
+            response = await self.post(url, data=body, headers=body.headers)
+
+        self._record_upload(entry, project_id, store_id, response)
+        return response
+
+
+class AsyncPackageCache:
+    """
+    asyncio counterpart of `PackageCache`: repository listings and package
+    downloads shared by several importers, each one fetched once.
+
+    Directory listings are crawled concurrently, at most `max_crawls` at once.
+    Downloads are verified and their digests kept as in `PackageCache`.
+    The HTTP session is opened on first use; `close` it when done.
+    """
+
+    def __init__(self, directory: str = PACKAGES_PATH, max_crawls: int = DEFAULT_MAX_CRAWLS) -> None:
+        self.directory = directory
+        self.max_crawls = max_crawls
+        self.checksums: Checksums = {}
+        self.digests: Dict[str, str] = {}
+        self._results: Dict[Tuple[Any, ...], asyncio.Future] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._crawls: Optional[asyncio.Semaphore] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0))
+            self._crawls = asyncio.Semaphore(self.max_crawls)
+        return self._session
+
+    async def close(self) -> None:
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    async def _once(self, key: Tuple[Any, ...], func: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._results.get(key)
+        if future is None:
+            future = self._results[key] = asyncio.ensure_future(func())
+
+        return await asyncio.shield(future)
+
+    async def _find_packages(self, url: str, repository_url: str, visited: Set[str], metadata: List[str]) -> List[str]:
+        """
+        Collect package URLs from a repository directory listing, crawling its
+        subdirectories concurrently. Checksum files are appended to `metadata`.
+        """
+        normalized_url = url.rstrip('/')
+        if normalized_url in visited:
+            return []
+        visited.add(normalized_url)
+
+        packages = []
+        directories = []
+        try:
+            session = self.session
+            progress.status(f'Accessing: {normalized_url}')
+            async with self._crawls:
+                with tracer.span('crawl', 'transfer', url=normalized_url) as span:
+                    async with session.get(normalized_url) as response:
+                        response.raise_for_status()
+                        parser = ListingParser(normalized_url, repository_url, response.charset)
+                        links = []
+                        size = 0
+                        async for chunk in response.content.iter_chunked(LISTING_CHUNK_SIZE):
+                            size += len(chunk)
+                            links.extend(parser.feed(chunk))
+                        links.extend(parser.close())
+                    span['bytes'] = size
+
+            for href, resource_url in links:
+                if any(href.endswith(ext) for ext in EXTENSIONS):
+                    packages.append(resource_url)
+                elif href.endswith('/'):
+                    directories.append(resource_url)
+                elif is_checksum_file(href):
+                    metadata.append(resource_url)
+            progress.advance('crawl', items=1)
+
+        except HTTP_ERRORS as e:
+            logger.error('Error accessing the URL or downloading files: %s', e)
+            return packages
+
+        # subdirectories are crawled once this listing is closed
+        for found in await asyncio.gather(
+            *(self._find_packages(directory, repository_url, visited, metadata) for directory in directories)
+        ):
+            packages.extend(found)
+
+        return packages
+
+    async def list(self, url: str, keep_versions: int = 0, architectures: Optional[List[str]] = None) -> List[str]:
+        """Return the package URLs of a repository (see `list_packages`)."""
+
+        async def crawl() -> List[str]:
+            metadata: List[str] = []
+            packages = await self._find_packages(url, url, set(), metadata)
+            await self._load_checksums(metadata)
+            return select_packages(url, packages, keep_versions, architectures)
+
+        return await self._once(('list', url, keep_versions, tuple(architectures or [])), crawl)
+
+    async def _load_checksums(self, urls: List[str]) -> None:
+        """Download and parse checksum files into `checksums` (see `load_checksums`)."""
+
+        async def load(url: str) -> None:
+            session = self.session
+            try:
+                async with self._crawls, session.get(url) as response:
+                    response.raise_for_status()
+                    data = await response.read()
+                # decompressing and parsing a big index is CPU bound: keep it off the event loop
+                checksums = await asyncio.get_running_loop().run_in_executor(None, parse_checksums, url, data)
+            except (*HTTP_ERRORS, *PARSE_ERRORS) as e:
+                logger.warning('Ignoring checksum file %s: %s', url, e)
+                return
+            self.checksums.update(checksums)
+
+        await asyncio.gather(*(load(url) for url in select_checksum_files(urls)))
+
+    async def _download(self, url: str) -> Tuple[str, str]:
+        """Download a single package file and return its local path and sha256 (see `download_verified`)."""
+        file_path = os.path.join(package_directory(self.directory, url), unquote(os.path.basename(url)))
+        download = VerifiedDownload(url, file_path, lookup(self.checksums, url))
+        session = self.session
+
+        while True:
+            download.start()
+            async with transfers.slot():
+                with tracer.span('download', 'transfer', url=url) as span:
+                    async with session.get(url) as response:
+                        response.raise_for_status()
+                        download.size(response.content_length)
+                        with open(file_path, 'wb') as file:
+                            async for chunk in response.content.iter_chunked(8192):
+                                await transfers.consume(scheduler.download, len(chunk))
+                                download.write(file, chunk)
+                    span['bytes'] = download.verifier.size
+
+            sha256 = download.finish(content_length(response.headers))
+            if sha256:
+                return file_path, sha256
+
+    async def fetch(self, url: str) -> Optional[str]:
+        """Return the local path of a package, downloading it the first time. None if the download failed."""
+
+        async def download() -> Optional[str]:
+            progress.add_total('download', items=1)
+            os.makedirs(package_directory(self.directory, url), exist_ok=True)
+            try:
+                file_path, sha256 = await self._download(url)
+            except (*HTTP_ERRORS, IntegrityError) as e:
+                logger.error('Error accessing the URL or downloading files: %s', e)
+                return None
+
+            self.digests[os.path.abspath(file_path)] = sha256
+            return file_path
+
+        return await self._once(('fetch', url), download)
+
+    async def size(self, url: str) -> Optional[int]:
+        """Return the size of a package (HEAD request, once per URL), None if unknown."""
+
+        async def head() -> Optional[int]:
+            session = self.session
+            try:
+                async with self._crawls, session.head(url, allow_redirects=True) as response:
+                    response.raise_for_status()
+                    return response.content_length
+            except HTTP_ERRORS:
+                return None
+
+        return await self._once(('size', url), head)
+
+    def clear(self) -> None:
+        """Remove the downloaded packages."""
+        self._results.clear()
+        self.digests.clear()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+async def import_servers(
+    servers: List[Dict[str, Optional[str]]],
+    index: Optional[PackageIndex] = None,
+    template: Optional[Dict[str, Any]] = None,
+    hedge: Optional[Callable[[], HedgePolicy]] = None,
+    packages: Optional['ThreadedPackageCache'] = None,
+) -> None:
+    """
+    Import into `servers` (as returned by `parse_servers`), or the configured
+    server if empty. `hedge` creates the hedge policy of each server.
+    `packages` replaces the repositories (e.g. an offline bundle); its owner clears it.
+    """
+    async with contextlib.AsyncExitStack() as stack:
+        clients = [
+            # each server logs in from its own import, so an unreachable one does not stop the others
+            await stack.enter_async_context(
+                AsyncMigasfreeImport(index=index, hedge=hedge() if hedge else None, authenticate=False, **server)
+            )
+            for server in servers or [{}]
+        ]
+        try:
+            if len(clients) > 1:
+                await AsyncMultiServerImporter(clients, template, packages=packages).run()
+            else:
+                await AsyncMigasfreeImporter(clients[0], template, packages=packages).run()
+        finally:
+            for client in clients:
+                if client.hedge:
+                    client.hedge.log(client.server)
+
+
+def run(
+    servers: List[Dict[str, Optional[str]]],
+    index: Optional[PackageIndex] = None,
+    hedge: Optional[Callable[[], HedgePolicy]] = None,
+    template: Optional[Dict[str, Any]] = None,
+    packages: Optional['ThreadedPackageCache'] = None,
+) -> None:
+    """Synchronous entry point of the asyncio engine."""
+    asyncio.run(import_servers(servers, index, template, hedge=hedge, packages=packages))
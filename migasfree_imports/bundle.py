@@ -0,0 +1,159 @@
+import hashlib
+import io
+import json
+import logging
+import mmap
+import os
+import tarfile
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from .importer import PACKAGES_PATH, PackageCache
+from .index import sha256_file
+from .progress import progress
+from .utils import package_directory
+
+INDEX_NAME = 'index.json'
+BUNDLE_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+def internal_deployments(template: Dict[str, Any], distro_name: str) -> List[Dict[str, Any]]:
+    return [
+        deployment
+        for deployment in template['deployments'][distro_name]
+        if deployment['source'] == 'I' and not deployment.get('ignored', False)
+    ]
+
+
+def export_bundle(template: Dict[str, Any], distro: Dict[str, Any], output: str) -> Dict[str, Any]:
+    """
+    Write an offline import bundle of a distro base: an uncompressed tar file
+    with every package of its internal deployments and an `index.json` that
+    holds the template (icons included) and the offset, size and sha256 of
+    each package inside the bundle. Returns the index.
+    """
+    index: Dict[str, Any] = {
+        'version': BUNDLE_VERSION,
+        'created': datetime.now().isoformat(),
+        'distro': distro['name'],
+        'template': {
+            'distros': [distro],
+            'deployments': {distro['name']: template['deployments'][distro['name']]},
+            'applications': template['applications'],
+        },
+        'repositories': {},
+    }
+
+    members: Dict[str, Dict[str, Any]] = {}
+    with tempfile.TemporaryDirectory() as directory, progress:
+        cache = PackageCache(directory)
+        with tarfile.open(output, 'w') as tar:
+            for deployment in internal_deployments(template, distro['name']):
+                urls = cache.list(
+                    deployment['url_download'],
+                    keep_versions=deployment.get('keep_versions', 0),
+                    architectures=deployment.get('architectures'),
+                )
+                entries = index['repositories'].setdefault(deployment['url_download'], [])
+
+                for url in urls:
+                    if url not in members:
+                        file_path = cache.fetch(url)
+                        if not file_path:
+                            continue
+
+                        name = f'packages/{len(members)}/{os.path.basename(file_path)}'
+                        tar.add(file_path, arcname=name)
+                        sha256 = cache.digests.get(os.path.abspath(file_path)) or sha256_file(file_path)
+                        members[url] = {'url': url, 'name': name, 'sha256': sha256}
+                        os.remove(file_path)
+
+                    entries.append(members[url])
+
+        # offsets are only known once the members are written
+        by_name = {entry['name']: entry for entry in members.values()}
+        with tarfile.open(output, 'r') as tar:
+            for member in tar.getmembers():
+                by_name[member.name].update(offset=member.offset_data, size=member.size)
+
+        data = json.dumps(index, indent=2).encode()
+        with tarfile.open(output, 'a') as tar:
+            info = tarfile.TarInfo(INDEX_NAME)
+            info.size = len(data)
+            info.mtime = int(datetime.now().timestamp())
+            tar.addfile(info, io.BytesIO(data))
+
+    logger.info('Bundle %s: %d packages for %s', output, len(members), distro['name'])
+    return index
+
+
+class BundlePackageCache(PackageCache):
+    """
+    Package source backed by an offline bundle instead of the repositories.
+
+    The bundle is memory-mapped; packages are copied out of it on demand, so
+    the network is only used to talk to the migasfree server. Each package is
+    checked against the sha256 of the bundle index while it is copied.
+    """
+
+    def __init__(self, path: str, directory: str = PACKAGES_PATH) -> None:
+        super().__init__(directory)
+        self.path = path
+
+        with tarfile.open(path, 'r') as tar:
+            self.index = json.load(tar.extractfile(INDEX_NAME))
+
+        if self.index.get('version') != BUNDLE_VERSION:
+            raise ValueError(f'Unsupported bundle version: {self.index.get("version")}')
+
+        self._file = open(path, 'rb')  # noqa: SIM115 - kept open for the lifetime of the mapping
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._entries = {entry['url']: entry for entries in self.index['repositories'].values() for entry in entries}
+
+    @property
+    def template(self) -> Dict[str, Any]:
+        return self.index['template']
+
+    def list(self, url: str, keep_versions: int = 0, architectures: Optional[List[str]] = None) -> List[str]:
+        if url not in self.index['repositories']:
+            logger.warning('Repository %s is not in bundle %s', url, self.path)
+        return [entry['url'] for entry in self.index['repositories'].get(url, [])]
+
+    def size(self, url: str) -> Optional[int]:
+        entry = self._entries.get(url)
+        return entry['size'] if entry else None
+
+    def fetch(self, url: str) -> Optional[str]:
+        entry = self._entries.get(url)
+        if entry is None:
+            logger.error('Package %s is not in bundle %s', url, self.path)
+            return None
+
+        def extract() -> Optional[str]:
+            start = entry['offset']
+            # a view of the mapping: the package is hashed and written without copying it
+            with memoryview(self._map)[start : start + entry['size']] as data:
+                sha256 = hashlib.sha256(data).hexdigest()
+                if sha256 != entry['sha256']:
+                    logger.error('Package %s is corrupted in bundle %s (sha256 %s)', url, self.path, sha256)
+                    return None
+
+                directory = package_directory(self.directory, url)
+                os.makedirs(directory, exist_ok=True)
+                file_path = os.path.join(directory, os.path.basename(entry['name']))
+                with open(file_path, 'wb') as file:
+                    file.write(data)
+
+            with self._lock:
+                self.digests[os.path.abspath(file_path)] = sha256
+            progress.advance('extract', items=1, size=entry['size'])
+            return file_path
+
+        return self._once(('fetch', url), extract)
+
+    def close(self) -> None:
+        self._map.close()
+        self._file.close()
@@ -0,0 +1,206 @@
+import bz2
+import gzip
+import hashlib
+import io
+import logging
+import lzma
+import os
+import re
+import xml.etree.ElementTree as ElementTree
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote, urljoin
+
+import requests
+import zstandard
+
+# package url -> (hash algorithm, hex digest)
+Checksums = Dict[str, Tuple[str, str]]
+
+DEB_FIELDS = (('SHA256', 'sha256'), ('SHA512', 'sha512'), ('SHA1', 'sha1'), ('MD5sum', 'md5'))
+RPM_ALGORITHMS = {'sha': 'sha1'}
+RPM_NAMESPACE = '{http://linux.duke.edu/metadata/common}'
+SUMS_FILES = {'SHA256SUMS': 'sha256', 'SHA512SUMS': 'sha512'}
+SIDECAR_EXTENSIONS = {'.sha256': 'sha256', '.sha512': 'sha512'}
+# preferred first: a repository usually publishes the same Packages file several times
+PACKAGES_FILES = ('Packages.xz', 'Packages.gz', 'Packages.bz2', 'Packages')
+PRIMARY_RE = re.compile(r'(^|-)primary\.xml(\.(gz|xz|bz2|zst))?$')
+
+# errors of unreadable checksum files
+PARSE_ERRORS = (ValueError, EOFError, OSError, lzma.LZMAError, zstandard.ZstdError, ElementTree.ParseError)
+
+logger = logging.getLogger(__name__)
+
+
+class IntegrityError(requests.RequestException):
+    """A downloaded package does not match its expected checksum or size."""
+
+
+def is_checksum_file(name: str) -> bool:
+    """Is this file name repository metadata or a sidecar file with package checksums?"""
+    name = os.path.basename(name)
+    return (
+        name in PACKAGES_FILES
+        or name in SUMS_FILES
+        or name.endswith(tuple(SIDECAR_EXTENSIONS))
+        or PRIMARY_RE.search(name) is not None
+    )
+
+
+def select_checksum_files(urls: List[str]) -> List[str]:
+    """Drop the duplicates of `Packages` files (keep one compression per directory)."""
+    packages: Dict[str, str] = {}
+    selected = []
+    for url in urls:
+        directory, name = url.rsplit('/', 1)
+        if name not in PACKAGES_FILES:
+            selected.append(url)
+        elif directory not in packages or PACKAGES_FILES.index(name) < PACKAGES_FILES.index(
+            packages[directory].rsplit('/', 1)[1]
+        ):
+            packages[directory] = url
+
+    return selected + list(packages.values())
+
+
+def decompress(name: str, data: bytes) -> bytes:
+    """Decompress `data` by the extension of the file `name` (.gz, .xz, .bz2 or .zst); other data is returned as is."""
+    if name.endswith('.gz'):
+        return gzip.decompress(data)
+    if name.endswith('.xz'):
+        return lzma.decompress(data)
+    if name.endswith('.bz2'):
+        return bz2.decompress(data)
+    if name.endswith('.zst'):
+        # streaming: zstd frames do not always record the decompressed size
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+def _key(url: str) -> str:
+    return unquote(url)
+
+
+def parse_deb_packages(url: str, text: str) -> Checksums:
+    """Checksums of a Debian `Packages` index: `Filename` is relative to the archive root."""
+    root = url[: url.index('/dists/') + 1] if '/dists/' in url else url.rsplit('/', 1)[0] + '/'
+    checksums = {}
+    for stanza in re.split(r'\n\s*\n', text):
+        fields = {}
+        for line in stanza.splitlines():
+            if line and not line[0].isspace() and ':' in line:
+                key, value = line.split(':', 1)
+                fields[key.strip()] = value.strip()
+
+        if 'Filename' not in fields:
+            continue
+
+        for field, algorithm in DEB_FIELDS:
+            if field in fields:
+                checksums[_key(urljoin(root, fields['Filename']))] = (algorithm, fields[field].lower())
+                break
+
+    return checksums
+
+
+def parse_rpm_primary(url: str, data: bytes) -> Checksums:
+    """Checksums of a `primary.xml` of rpm repodata: locations are relative to the parent of `repodata/`."""
+    root = url[: url.rindex('/repodata/') + 1] if '/repodata/' in url else url.rsplit('/', 1)[0] + '/'
+    checksums = {}
+    for _, element in ElementTree.iterparse(io.BytesIO(data)):
+        if element.tag != f'{RPM_NAMESPACE}package':
+            continue
+
+        checksum = element.find(f'{RPM_NAMESPACE}checksum')
+        location = element.find(f'{RPM_NAMESPACE}location')
+        algorithm = checksum.get('type', 'sha256') if checksum is not None else ''
+        algorithm = RPM_ALGORITHMS.get(algorithm, algorithm)
+        if algorithm in hashlib.algorithms_guaranteed and location is not None and checksum.text:
+            checksums[_key(urljoin(root, location.get('href', '')))] = (algorithm, checksum.text.strip().lower())
+        element.clear()
+
+    return checksums
+
+
+def parse_sums(url: str, text: str, algorithm: str) -> Checksums:
+    """Checksums of a `SHA256SUMS` style file (`<digest>  [*]<file name>` lines) or of a sidecar file."""
+    directory = url.rsplit('/', 1)[0] + '/'
+    checksums = {}
+    for line in text.splitlines():
+        parts = line.split(None, 1)
+        if not parts:
+            continue
+
+        if len(parts) == 1 or url.endswith(tuple(SIDECAR_EXTENSIONS)):
+            # a sidecar file describes the file it is named after
+            target = url[: url.rindex('.')]
+        else:
+            target = urljoin(directory, parts[1].strip().lstrip('*'))
+        checksums[_key(target)] = (algorithm, parts[0].lower())
+
+    return checksums
+
+
+def parse_checksums(url: str, data: bytes) -> Checksums:
+    """Parse a checksum file (see `is_checksum_file`) into package URL -> (algorithm, digest)."""
+    name = os.path.basename(url)
+    if name in PACKAGES_FILES:
+        return parse_deb_packages(url, decompress(name, data).decode('utf-8', 'replace'))
+    if PRIMARY_RE.search(name):
+        return parse_rpm_primary(url, decompress(name, data))
+    if name in SUMS_FILES:
+        return parse_sums(url, data.decode('utf-8', 'replace'), SUMS_FILES[name])
+
+    extension = os.path.splitext(name)[1]
+    return parse_sums(url, data.decode('utf-8', 'replace'), SIDECAR_EXTENSIONS[extension])
+
+
+def load_checksums(urls: List[str]) -> Checksums:
+    """Download and parse checksum files; unreadable ones are skipped."""
+    checksums: Checksums = {}
+    for url in select_checksum_files(urls):
+        try:
+            response = requests.get(url)
+            response.raise_for_status()
+            checksums.update(parse_checksums(url, response.content))
+        except (requests.RequestException, *PARSE_ERRORS) as e:
+            logger.warning('Ignoring checksum file %s: %s', url, e)
+
+    return checksums
+
+
+def lookup(checksums: Checksums, url: str) -> Optional[Tuple[str, str]]:
+    """Expected checksum of a package URL, if known."""
+    return checksums.get(_key(url))
+
+
+class Verifier:
+    """
+    Hashes a download while it is streamed: always sha256 (kept for the
+    package index and deduplication) and, if different, the algorithm of
+    the expected checksum.
+    """
+
+    def __init__(self, checksum: Optional[Tuple[str, str]] = None) -> None:
+        self.checksum = checksum
+        self.sha256 = hashlib.sha256()
+        self.expected = hashlib.new(checksum[0]) if checksum and checksum[0] != 'sha256' else None
+        self.size = 0
+
+    def update(self, chunk: bytes) -> None:
+        self.sha256.update(chunk)
+        if self.expected is not None:
+            self.expected.update(chunk)
+        self.size += len(chunk)
+
+    def verify(self, url: str, content_length: Optional[int] = None) -> str:
+        """Return the sha256 of the download, raising `IntegrityError` if it is truncated or corrupted."""
+        if content_length is not None and self.size != content_length:
+            raise IntegrityError(f'{url}: got {self.size} of {content_length} bytes')
+
+        if self.checksum:
+            algorithm, expected = self.checksum
+            digest = (self.sha256 if self.expected is None else self.expected).hexdigest()
+            if digest != expected:
+                raise IntegrityError(f'{url}: {algorithm} mismatch (expected {expected}, got {digest})')
+
+        return self.sha256.hexdigest()
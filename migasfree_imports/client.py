@@ -1,19 +1,172 @@
+import asyncio
 import contextlib
+import functools
+import json
 import logging
 import os
-from typing import Any, Dict, List, Optional, Union
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterator,
+    Awaitable,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
 import requests
 import urllib3
 
-from .utils import print_inplace
+from .hedge import HedgePolicy
+from .progress import progress
+from .scheduler import scheduler, transfers
+from .trace import tracer
+
+if TYPE_CHECKING:
+    from .index import PackageIndex
+
+HEDGE_WORKERS = 32
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# error responses: HTTP error statuses and bodies that are not JSON
+RESPONSE_ERRORS = (requests.HTTPError, ValueError)
 
 urllib3.disable_warnings()
 
 logger = logging.getLogger(__name__)
 
 
-class MigasfreeImport:
+def parse_servers(value: str) -> List[Dict[str, Optional[str]]]:
+    """
+    Parse a comma separated list of servers, each one optionally with its own
+    credentials: `user:password@server`. Servers without credentials use
+    MIGASFREE_PACKAGER_USER and MIGASFREE_PACKAGER_PASSWORD.
+    """
+    servers = []
+    for item in filter(None, (item.strip() for item in value.split(','))):
+        credentials, _, server = item.rpartition('@')
+        username, _, password = credentials.partition(':')
+        servers.append({'server': server, 'username': username or None, 'password': password or None})
+
+    return servers
+
+
+class SingleFlight:
+    """
+    Collapses identical in-flight calls: while a call for a key is running,
+    other callers with the same key wait for it and share its result.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+
+    @staticmethod
+    def key(*parts: Any) -> str:
+        return json.dumps(parts, sort_keys=True, default=str)
+
+    def do(self, key: str, func: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._calls.get(key)
+            owner = future is None
+            if owner:
+                future = self._calls[key] = Future()
+
+        if owner:
+            try:
+                future.set_result(func())
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._calls[key]
+
+        return future.result()
+
+
+class AsyncSingleFlight:
+    """asyncio counterpart of `SingleFlight`: concurrent calls with the same key share one task."""
+
+    def __init__(self) -> None:
+        self._calls: Dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._calls.get(key)
+        if future is None:
+            future = self._calls[key] = asyncio.ensure_future(func())
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+
+        # a cancelled caller must not cancel the call shared with the others
+        return await asyncio.shield(future)
+
+
+class UploadBody:
+    """
+    Streaming multipart/form-data body of a package upload: form `fields` and
+    one `file`, read in chunks while they are sent so the upload bandwidth cap
+    paces the bytes themselves.
+
+    requests iterates the body, aiohttp its `async_chunks`. Send `headers`
+    with it: they carry the boundary and the length, so it is not chunked.
+    """
+
+    def __init__(
+        self, fields: Dict[str, Any], name: str, file: BinaryIO, content_type: str = 'application/octet-stream'
+    ) -> None:
+        self.boundary = uuid.uuid4().hex
+        self.file = file
+        self.size = os.fstat(file.fileno()).st_size
+
+        filename = os.path.basename(file.name).replace('"', '%22')
+        parts = [self._part(f'name="{key}"', f'\r\n{value}\r\n') for key, value in fields.items()]
+        parts.append(self._part(f'name="{name}"; filename="{filename}"', f'Content-Type: {content_type}\r\n\r\n'))
+        self.head = ''.join(parts).encode()
+        self.tail = f'\r\n--{self.boundary}--\r\n'.encode()
+
+    def _part(self, disposition: str, rest: str) -> str:
+        return f'--{self.boundary}\r\nContent-Disposition: form-data; {disposition}\r\n{rest}'
+
+    def __len__(self) -> int:
+        return len(self.head) + self.size + len(self.tail)
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {'Content-Type': f'multipart/form-data; boundary={self.boundary}', 'Content-Length': str(len(self))}
+
+    def _chunks(self) -> Iterator[bytes]:
+        yield self.head
+        self.file.seek(0)
+        yield from iter(functools.partial(self.file.read, UPLOAD_CHUNK_SIZE), b'')
+        yield self.tail
+
+    def __iter__(self) -> Iterator[bytes]:
+        for chunk in self._chunks():
+            scheduler.upload.consume(len(chunk))
+            yield chunk
+
+    async def async_chunks(self) -> AsyncIterator[bytes]:
+        for chunk in self._chunks():
+            await transfers.consume(scheduler.upload, len(chunk))
+            yield chunk
+
+
+class MigasfreeImportBase:
+    """
+    Server settings, credentials and response handling shared by the blocking
+    `MigasfreeImport` and the asyncio client: they only differ in how requests
+    are sent.
+    """
+
     MESSAGES = {
         '/api/v1/token/platforms/': 'New Platform: {response[name]} -> https://{self.server}/platforms/results/{response[id]}',
         '/api/v1/token/projects/': 'New Project: {response[name]} -> https://{self.server}/projects/results/{response[id]}',
@@ -23,10 +176,25 @@ class MigasfreeImport:
         '/api/v1/token/catalog/apps/': 'New Application: {response[name]} -> https://{self.server}/applications/results/{response[id]}',
     }
 
-    def __init__(self, server: Optional[str] = None, token: Optional[str] = None) -> None:
+    def __init__(
+        self,
+        server: Optional[str] = None,
+        token: Optional[str] = None,
+        index: Optional['PackageIndex'] = None,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        hedge: Optional[HedgePolicy] = None,
+    ) -> None:
+        self.index = index
+        self.hedge = hedge
+        self.username = username
+        self.password = password
         self.server = server or self.get_server()
-        self.token = token or self.get_token()
-        self.headers = {'Authorization': f'Token {self.token}'}
+        self.token = token
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {'Authorization': f'Token {self.token}'}
 
     def get_url(self, endpoint: str) -> str:
         return f'http://{self.server}{endpoint}'  # FIXME https
@@ -37,69 +205,260 @@ class MigasfreeImport:
             raise ValueError('MIGASFREE_CLIENT_SERVER environment variable not set.')
         return server
 
-    def get_token(self) -> str:
-        """Retrieve an authentication token from the server."""
-        api_url = self.get_url('/token-auth/')
-        username = os.getenv('MIGASFREE_PACKAGER_USER')
-        password = os.getenv('MIGASFREE_PACKAGER_PASSWORD')
+    def credentials(self) -> Dict[str, str]:
+        """Username and password to get a token: the client ones or those of the environment."""
+        username = self.username or os.getenv('MIGASFREE_PACKAGER_USER')
+        password = self.password or os.getenv('MIGASFREE_PACKAGER_PASSWORD')
 
         if not username or not password:
             raise ValueError(
                 'MIGASFREE_PACKAGER_USER and MIGASFREE_PACKAGER_PASSWORD environment variables must be set.'
             )
 
-        response = requests.post(api_url, json={'username': username, 'password': password}, verify=False)
-        if response.status_code == 200:
-            self.token = response.json().get('token')
-            self.headers = {'Authorization': f'Token {self.token}'}
+        return {'username': username, 'password': password}
+
+    def _accept_token(self, status: int, text: str, data: Callable[[], Dict[str, Any]]) -> str:
+        """Keep the token of a `/token-auth/` response (`data` decodes its body)."""
+        if status == 200:
+            self.token = data().get('token')
             return self.token
 
-        logger.error('Error: %s - %s.', response.status_code, response.text)
-        raise ConnectionError(f'Could not authenticate with server: {response.text}')
+        logger.error('Error: %s - %s.', status, text)
+        raise ConnectionError(f'Could not authenticate with server: {text}')
+
+    @staticmethod
+    def decode(url: str, status: int, body: Union[str, bytes]) -> Any:
+        """Decoded JSON body of a response ({} if empty). Raises `requests.HTTPError` for error statuses."""
+        if status >= 400:
+            raise requests.HTTPError(f'{status} Error for url: {url}')
+
+        return json.loads(body) if body else {}
+
+    @staticmethod
+    def _failed(error: Exception) -> Dict[str, Any]:
+        """Log a request that got an error response (one of `RESPONSE_ERRORS`): its result is empty."""
+        if isinstance(error, requests.HTTPError):
+            logger.error('HTTP error occurred: %s', error)
+        else:
+            logger.error('Other error occurred: %s', error)
+
+        return {}
+
+    def _log_created(self, endpoint: str, response: Dict[str, Any]) -> None:
+        if endpoint in self.MESSAGES:
+            with contextlib.suppress(Exception):
+                logger.info(self.MESSAGES[endpoint].format(response=response, self=self))
+
+    def _indexed_upload(
+        self, file_path: str, project_id: int, store_id: int
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[int]]:
+        """
+        Index entry of a package file and, if the package index knows the same
+        content is already uploaded to this server, project and store, the
+        server id of that package (to check with `_confirm_upload`).
+        """
+        entry = self.index.lookup(file_path) if self.index else None
+        package_id = self.index.uploaded(entry['sha256'], self.server, project_id, store_id) if entry else None
+        return entry, package_id
+
+    def _confirm_upload(
+        self,
+        file_path: str,
+        entry: Dict[str, Any],
+        project_id: int,
+        store_id: int,
+        package_id: int,
+        package: Optional[Dict[str, Any]],
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Response to use instead of uploading a package again if `package` (the
+        server answer for the indexed `package_id`, None for an error) shows it
+        is still there. Otherwise the stale upload is dropped from the index.
+        """
+        if package:
+            logger.debug('Skipping %s: already uploaded as package %s', file_path, package_id)
+            return {'id': package_id}
+
+        logger.info('Package %s is not on %s any more, uploading %s again', package_id, self.server, file_path)
+        self.index.forget_upload(entry['sha256'], self.server, project_id, store_id)
+        return None
+
+    def _record_upload(
+        self, entry: Optional[Dict[str, Any]], project_id: int, store_id: int, response: Dict[str, Any]
+    ) -> None:
+        if entry and response:
+            self.index.record_upload(entry['sha256'], self.server, project_id, store_id, response['id'])
+
+
+class MigasfreeImport(MigasfreeImportBase):
+    def __init__(
+        self,
+        server: Optional[str] = None,
+        token: Optional[str] = None,
+        index: Optional['PackageIndex'] = None,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        hedge: Optional[HedgePolicy] = None,
+        authenticate: bool = True,
+    ) -> None:
+        super().__init__(server, token, index, username, password, hedge)
+        self.single_flight = SingleFlight()
+        self._hedges = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix='hedge') if hedge else None
+        # without `authenticate`, the token is got by the first `login`
+        self.token = token or (self.get_token() if authenticate else None)
+
+    def get_token(self) -> str:
+        """Retrieve an authentication token from the server."""
+        response = requests.post(self.get_url('/token-auth/'), json=self.credentials(), verify=False)
+        return self._accept_token(response.status_code, response.text, response.json)
 
-    def _request(
+    def login(self) -> str:
+        """Return the authentication token, retrieving it if the client has none yet."""
+        return self.token or self.get_token()
+
+    def _send(self, **kwargs: Any) -> requests.Response:
+        """Send an HTTP request (the single point where the client touches the network)."""
+        return requests.request(**kwargs)
+
+    def _request(self, method: str, endpoint: str, **kwargs: Any) -> Dict[str, Any]:
+        """Helper method to make HTTP requests: `_call`, but error responses are logged and give {}."""
+        try:
+            return self._call(method, endpoint, **kwargs)
+        except RESPONSE_ERRORS as e:
+            return self._failed(e)
+
+    def _call(
         self,
         method: str,
         endpoint: str,
-        data: Optional[Dict[str, Any]] = None,
+        data: Optional[Union[Dict[str, Any], UploadBody]] = None,
         params: Optional[Dict[str, Any]] = None,
         files: Optional[Dict[str, Any]] = None,
-    ) -> Dict[str, Any]:
-        """Helper method to make HTTP requests."""
+        headers: Optional[Dict[str, str]] = None,
+        json: Optional[Dict[str, Any]] = None,
+    ) -> Any:
+        """
+        Send a request and return its decoded JSON body. Raises `requests.HTTPError` for error responses.
+
+        `data` is sent as a form (multipart with `files`), `json` as a JSON body.
+        """
         url = self.get_url(endpoint)
-        response = requests.request(
-            method=method, url=url, headers=self.headers, data=data, params=params, files=files, verify=False
+        with tracer.span(f'{method} {endpoint}', 'http', server=self.server) as span:
+            response = self._send(
+                method=method,
+                url=url,
+                headers={**self.headers, **(headers or {})},
+                data=data,
+                params=params,
+                files=files,
+                json=json,
+                verify=False,
+            )
+            span.update(status=response.status_code, bytes=len(response.content))
+
+        return self.decode(url, response.status_code, response.text)
+
+    def get(self, endpoint: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        GET request; identical concurrent requests share a single network call (and its result).
+
+        With a hedge policy, slow requests are hedged (see `_hedged_get`).
+        """
+        if self.hedge:
+            return self.single_flight.do(
+                SingleFlight.key('GET', endpoint, params), lambda: self._hedged_get(endpoint, params)
+            )
+
+        return self.single_flight.do(
+            SingleFlight.key('GET', endpoint, params), lambda: self._request('GET', endpoint, params=params)
         )
 
+    def _timed_get(self, endpoint: str, params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """GET that raises on error responses; only the latency of successful ones is learned."""
+        start = time.perf_counter()
+        response = self._call('GET', endpoint, params=params)
+        self.hedge.record(time.perf_counter() - start)
+        return response
+
+    def _hedged_get(self, endpoint: str, params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        GET that sends a duplicate request when there is no response within the
+        hedge delay (if the hedge budget allows it) and returns the first
+        successful response. The slower request is not waited for.
+
+        An error response does not win: the other request is waited for. If
+        both fail, the result is that of `_request`.
+        """
         try:
-            response.raise_for_status()
-            if response.text:
-                return response.json()
-        except requests.exceptions.HTTPError as http_err:
-            logger.error('HTTP error occurred: %s', http_err)
-        except Exception as err:
-            logger.error('Other error occurred: %s', err)
+            return self._first_get(endpoint, params)
+        except RESPONSE_ERRORS as e:
+            return self._failed(e)
 
-        return {}
+    def _first_get(self, endpoint: str, params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        delay = self.hedge.delay()
+        if delay is None:
+            return self._timed_get(endpoint, params)
 
-    def get(self, endpoint: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-        return self._request('GET', endpoint, params=params)
+        first = self._hedges.submit(self._timed_get, endpoint, params)
+        try:
+            return first.result(timeout=delay)
+        except FutureTimeoutError:
+            pass
 
-    def post(
-        self, endpoint: str, data: Optional[Dict[str, Any]] = None, files: Optional[Dict[str, Any]] = None
-    ) -> Dict[str, Any]:
-        response = self._request('POST', endpoint, data=data, files=files)
+        if not self.hedge.acquire():
+            return first.result()
 
-        if endpoint in self.MESSAGES:
-            with contextlib.suppress(Exception):
-                logger.info(self.MESSAGES[endpoint].format(response=response, self=self))
+        logger.debug('Hedging GET %s after %.3fs', endpoint, delay)
+        second = self._hedges.submit(self._timed_get, endpoint, params)
+        error: Optional[Exception] = None
+        for future in as_completed([first, second]):
+            try:
+                response = future.result()
+            except Exception as e:
+                error = e
+                continue
+
+            if future is second:
+                self.hedge.won()
+            return response
+
+        raise error
+
+    def get_all(self, endpoint: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Retrieve every element of a paginated list endpoint."""
+        elements: List[Dict[str, Any]] = []
+        page = 1
+
+        while True:
+            response = self.get(endpoint, params={**(params or {}), 'page': page})
+            if isinstance(response, list):
+                return response
 
+            elements.extend(response.get('results', []))
+            if not response.get('next'):
+                return elements
+
+            page += 1
+
+    def post(
+        self,
+        endpoint: str,
+        data: Optional[Union[Dict[str, Any], UploadBody]] = None,
+        files: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Dict[str, Any]:
+        response = self._request('POST', endpoint, data=data, files=files, headers=headers)
+        self._log_created(endpoint, response)
         return response
 
     def patch(
-        self, endpoint: str, data: Optional[Dict[str, Any]] = None, files: Optional[Dict[str, Any]] = None
+        self,
+        endpoint: str,
+        data: Optional[Dict[str, Any]] = None,
+        files: Optional[Dict[str, Any]] = None,
+        json: Optional[Dict[str, Any]] = None,
     ) -> Dict[str, Any]:
-        return self._request('PATCH', endpoint, data=data, files=files)
+        return self._request('PATCH', endpoint, data=data, files=files, json=json)
 
     def put(self, endpoint: str, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         return self._request('PUT', endpoint, data=data)
@@ -111,18 +470,51 @@ class MigasfreeImport:
         data: Optional[Dict[str, Any]] = None,
         files: Optional[Dict[str, Any]] = None,
     ) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
-        element = self.get(endpoint, params=params)
-        if element:
-            return element.get('results', element)
+        """
+        Return the elements matching `params`, creating one with `data` if there is none.
+
+        Concurrent calls with the same endpoint and params are collapsed, so
+        they do not create twin objects.
+        """
 
-        return [self.post(endpoint, data=data, files=files)]
+        def get_or_post() -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+            element = self.get(endpoint, params=params)
+            if element:
+                return element.get('results', element)
+
+            return [self.post(endpoint, data=data, files=files)]
+
+        return self.single_flight.do(SingleFlight.key('GET_OR_POST', endpoint, params), get_or_post)
 
     def upload_package(self, file_path: str, project_id: int, store_id: int) -> Dict[str, Any]:
-        """Upload a package file to the server."""
-        print_inplace(f'    Uploading {file_path}')
+        """
+        Upload a package file to the server.
+
+        If a package index is set, packages with the same content already uploaded
+        to this server, project and store are not uploaded again, as long as
+        the server still has them.
+        """
+        entry, package_id = self._indexed_upload(file_path, project_id, store_id)
+        if package_id is not None:
+            # the server may have deleted the package since it was uploaded
+            try:
+                package = self._call('GET', f'/api/v1/token/packages/{package_id}/')
+            except RESPONSE_ERRORS:
+                package = None
+            uploaded = self._confirm_upload(file_path, entry, project_id, store_id, package_id, package)
+            if uploaded:
+                return uploaded
+
+        progress.status(f'Uploading {file_path}')
         url = '/api/v1/token/packages/'
         form_data = {'project': project_id, 'store': store_id}
 
-        with open(file_path, 'rb') as file:
-            files = {'files': (os.path.basename(file_path), file, 'application/octet-stream')}
-            return self.post(url, data=form_data, files=files)
+        with tracer.span('upload', 'transfer', file=file_path, server=self.server) as span, open(
+            file_path, 'rb'
+        ) as file:
+            body = UploadBody(form_data, 'files', file)
+            span['bytes'] = body.size
+            response = self.post(url, data=body, headers=body.headers)
+
+        self._record_upload(entry, project_id, store_id, response)
+        return response
@@ -0,0 +1,81 @@
+import logging
+import math
+import threading
+from collections import deque
+from typing import Deque, List, Optional
+
+DEFAULT_PERCENTILE = 0.95
+DEFAULT_BUDGET = 0.05
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    if not values:
+        return 0.0
+    rank = max(math.ceil(fraction * len(values)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class HedgePolicy:
+    """
+    When to hedge an idempotent request, i.e. send a duplicate and use the
+    first response.
+
+    The hedge delay is the `percentile` of the latencies of the last `window`
+    requests (no hedging until `min_samples` were seen). Hedges are limited
+    to `budget` times the number of requests, so at most that fraction of
+    extra load is sent to the server.
+    """
+
+    def __init__(
+        self,
+        percentile: float = DEFAULT_PERCENTILE,
+        budget: float = DEFAULT_BUDGET,
+        min_samples: int = 20,
+        min_delay: float = 0.01,
+        window: int = 1000,
+    ) -> None:
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.requests = 0
+        self.hedges = 0
+        self.wins = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float) -> None:
+        """Record the latency of a request (hedges included)."""
+        with self._lock:
+            self.latencies.append(latency)
+
+    def delay(self) -> Optional[float]:
+        """Count a new request and return the seconds to wait before hedging it, None to not hedge it."""
+        with self._lock:
+            self.requests += 1
+            if len(self.latencies) < self.min_samples:
+                return None
+            latencies = sorted(self.latencies)
+
+        return max(percentile(latencies, self.percentile), self.min_delay)
+
+    def acquire(self) -> bool:
+        """Take a hedge from the budget, False if it is spent."""
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def won(self) -> None:
+        """Count a hedge that answered before the original request."""
+        with self._lock:
+            self.wins += 1
+
+    def log(self, server: str) -> None:
+        logger.info(
+            'Hedged requests to %s: %d of %d (%d answered first)', server, self.hedges, self.requests, self.wins
+        )
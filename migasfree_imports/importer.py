@@ -1,18 +1,34 @@
+import asyncio
 import base64
+import functools
 import io
 import json
 import logging
 import os
 import shutil
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
+from urllib.parse import unquote
 
-from .client import MigasfreeImport
-from .utils import download_packages, select_distro, select_project, slugify
+import requests
+
+from .checksums import Checksums, load_checksums, lookup
+from .client import AsyncSingleFlight, MigasfreeImport
+from .progress import progress
+from .scheduler import scheduler, transfers
+from .trace import tracer
+from .utils import download_verified, list_packages, package_directory, select_distro, select_project, slugify
+
+if TYPE_CHECKING:
+    from .aio import AsyncMigasfreeImport, AsyncPackageCache
+    from .index import PackageIndex
 
 GIT_REPO = 'https://github.com/migasfree/migasfree-imports'  # OFFICIAL (default selected)
 PACKAGES_PATH = './packages'
 TEMPLATE_FILE = os.path.join(os.path.dirname(__file__), '..', 'templates', 'template.json')
+THREAD_WORKERS = 32
 
 logger = logging.getLogger(__name__)
 
@@ -36,29 +52,223 @@ def decode_icon(data_uri: str) -> tuple:
     return f'icon.{ext}', io.BytesIO(raw), mime_type
 
 
-class MigasfreeImporter:
+def deployment_comment(
+    deployment: Dict[str, Any], distro_base: Dict[str, Any], project: Dict[str, Any], server: str
+) -> str:
+    if 'comment' in deployment:
+        variables = {
+            'server': server,
+            'project_name': project['name'],
+            'project_slug': slugify(project['name']),
+            'deployment_name': deployment['name'],
+            'deployment_slug': slugify(deployment['name']),
+        }
+        return deployment['comment'].format(**variables)
+
+    return f'Imported from {GIT_REPO}\nTemplate: {distro_base["name"]}'
+
+
+def external_deployment_data(
+    deployment: Dict[str, Any], project: Dict[str, Any], comment: str, start_date: str
+) -> Dict[str, Any]:
+    return {
+        'enabled': deployment['enabled'],
+        'name': deployment['name'],
+        'base_url': deployment['base_url'],
+        'comment': comment,
+        'start_date': start_date,
+        'source': 'E',
+        'options': deployment['options'],
+        'suite': deployment['suite'],
+        'components': deployment['components'],
+        'frozen': deployment['frozen'],
+        'expire': 1440,
+        'project': project['id'],
+        'included_attributes': deployment['included_attributes'],
+    }
+
+
+def internal_deployment_data(
+    deployment: Dict[str, Any], project: Dict[str, Any], available_packages: List[int], start_date: str
+) -> Dict[str, Any]:
+    return {
+        'enabled': deployment['enabled'],
+        'name': deployment['name'],
+        'comment': 'comment',
+        'start_date': start_date,
+        'source': 'I',
+        'project': project['id'],
+        'included_attributes': deployment['included_attributes'],
+        'packages_to_install': deployment['packages_to_install'],
+        'packages_to_remove': deployment['packages_to_remove'],
+        'available_packages': available_packages,
+    }
+
+
+def merge_available_packages(
+    existing: Dict[str, Any], stored: Dict[str, int], wanted: Set[int], prune: bool = False
+) -> Tuple[List[int], List[int]]:
     """
-    Handles the orchestration of importing configuration into a migasfree server.
+    Return the current `available_packages` of an existing deployment and the
+    updated list: `wanted` packages are added and, with `prune`, stored
+    packages that are not wanted any more are dropped.
+    """
+    current = [package['id'] if isinstance(package, dict) else package for package in existing['available_packages']]
+    if prune:
+        gone = set(stored.values()) - wanted
+        available_packages = [package_id for package_id in current if package_id not in gone]
+    else:
+        available_packages = list(current)
+    available_packages += sorted(wanted - set(available_packages))
+
+    return current, available_packages
+
+
+def application_data(application: Dict[str, Any], category: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'name': application['name'],
+        'level': application['level'],
+        'category': category['id'],
+        'score': application['score'],
+        'description': application['description'],
+        'available_for_attributes': application['available_for_attributes'],
+    }
+
+
+class PackageCache:
+    """
+    Repository listings and package downloads shared by several importers.
+
+    Each listing and each package is fetched once, even when requested
+    concurrently from several threads; later callers wait for the first one.
+    Downloads are verified against the checksums published in the listed
+    repositories, and the sha256 of each downloaded file is kept in `digests`.
+    """
+
+    def __init__(self, directory: str = PACKAGES_PATH) -> None:
+        self.directory = directory
+        self.checksums: Checksums = {}
+        self.digests: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._results: Dict[Tuple[Any, ...], Future] = {}
+
+    def _once(self, key: Tuple[Any, ...], func: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._results.get(key)
+            owner = future is None
+            if owner:
+                future = self._results[key] = Future()
+
+        if owner:
+            try:
+                future.set_result(func())
+            except Exception as e:
+                future.set_exception(e)
+
+        return future.result()
+
+    def list(self, url: str, keep_versions: int = 0, architectures: Optional[List[str]] = None) -> List[str]:
+        """Return the package URLs of a repository (see `list_packages`)."""
+
+        def crawl() -> List[str]:
+            metadata: List[str] = []
+            packages = list_packages(url, keep_versions, architectures, metadata=metadata)
+            checksums = load_checksums(metadata)
+            with self._lock:
+                self.checksums.update(checksums)
+            return packages
+
+        return self._once(('list', url, keep_versions, tuple(architectures or [])), crawl)
+
+    def fetch(self, url: str) -> Optional[str]:
+        """Return the local path of a package, downloading it the first time. None if the download failed."""
+
+        def download() -> Optional[str]:
+            progress.add_total('download', items=1)
+            directory = package_directory(self.directory, url)
+            os.makedirs(directory, exist_ok=True)
+            try:
+                file_path, sha256 = download_verified(url, directory, lookup(self.checksums, url))
+            except requests.RequestException as e:
+                logger.error('Error accessing the URL or downloading files: %s', e)
+                return None
+
+            with self._lock:
+                self.digests[os.path.abspath(file_path)] = sha256
+            return file_path
+
+        return self._once(('fetch', url), download)
+
+    def size(self, url: str) -> Optional[int]:
+        """Return the size of a package (HEAD request, once per URL), None if unknown."""
+
+        def head() -> Optional[int]:
+            try:
+                response = requests.head(url, allow_redirects=True)
+                response.raise_for_status()
+                return int(response.headers['Content-Length'])
+            except (requests.RequestException, KeyError, ValueError):
+                return None
+
+        return self._once(('size', url), head)
+
+    def clear(self) -> None:
+        """Remove the downloaded packages."""
+        with self._lock:
+            self._results.clear()
+            self.digests.clear()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def default_package_cache() -> 'AsyncPackageCache':
+    from .aio import AsyncPackageCache  # optional: only needed by the asyncio engine
+
+    return AsyncPackageCache()
+
+
+class AsyncMigasfreeImporter:
     """
+    Import engine: orchestrates the import of configuration into a migasfree
+    server from an event loop. It drives an `AsyncMigasfreeImport` and an
+    `AsyncPackageCache` (asyncio engine) or, through `MigasfreeImporter`, the
+    blocking client and package cache from worker threads (threads engine).
 
-    def __init__(self, client: MigasfreeImport, template: Optional[Dict[str, Any]] = None) -> None:
+    Deployments (and applications) are imported concurrently; an owned
+    package cache is cleared once all of them are done.
+    """
+
+    def __init__(
+        self,
+        client: Union['AsyncMigasfreeImport', 'ThreadedClient'],
+        template: Optional[Dict[str, Any]] = None,
+        packages: Optional[Union['AsyncPackageCache', 'ThreadedPackageCache']] = None,
+    ) -> None:
         self.client = client
         self.current_date = datetime.now().strftime('%Y-%m-%d')
         self.template = template or load_template()
+        # a shared cache is cleared by its owner once every importer is done
+        self._owns_packages = packages is None
+        self.packages = packages or default_package_cache()
+        self.report = {'deployments': 0, 'applications': 0, 'uploaded': 0}
 
-    def run(self) -> None:
+    async def run(self) -> None:
         """
         Executes the import process.
         """
-        # DISTRO_BASE
-        # ===========
         distro_base = select_distro(self.template['distros'])
 
-        # SELECT PROJECT
-        # ==============
-        projects = self.client.get('/api/v1/token/projects/')['results']
+        await self.client.login()
+        projects = (await self.client.get('/api/v1/token/projects/'))['results']
         project_name = select_project(projects)
 
+        await self.import_project(distro_base, project_name)
+
+    async def import_project(self, distro_base: Dict[str, Any], project_name: str) -> None:
+        """
+        Imports platform, project, stores, deployments and applications of a distro base.
+        """
+        await self.client.login()
+
         logger.info('Importing external deployments')
         logger.info('==============================')
         logger.info('  Server: %s', self.client.server)
@@ -66,154 +276,221 @@ class MigasfreeImporter:
         logger.info('  Distro Base: %s', distro_base['name'])
         print()
 
+        server = self.client.server
+
         # PLATFORM
-        payload = {'name': distro_base['platform']}
-        platform = self.client.get_or_post('/api/v1/token/platforms/', params=payload, data=payload)[0]
+        with tracer.span('platform', 'phase', server=server):
+            payload = {'name': distro_base['platform']}
+            platform = (await self.client.get_or_post('/api/v1/token/platforms/', params=payload, data=payload))[0]
 
         # PROJECT
         # =======
-        project = self.client.get_or_post(
-            '/api/v1/token/projects/',
-            params={'name': project_name},
-            data={
-                'name': project_name,
-                'pms': distro_base['pms'],
-                'architecture': distro_base['architecture'],
-                'auto_register_computers': True,
-                'platform': platform['id'],
-            },
-        )[0]
+        with tracer.span('project', 'phase', server=server):
+            project = (
+                await self.client.get_or_post(
+                    '/api/v1/token/projects/',
+                    params={'name': project_name},
+                    data={
+                        'name': project_name,
+                        'pms': distro_base['pms'],
+                        'architecture': distro_base['architecture'],
+                        'auto_register_computers': True,
+                        'platform': platform['id'],
+                    },
+                )
+            )[0]
 
         # STORES
         # ======
-        self.client.post('/api/v1/token/stores/', data={'name': 'org', 'project': project['id']})
-        self.client.post('/api/v1/token/stores/', data={'name': 'thirds', 'project': project['id']})
-        self.client.post('/api/v1/token/stores/', data={'name': 'updates', 'project': project['id']})
-
-        # DEPLOYMENTS
-        # ===========
-        self._import_deployments(distro_base, project)
-
-        # APPLICATIONS
-        # ============
-        self._import_applications(project)
+        with tracer.span('stores', 'phase', server=server):
+            await asyncio.gather(
+                *(
+                    self.client.post('/api/v1/token/stores/', data={'name': name, 'project': project['id']})
+                    for name in ('org', 'thirds', 'updates')
+                )
+            )
 
-    def _import_deployments(self, distro_base: Dict[str, Any], project: Dict[str, Any]) -> None:
+        try:
+            with progress:
+                # DEPLOYMENTS
+                # ===========
+                with tracer.span('deployments', 'phase', server=server):
+                    await self._import_deployments(distro_base, project)
+
+                # APPLICATIONS
+                # ============
+                with tracer.span('applications', 'phase', server=server):
+                    await self._import_applications(project)
+        finally:
+            if self._owns_packages:
+                self.packages.clear()
+                await self.packages.close()
+
+    async def _import_deployments(self, distro_base: Dict[str, Any], project: Dict[str, Any]) -> None:
         deployments = self.template['deployments'][distro_base['name']]
 
-        for deployment in deployments:
-            ignored = deployment.get('ignored', False)
+        async def import_deployment(deployment: Dict[str, Any]) -> None:
+            with tracer.span(deployment['name'], 'deployment', source=deployment['source'], server=self.client.server):
+                await self._process_deployment(deployment, distro_base, project)
+            self.report['deployments'] += 1
 
-            if not ignored:
-                self._process_deployment(deployment, distro_base, project)
+        await asyncio.gather(
+            *(import_deployment(deployment) for deployment in deployments if not deployment.get('ignored', False))
+        )
 
-    def _process_deployment(
+    async def _process_deployment(
         self, deployment: Dict[str, Any], distro_base: Dict[str, Any], project: Dict[str, Any]
     ) -> None:
-        if 'comment' in deployment:
-            variables = {
-                'server': self.client.server,
-                'project_name': project['name'],
-                'project_slug': slugify(project['name']),
-                'deployment_name': deployment['name'],
-                'deployment_slug': slugify(deployment['name']),
-            }
-            comment = deployment['comment'].format(**variables)
-        else:
-            comment = f'Imported from {GIT_REPO}\nTemplate: {distro_base["name"]}'
-
         if deployment['source'] == 'E':
-            self.client.post(
+            comment = deployment_comment(deployment, distro_base, project, self.client.server)
+            await self.client.post(
                 '/api/v1/token/deployments/',
-                data={
-                    'enabled': deployment['enabled'],
-                    'name': deployment['name'],
-                    'base_url': deployment['base_url'],
-                    'comment': comment,
-                    'start_date': self.current_date,
-                    'source': 'E',
-                    'options': deployment['options'],
-                    'suite': deployment['suite'],
-                    'components': deployment['components'],
-                    'frozen': deployment['frozen'],
-                    'expire': 1440,
-                    'project': project['id'],
-                    'included_attributes': deployment['included_attributes'],
-                },
+                data=external_deployment_data(deployment, project, comment, self.current_date),
             )
 
         elif deployment['source'] == 'I':
-            download_packages(deployment['url_download'], PACKAGES_PATH)
-
-            store = self.client.get_or_post(
-                '/api/v1/token/stores/',
-                params={'name': deployment['store'], 'project__id': project['id']},
-                data={'name': deployment['store'], 'project': project['id']},
+            store = (
+                await self.client.get_or_post(
+                    '/api/v1/token/stores/',
+                    params={'name': deployment['store'], 'project__id': project['id']},
+                    data={'name': deployment['store'], 'project': project['id']},
+                )
             )[0]
 
-            # Upload packages
-            # ===============
-            available_packages = []
-            for package in os.listdir(PACKAGES_PATH):
-                if os.path.isfile(os.path.join(PACKAGES_PATH, package)):
-                    response = self.client.upload_package(
-                        os.path.join(PACKAGES_PATH, package), project['id'], store['id']
-                    )
-                    if response:
-                        available_packages.append(response['id'])
-
-            shutil.rmtree(PACKAGES_PATH)
+            existing = await self.client.get(
+                '/api/v1/token/deployments/', params={'name': deployment['name'], 'project__id': project['id']}
+            )
+            if existing and existing.get('results'):
+                await self._sync_deployment(existing['results'][0], deployment, project, store)
+                return
+
+            urls = await self.packages.list(
+                deployment['url_download'],
+                keep_versions=deployment.get('keep_versions', 0),
+                architectures=deployment.get('architectures'),
+            )
+            file_paths = await self._fetch_packages(urls)
+            available_packages = await self._upload_packages(file_paths, project, store)
 
-            self.client.post(
+            await self.client.post(
                 '/api/v1/token/deployments/',
-                data={
-                    'enabled': deployment['enabled'],
-                    'name': deployment['name'],
-                    'comment': 'comment',
-                    'start_date': self.current_date,
-                    'source': 'I',
-                    'project': project['id'],
-                    'included_attributes': deployment['included_attributes'],
-                    'packages_to_install': deployment['packages_to_install'],
-                    'packages_to_remove': deployment['packages_to_remove'],
-                    'available_packages': available_packages,
-                },
+                data=internal_deployment_data(deployment, project, available_packages, self.current_date),
             )
 
-    def _import_applications(self, project: Dict[str, Any]) -> None:
-        applications: List[Dict[str, Any]] = self.template['applications']
+    async def _sync_deployment(
+        self,
+        existing: Dict[str, Any],
+        deployment: Dict[str, Any],
+        project: Dict[str, Any],
+        store: Dict[str, Any],
+    ) -> None:
+        """
+        Bring an existing internal deployment up to date with its repository.
+
+        Only packages missing from the store are downloaded and uploaded. If the
+        deployment sets `prune`, packages no longer in the repository are
+        dropped from `available_packages`.
+        """
+        listed, packages = await asyncio.gather(
+            self.packages.list(
+                deployment['url_download'],
+                keep_versions=deployment.get('keep_versions', 0),
+                architectures=deployment.get('architectures'),
+            ),
+            self.client.get_all(
+                '/api/v1/token/packages/', params={'project__id': project['id'], 'store__id': store['id']}
+            ),
+        )
+        upstream = {unquote(os.path.basename(url)): url for url in listed}
+        stored = {package['fullname']: package['id'] for package in packages}
+
+        wanted = {stored[name] for name in upstream if name in stored}
+
+        uploaded = []
+        missing = [url for name, url in upstream.items() if name not in stored]
+        if missing:
+            uploaded = await self._upload_packages(await self._fetch_packages(missing), project, store)
+            wanted.update(uploaded)
+
+        current, available_packages = merge_available_packages(
+            existing, stored, wanted, prune=deployment.get('prune', False)
+        )
+
+        logger.info(
+            'Deployment %s: %d package(s) uploaded, %d available (was %d)',
+            deployment['name'],
+            len(uploaded),
+            len(available_packages),
+            len(current),
+        )
+
+        if available_packages != current:
+            # as JSON: a form would send nothing for an empty list, leaving the old one on the server
+            await self.client.patch(
+                f'/api/v1/token/deployments/{existing["id"]}/', json={'available_packages': available_packages}
+            )
 
-        for application in applications:
-            # Category
+    async def _fetch_packages(self, urls: List[str]) -> List[str]:
+        """Download packages (once per cache), returning the local paths of the successful ones."""
+        # sizes only order the transfers that queue for a slot (looked up concurrently, a HEAD request each)
+        if len(urls) > scheduler.max_transfers > 1:
+            sizes = await asyncio.gather(*(self.packages.size(url) for url in urls))
+        else:
+            sizes = [None] * len(urls)
+
+        jobs = [(size, lambda url=url: self.packages.fetch(url)) for url, size in zip(urls, sizes)]
+        file_paths = [path for path in await transfers.run(jobs) if path]
+
+        if self.client.index and file_paths:
+            # scanning packages is CPU bound: keep it off the event loop
+            try:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, functools.partial(self.client.index.add, file_paths, digests=self.packages.digests)
+                )
+            except Exception as e:
+                # the index only saves work: the packages are uploaded all the same
+                logger.warning('Could not index the downloaded packages: %s', e)
+
+        return file_paths
+
+    async def _upload_packages(
+        self, file_paths: List[str], project: Dict[str, Any], store: Dict[str, Any]
+    ) -> List[int]:
+        """Upload package files to a store, returning the ids of the uploaded packages."""
+        sizes = [os.path.getsize(path) for path in file_paths]
+        progress.add_total('upload', items=len(file_paths), size=sum(sizes))
+
+        async def upload(file_path: str, size: int) -> Optional[int]:
+            async with transfers.slot():
+                response = await self.client.upload_package(file_path, project['id'], store['id'])
+            progress.advance('upload', items=1, size=size)
+            return response['id'] if response else None
+
+        jobs = [(size, lambda path=path, size=size: upload(path, size)) for path, size in zip(file_paths, sizes)]
+        package_ids = [package_id for package_id in await transfers.run(jobs) if package_id is not None]
+
+        self.report['uploaded'] += len(package_ids)
+        return package_ids
+
+    async def _import_applications(self, project: Dict[str, Any]) -> None:
+        async def import_application(application: Dict[str, Any]) -> None:
             payload = {'name': application['category']}
-            category = self.client.get_or_post('/api/v1/token/catalog/categories/', params=payload, data=payload)[0]
+            category = (
+                await self.client.get_or_post('/api/v1/token/catalog/categories/', params=payload, data=payload)
+            )[0]
 
-            # Decode icon from base64 data URI
             icon_filename, icon_file, icon_mime = decode_icon(application['icon'])
 
-            # Apps
-            app = self.client.get_or_post(
-                '/api/v1/token/catalog/apps/',
-                params={'name': application['name']},
-                data={
-                    'name': application['name'],
-                    'level': application['level'],
-                    'category': category['id'],
-                    'score': application['score'],
-                    'description': application['description'],
-                    'available_for_attributes': application['available_for_attributes'],
-                },
-                files={
-                    'icon': (
-                        icon_filename,
-                        icon_file,
-                        icon_mime,
-                    )
-                },
+            app = (
+                await self.client.get_or_post(
+                    '/api/v1/token/catalog/apps/',
+                    params={'name': application['name']},
+                    data=application_data(application, category),
+                    files={'icon': (icon_filename, icon_file, icon_mime)},
+                )
             )[0]
 
-            # Project-Packages
-            project_packages = self.client.get_or_post(
+            project_packages = await self.client.get_or_post(
                 '/api/v1/token/catalog/project-packages/',
                 params={'application__id': app['id'], 'project__id': project['id']},
                 data={
@@ -223,3 +500,269 @@ class MigasfreeImporter:
                 },
             )
             logger.info(project_packages)
+            self.report['applications'] += 1
+
+        await asyncio.gather(*(import_application(application) for application in self.template['applications']))
+
+
+class AsyncMultiServerImporter:
+    """
+    Imports the same template into several migasfree servers at once.
+
+    Repositories are crawled and packages downloaded once; each server has its
+    own client and importer, and they run concurrently on the same event loop.
+    """
+
+    def __init__(
+        self,
+        clients: List[Union['AsyncMigasfreeImport', 'ThreadedClient']],
+        template: Optional[Dict[str, Any]] = None,
+        packages: Optional[Union['AsyncPackageCache', 'ThreadedPackageCache']] = None,
+    ) -> None:
+        self.template = template or load_template()
+        self.packages = packages or default_package_cache()
+        self.importers = [AsyncMigasfreeImporter(client, self.template, packages=self.packages) for client in clients]
+        self.errors: Dict[str, Exception] = {}
+
+    async def run(self) -> None:
+        """
+        Executes the import process in every server and logs a report per server.
+        """
+        distro_base = select_distro(self.template['distros'])
+        project_name = await self._select_project()
+
+        try:
+            importers = [importer for importer in self.importers if importer.client.server not in self.errors]
+            with progress:
+                results = await asyncio.gather(
+                    *(importer.import_project(distro_base, project_name) for importer in importers),
+                    return_exceptions=True,
+                )
+            for importer, result in zip(importers, results):
+                if isinstance(result, Exception):
+                    self._failed(importer, result)
+        finally:
+            self.packages.clear()
+            await self.packages.close()
+
+        self.log_report()
+
+    async def _select_project(self) -> Optional[str]:
+        """
+        Select the project among those of the first server that answers, None if none does.
+        Servers that cannot be reached or reject the login are recorded in `errors`.
+        """
+        for importer in self.importers:
+            try:
+                await importer.client.login()
+                projects = (await importer.client.get('/api/v1/token/projects/'))['results']
+            except Exception as e:
+                self._failed(importer, e)
+                continue
+
+            return select_project(projects)
+
+        return None
+
+    def _failed(self, importer: AsyncMigasfreeImporter, error: Exception) -> None:
+        logger.error('Import into %s failed: %s', importer.client.server, error)
+        self.errors[importer.client.server] = error
+
+    def log_report(self) -> None:
+        logger.info('Import report')
+        logger.info('=============')
+        for importer in self.importers:
+            server = importer.client.server
+            status = f'FAILED ({self.errors[server]})' if server in self.errors else 'OK'
+            logger.info(
+                '  %s: %s - %d deployments, %d applications, %d packages uploaded',
+                server,
+                status,
+                importer.report['deployments'],
+                importer.report['applications'],
+                importer.report['uploaded'],
+            )
+
+
+def _in_thread(name: str) -> Callable[..., Awaitable[Any]]:
+    """Coroutine method calling the `name` method of the wrapped blocking object in a worker thread."""
+
+    async def method(self: Any, *args: Any, **kwargs: Any) -> Any:
+        func = functools.partial(getattr(self.wrapped, name), *args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(None, func)
+
+    method.__name__ = name
+    return method
+
+
+class ThreadedClient:
+    """
+    Coroutine interface of a blocking `MigasfreeImport`, so the import engine
+    drives it as an `AsyncMigasfreeImport`: each call runs in a worker thread.
+    """
+
+    def __init__(self, client: MigasfreeImport) -> None:
+        self.wrapped = client
+
+    @property
+    def server(self) -> str:
+        return self.wrapped.server
+
+    @property
+    def index(self) -> Optional['PackageIndex']:
+        return self.wrapped.index
+
+    login = _in_thread('login')
+    get = _in_thread('get')
+    get_all = _in_thread('get_all')
+    post = _in_thread('post')
+    patch = _in_thread('patch')
+    put = _in_thread('put')
+    get_or_post = _in_thread('get_or_post')
+    upload_package = _in_thread('upload_package')
+
+
+class ThreadedPackageCache:
+    """
+    Coroutine interface of a blocking `PackageCache` (or `BundlePackageCache`)
+    for the import engine: each call runs in a worker thread. Downloads wait
+    for a slot of `transfers` first, so they start largest first and do not
+    take worker threads while they wait.
+    """
+
+    def __init__(self, cache: PackageCache) -> None:
+        self.wrapped = cache
+        self.single_flight = AsyncSingleFlight()
+
+    @property
+    def directory(self) -> str:
+        return self.wrapped.directory
+
+    @property
+    def digests(self) -> Dict[str, str]:
+        return self.wrapped.digests
+
+    list = _in_thread('list')
+    size = _in_thread('size')
+    _fetch = _in_thread('fetch')
+
+    async def fetch(self, url: str) -> Optional[str]:
+        async def fetch() -> Optional[str]:
+            async with transfers.slot():
+                return await self._fetch(url)
+
+        return await self.single_flight.do(url, fetch)
+
+    def clear(self) -> None:
+        self.wrapped.clear()
+
+    async def close(self) -> None:
+        """Nothing to do: the wrapped cache is closed by its owner."""
+
+
+def run_in_threads(coroutine: Awaitable[Any]) -> Any:
+    """
+    Run a coroutine of the import engine on a new event loop, with enough
+    worker threads for the blocking calls of `ThreadedClient` and
+    `ThreadedPackageCache` (transfers hold at most `max_transfers` of them).
+    """
+
+    async def main() -> Any:
+        workers = THREAD_WORKERS + 2 * scheduler.max_transfers
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=workers))
+        return await coroutine
+
+    return asyncio.run(main())
+
+
+class MigasfreeImporter:
+    """
+    Handles the orchestration of importing configuration into a migasfree server.
+
+    Blocking interface of `AsyncMigasfreeImporter` for a requests based
+    `MigasfreeImport` and `PackageCache`, which are called from worker threads.
+    """
+
+    def __init__(
+        self,
+        client: MigasfreeImport,
+        template: Optional[Dict[str, Any]] = None,
+        packages: Optional[PackageCache] = None,
+    ) -> None:
+        self.client = client
+        # a shared cache is cleared by its owner once every importer is done
+        self._owns_packages = packages is None
+        self.packages = packages or PackageCache()
+        self.engine = AsyncMigasfreeImporter(ThreadedClient(client), template, ThreadedPackageCache(self.packages))
+
+    @property
+    def template(self) -> Dict[str, Any]:
+        return self.engine.template
+
+    @property
+    def current_date(self) -> str:
+        return self.engine.current_date
+
+    @property
+    def report(self) -> Dict[str, int]:
+        return self.engine.report
+
+    def run(self) -> None:
+        """
+        Executes the import process.
+        """
+        self._run(self.engine.run())
+
+    def import_project(self, distro_base: Dict[str, Any], project_name: str) -> None:
+        """
+        Imports platform, project, stores, deployments and applications of a distro base.
+        """
+        self._run(self.engine.import_project(distro_base, project_name))
+
+    def _run(self, coroutine: Awaitable[None]) -> None:
+        try:
+            run_in_threads(coroutine)
+        finally:
+            if self._owns_packages:
+                self.packages.clear()
+
+
+class MultiServerImporter:
+    """
+    Imports the same template into several migasfree servers at once.
+
+    Blocking interface of `AsyncMultiServerImporter` for requests based
+    clients and a `PackageCache` shared by every server.
+    """
+
+    def __init__(
+        self,
+        clients: List[MigasfreeImport],
+        template: Optional[Dict[str, Any]] = None,
+        packages: Optional[PackageCache] = None,
+    ) -> None:
+        self.packages = packages or PackageCache()
+        self.engine = AsyncMultiServerImporter(
+            [ThreadedClient(client) for client in clients], template, ThreadedPackageCache(self.packages)
+        )
+
+    @property
+    def template(self) -> Dict[str, Any]:
+        return self.engine.template
+
+    @property
+    def importers(self) -> List[AsyncMigasfreeImporter]:
+        return self.engine.importers
+
+    @property
+    def errors(self) -> Dict[str, Exception]:
+        return self.engine.errors
+
+    def run(self) -> None:
+        """
+        Executes the import process in every server and logs a report per server.
+        """
+        run_in_threads(self.engine.run())
+
+    def log_report(self) -> None:
+        self.engine.log_report()
@@ -0,0 +1,297 @@
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import sqlite3
+import struct
+import tarfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from .checksums import decompress
+from .packages import parse_package_filename
+from .utils import EXTENSIONS
+
+INDEX_FILE = './packages.db'
+
+RPM_LEAD_SIZE = 96
+RPM_HEADER_MAGIC = b'\x8e\xad\xe8\x01'
+RPM_TAG_NAME = 1000
+RPM_TAG_VERSION = 1001
+RPM_TAG_RELEASE = 1002
+RPM_TAG_EPOCH = 1003
+RPM_TAG_ARCH = 1022
+RPM_TYPE_INT32 = 4
+RPM_TYPE_STRING = 6
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS packages (
+    path TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    name TEXT,
+    version TEXT,
+    arch TEXT,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS packages_sha256 ON packages (sha256);
+CREATE INDEX IF NOT EXISTS packages_nva ON packages (name, version, arch);
+CREATE TABLE IF NOT EXISTS uploads (
+    sha256 TEXT NOT NULL,
+    server TEXT NOT NULL,
+    project INTEGER NOT NULL,
+    store INTEGER NOT NULL,
+    package_id INTEGER NOT NULL,
+    PRIMARY KEY (sha256, server, project, store)
+);
+"""
+
+
+def read_deb_control(file_path: str) -> Dict[str, str]:
+    """Read the control fields of a .deb package (an ar archive with a control tarball)."""
+    with open(file_path, 'rb') as file:
+        if file.read(8) != b'!<arch>\n':
+            raise ValueError(f'{file_path} is not a deb package')
+
+        while True:
+            header = file.read(60)
+            if len(header) < 60:
+                raise ValueError(f'{file_path} has no control member')
+
+            name = header[:16].decode().strip().rstrip('/')
+            size = int(header[48:58].decode().strip())
+            if name.startswith('control.tar'):
+                control_tar = decompress(name, file.read(size))
+                break
+
+            file.seek(size + size % 2, os.SEEK_CUR)
+
+    with tarfile.open(fileobj=io.BytesIO(control_tar)) as tar:
+        member = next(m for m in tar.getmembers() if m.name.lstrip('./') == 'control')
+        control = tar.extractfile(member).read().decode('utf-8', 'replace')
+
+    fields = {}
+    for line in control.splitlines():
+        if line and not line[0].isspace() and ':' in line:
+            key, value = line.split(':', 1)
+            fields[key.strip()] = value.strip()
+
+    return fields
+
+
+def _read_rpm_header(file: Any) -> Dict[int, Any]:
+    magic, _, count, data_size = struct.unpack('>4s4sII', file.read(16))
+    if magic[:3] != RPM_HEADER_MAGIC[:3]:
+        raise ValueError('bad rpm header magic')
+
+    entries = [struct.unpack('>IIII', file.read(16)) for _ in range(count)]
+    data = file.read(data_size)
+
+    tags = {}
+    for tag, tag_type, offset, _ in entries:
+        if tag_type == RPM_TYPE_STRING:
+            tags[tag] = data[offset : data.index(b'\0', offset)].decode('utf-8', 'replace')
+        elif tag_type == RPM_TYPE_INT32:
+            tags[tag] = struct.unpack('>I', data[offset : offset + 4])[0]
+
+    return tags
+
+
+def read_rpm_header(file_path: str) -> Dict[str, str]:
+    """Read name, version and architecture from the header of a .rpm package."""
+    with open(file_path, 'rb') as file:
+        if file.read(4) != b'\xed\xab\xee\xdb':
+            raise ValueError(f'{file_path} is not a rpm package')
+
+        file.seek(RPM_LEAD_SIZE)
+        _read_rpm_header(file)  # signature header, padded to 8 bytes
+        file.seek((file.tell() + 7) & ~7)
+        tags = _read_rpm_header(file)
+
+    version = f'{tags[RPM_TAG_VERSION]}-{tags[RPM_TAG_RELEASE]}'
+    if RPM_TAG_EPOCH in tags:
+        version = f'{tags[RPM_TAG_EPOCH]}:{version}'
+
+    return {'Package': tags[RPM_TAG_NAME], 'Version': version, 'Architecture': tags.get(RPM_TAG_ARCH, '')}
+
+
+def scan_package(file_path: str, sha256: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Collect the metadata of a package file: name, version, arch, size, mtime and sha256.
+
+    The file is only read whole to hash it if `sha256` is not given (e.g. it
+    was computed while downloading). Runs in worker processes, so it only
+    takes and returns picklable values.
+    """
+    stat = os.stat(file_path)
+    if sha256 is None:
+        sha256 = sha256_file(file_path)
+
+    try:
+        fields = read_rpm_header(file_path) if file_path.endswith('.rpm') else read_deb_control(file_path)
+        name, version, arch = fields.get('Package'), fields.get('Version'), fields.get('Architecture')
+    except Exception as e:
+        logger.debug('Could not read metadata of %s (%s), using its file name', file_path, e)
+        package = parse_package_filename(file_path)
+        name, version, arch = package[:3] if package else (None, None, None)
+
+    return {
+        'path': os.path.abspath(file_path),
+        'filename': os.path.basename(file_path),
+        'name': name,
+        'version': version,
+        'arch': arch,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'sha256': sha256,
+    }
+
+
+def sha256_file(file_path: str) -> str:
+    """Hex sha256 digest of a file, read in 1 MiB blocks."""
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class PackageIndex:
+    """
+    Local SQLite index of package metadata and of packages already uploaded to each server.
+    """
+
+    def __init__(self, path: str = INDEX_FILE, workers: Optional[int] = None) -> None:
+        self.path = path
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, self._connection:
+            self._connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _is_current(self, file_path: str, row: Any) -> bool:
+        if row is None:
+            return False
+        stat = os.stat(file_path)
+        return row['size'] == stat.st_size and row['mtime'] == stat.st_mtime
+
+    def _store(self, entries: List[Dict[str, Any]]) -> None:
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO packages (path, filename, name, version, arch, size, mtime, sha256) '
+                'VALUES (:path, :filename, :name, :version, :arch, :size, :mtime, :sha256)',
+                entries,
+            )
+
+    def get(self, file_path: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT * FROM packages WHERE path = ?', (os.path.abspath(file_path),)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def _scan(self, paths: List[str], digests: Dict[str, str]) -> None:
+        if len(paths) > 1:
+            # spawned workers: forking would copy the locks held by the progress, transfer and hedge threads
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as executor:
+                entries = list(executor.map(scan_package, paths, [digests.get(path) for path in paths], chunksize=4))
+        else:
+            entries = [scan_package(path, digests.get(path)) for path in paths]
+
+        self._store(entries)
+
+    def update(self, directory: str, digests: Optional[Dict[str, str]] = None) -> int:
+        """
+        Index the package files of a directory, reading only new or changed files
+        (by mtime and size) in a process pool. Returns the number of files scanned.
+
+        `digests` maps absolute paths to sha256 digests already known, so those
+        files are not hashed again.
+        """
+        prefix = os.path.join(os.path.abspath(directory), '')
+        with self._lock:
+            rows = {
+                row['path']: row
+                for row in self._connection.execute(
+                    'SELECT * FROM packages WHERE substr(path, 1, ?) = ?', (len(prefix), prefix)
+                )
+            }
+
+        paths = [
+            os.path.abspath(os.path.join(directory, name))
+            for name in os.listdir(directory)
+            if name.endswith(EXTENSIONS) and os.path.isfile(os.path.join(directory, name))
+        ]
+        pending = [path for path in paths if not self._is_current(path, rows.get(path))]
+        self._scan(pending, digests or {})
+
+        present = set(paths)
+        vanished = [(path,) for path in rows if path not in present]
+        if vanished:
+            with self._lock, self._connection:
+                self._connection.executemany('DELETE FROM packages WHERE path = ?', vanished)
+
+        logger.debug('Indexed %d of %d packages in %s', len(pending), len(paths), directory)
+        return len(pending)
+
+    def add(self, file_paths: List[str], digests: Optional[Dict[str, str]] = None) -> int:
+        """
+        Index some package files, like `update` but without listing (or
+        pruning) a whole directory. Returns the number of files scanned.
+        """
+        paths = [os.path.abspath(path) for path in file_paths]
+        pending = [path for path in paths if not self._is_current(path, self.get(path))]
+        self._scan(pending, digests or {})
+
+        logger.debug('Indexed %d of %d packages', len(pending), len(paths))
+        return len(pending)
+
+    def lookup(self, file_path: str) -> Dict[str, Any]:
+        """Return the metadata of a package file, scanning it if it is not indexed or has changed."""
+        entry = self.get(file_path)
+        if entry is None or not self._is_current(file_path, entry):
+            entry = scan_package(file_path)
+            self._store([entry])
+        return entry
+
+    def seen(self, name: str, version: str, arch: str) -> bool:
+        """Has a package with exactly this name, version and architecture been indexed?"""
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT 1 FROM packages WHERE name = ? AND version = ? AND arch = ?', (name, version, arch)
+            ).fetchone()
+        return row is not None
+
+    def uploaded(self, sha256: str, server: str, project: int, store: int) -> Optional[int]:
+        """Return the server id of a package already uploaded with the same content, if any."""
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT package_id FROM uploads WHERE sha256 = ? AND server = ? AND project = ? AND store = ?',
+                (sha256, server, project, store),
+            ).fetchone()
+        return row['package_id'] if row else None
+
+    def record_upload(self, sha256: str, server: str, project: int, store: int, package_id: int) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO uploads (sha256, server, project, store, package_id) VALUES (?, ?, ?, ?, ?)',
+                (sha256, server, project, store, package_id),
+            )
+
+    def forget_upload(self, sha256: str, server: str, project: int, store: int) -> None:
+        """Drop a recorded upload, e.g. because the server does not have the package any more."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                'DELETE FROM uploads WHERE sha256 = ? AND server = ? AND project = ? AND store = ?',
+                (sha256, server, project, store),
+            )
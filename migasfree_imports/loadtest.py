@@ -0,0 +1,205 @@
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import requests
+
+from .client import MigasfreeImport
+from .hedge import percentile
+
+PROJECT_PREFIX = 'loadtest'
+
+logger = logging.getLogger(__name__)
+
+
+def endpoint_key(method: str, url: str) -> str:
+    """Group requests by method and endpoint, replacing object ids (`/deployments/50/` -> `/deployments/{id}/`)."""
+    path = re.sub(r'^https?://[^/]+', '', url).split('?')[0]
+    return f'{method} {re.sub(r"/[0-9]+(?=/|$)", "/{id}", path)}'
+
+
+class LoadStats:
+    """Latencies and errors per endpoint, shared by every virtual importer."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+
+    def record(self, key: str, latency: float, error: bool) -> None:
+        with self._lock:
+            self.latencies.setdefault(key, []).append(latency)
+            if error:
+                self.errors[key] = self.errors.get(key, 0) + 1
+
+    def report(self) -> Dict[str, Any]:
+        duration = (self.finished or time.monotonic()) - self.started
+        endpoints = {}
+        with self._lock:
+            for key, latencies in sorted(self.latencies.items()):
+                values = sorted(latencies)
+                errors = self.errors.get(key, 0)
+                endpoints[key] = {
+                    'requests': len(values),
+                    'errors': errors,
+                    'error_rate': errors / len(values),
+                    'throughput': len(values) / duration if duration > 0 else 0.0,
+                    'p50': percentile(values, 0.50),
+                    'p90': percentile(values, 0.90),
+                    'p95': percentile(values, 0.95),
+                    'p99': percentile(values, 0.99),
+                    'max': values[-1],
+                }
+
+        return {'duration': duration, 'endpoints': endpoints}
+
+
+class TimedMigasfreeImport(MigasfreeImport):
+    """Client that records the latency and outcome of every request in a `LoadStats`."""
+
+    def __init__(self, stats: LoadStats, *args: Any, **kwargs: Any) -> None:
+        self.stats = stats
+        super().__init__(*args, **kwargs)
+
+    def _send(self, **kwargs: Any) -> requests.Response:
+        key = endpoint_key(kwargs['method'], kwargs['url'])
+        start = time.perf_counter()
+        try:
+            response = super()._send(**kwargs)
+        except requests.RequestException:
+            self.stats.record(key, time.perf_counter() - start, error=True)
+            raise
+
+        self.stats.record(key, time.perf_counter() - start, error=response.status_code >= 400)
+        return response
+
+
+class LoadTest:
+    """
+    Simulates `users` concurrent importers against a migasfree server.
+
+    Each virtual importer repeats the request pattern of `MigasfreeImporter`:
+    `get_or_post` lookups of platform, project and store, an optional package
+    upload and the creation of an internal deployment. Virtual importers are
+    started evenly over `ramp_up` seconds. Objects are created in a project
+    named `loadtest-<timestamp>`, so they are easy to remove afterwards.
+    """
+
+    def __init__(
+        self,
+        server: str,
+        users: int = 10,
+        iterations: int = 10,
+        ramp_up: float = 0.0,
+        package: Optional[str] = None,
+        token: Optional[str] = None,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+    ) -> None:
+        self.server = server
+        self.users = users
+        self.iterations = iterations
+        self.ramp_up = ramp_up
+        self.package = package
+        self.stats = LoadStats()
+        # authenticate once; every virtual importer reuses the token
+        self.token = token or MigasfreeImport(server=server, username=username, password=password).token
+        self.project_name = f'{PROJECT_PREFIX}-{datetime.now().strftime("%Y%m%d%H%M%S")}'
+
+    def _iteration(self, client: MigasfreeImport, user: int, iteration: int) -> None:
+        payload = {'name': 'Linux'}
+        platform = client.get_or_post('/api/v1/token/platforms/', params=payload, data=payload)[0]
+
+        client.get('/api/v1/token/projects/')
+        project = client.get_or_post(
+            '/api/v1/token/projects/',
+            params={'name': self.project_name},
+            data={
+                'name': self.project_name,
+                'pms': 'apt',
+                'architecture': 'amd64',
+                'auto_register_computers': False,
+                'platform': platform['id'],
+            },
+        )[0]
+
+        store = client.get_or_post(
+            '/api/v1/token/stores/',
+            params={'name': 'thirds', 'project__id': project['id']},
+            data={'name': 'thirds', 'project': project['id']},
+        )[0]
+
+        available_packages = []
+        if self.package:
+            response = client.upload_package(self.package, project['id'], store['id'])
+            if response:
+                available_packages.append(response['id'])
+
+        client.post(
+            '/api/v1/token/deployments/',
+            data={
+                'enabled': False,
+                'name': f'{PROJECT_PREFIX}-{user}-{iteration}',
+                'comment': 'load test',
+                'start_date': datetime.now().strftime('%Y-%m-%d'),
+                'source': 'I',
+                'project': project['id'],
+                'available_packages': available_packages,
+            },
+        )
+
+    def _user(self, user: int) -> None:
+        time.sleep(self.ramp_up * user / self.users)
+        client = TimedMigasfreeImport(self.stats, server=self.server, token=self.token)
+
+        for iteration in range(self.iterations):
+            try:
+                self._iteration(client, user, iteration)
+            except Exception as e:
+                logger.debug('Virtual importer %d, iteration %d failed: %s', user, iteration, e)
+
+    def run(self) -> Dict[str, Any]:
+        logger.info(
+            'Load test: %d virtual importers x %d iterations against %s (ramp-up %ss)',
+            self.users,
+            self.iterations,
+            self.server,
+            self.ramp_up,
+        )
+
+        self.stats.started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.users) as executor:
+            list(executor.map(self._user, range(self.users)))
+        self.stats.finished = time.monotonic()
+
+        report = self.stats.report()
+        report.update({'server': self.server, 'users': self.users, 'iterations': self.iterations})
+        return report
+
+
+def log_report(report: Dict[str, Any]) -> None:
+    logger.info('Load test report (%.1fs)', report['duration'])
+    logger.info('  %-45s %8s %7s %8s %8s %8s %8s', 'endpoint', 'requests', 'errors', 'p50', 'p95', 'p99', 'max')
+    for key, endpoint in report['endpoints'].items():
+        logger.info(
+            '  %-45s %8d %6.1f%% %7.0fms %7.0fms %7.0fms %7.0fms',
+            key,
+            endpoint['requests'],
+            endpoint['error_rate'] * 100,
+            endpoint['p50'] * 1000,
+            endpoint['p95'] * 1000,
+            endpoint['p99'] * 1000,
+            endpoint['max'] * 1000,
+        )
+
+
+def write_report(report: Dict[str, Any], path: str) -> None:
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=2)
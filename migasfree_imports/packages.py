@@ -0,0 +1,214 @@
+import os
+import re
+from functools import cmp_to_key
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from urllib.parse import unquote
+
+ARCH_INDEPENDENT = ('all', 'noarch')
+
+_DIGITS_OR_LETTERS = re.compile(r'(\d+|[a-zA-Z]+)')
+
+
+class PackageFile(NamedTuple):
+    name: str
+    version: str
+    arch: str
+    pms: str  # 'deb' or 'rpm'
+
+
+def parse_package_filename(file_name: str) -> Optional[PackageFile]:
+    """
+    Extract name, version and architecture from a package file name.
+
+    Debian packages follow `name_version_arch.deb` and RPM packages
+    `name-version-release.arch.rpm`. Returns None if the name does not match.
+    """
+    file_name = unquote(os.path.basename(file_name))
+
+    if file_name.endswith('.deb'):
+        parts = file_name[: -len('.deb')].split('_')
+        if len(parts) != 3 or not all(parts):
+            return None
+        name, version, arch = parts
+        return PackageFile(name, version, arch, 'deb')
+
+    if file_name.endswith('.rpm'):
+        stem, _, arch = file_name[: -len('.rpm')].rpartition('.')
+        parts = stem.rsplit('-', 2)
+        if not arch or len(parts) != 3 or not all(parts):
+            return None
+        name, version, release = parts
+        return PackageFile(name, f'{version}-{release}', arch, 'rpm')
+
+    return None
+
+
+def _split_epoch(version: str) -> Tuple[int, str]:
+    epoch, sep, rest = version.partition(':')
+    if sep and epoch.isdigit():
+        return int(epoch), rest
+    return 0, version
+
+
+def _dpkg_order(char: str) -> int:
+    if char == '~':
+        return -1
+    if char.isalpha():
+        return ord(char)
+    return ord(char) + 256
+
+
+def _dpkg_compare_part(a: str, b: str) -> int:
+    """dpkg `verrevcmp`: alternate non-digit and digit runs."""
+    i = j = 0
+    while i < len(a) or j < len(b):
+        first_diff = 0
+        while (i < len(a) and not a[i].isdigit()) or (j < len(b) and not b[j].isdigit()):
+            ac = _dpkg_order(a[i]) if i < len(a) and not a[i].isdigit() else 0
+            bc = _dpkg_order(b[j]) if j < len(b) and not b[j].isdigit() else 0
+            if ac != bc:
+                return ac - bc
+            i += 1
+            j += 1
+
+        while i < len(a) and a[i] == '0':
+            i += 1
+        while j < len(b) and b[j] == '0':
+            j += 1
+
+        while i < len(a) and a[i].isdigit() and j < len(b) and b[j].isdigit():
+            if not first_diff:
+                first_diff = ord(a[i]) - ord(b[j])
+            i += 1
+            j += 1
+
+        if i < len(a) and a[i].isdigit():
+            return 1
+        if j < len(b) and b[j].isdigit():
+            return -1
+        if first_diff:
+            return first_diff
+
+    return 0
+
+
+def compare_deb_versions(a: str, b: str) -> int:
+    """Compare two Debian versions following dpkg ordering rules."""
+    epoch_a, rest_a = _split_epoch(a)
+    epoch_b, rest_b = _split_epoch(b)
+    if epoch_a != epoch_b:
+        return epoch_a - epoch_b
+
+    upstream_a, _, revision_a = rest_a.rpartition('-') if '-' in rest_a else (rest_a, '', '')
+    upstream_b, _, revision_b = rest_b.rpartition('-') if '-' in rest_b else (rest_b, '', '')
+
+    return _dpkg_compare_part(upstream_a, upstream_b) or _dpkg_compare_part(revision_a, revision_b)
+
+
+def _rpmvercmp(a: str, b: str) -> int:
+    """rpm `rpmvercmp`: compare alphanumeric segments, ignoring separators."""
+    if a == b:
+        return 0
+
+    while a or b:
+        a = re.sub(r'^[^a-zA-Z0-9~^]+', '', a)
+        b = re.sub(r'^[^a-zA-Z0-9~^]+', '', b)
+
+        # tilde sorts before everything, even the end of the string
+        if a.startswith('~') or b.startswith('~'):
+            if not a.startswith('~'):
+                return 1
+            if not b.startswith('~'):
+                return -1
+            a, b = a[1:], b[1:]
+            continue
+
+        # caret sorts after the end of the string but before anything else
+        if a.startswith('^') or b.startswith('^'):
+            if not a:
+                return -1
+            if not b:
+                return 1
+            if not a.startswith('^'):
+                return 1
+            if not b.startswith('^'):
+                return -1
+            a, b = a[1:], b[1:]
+            continue
+
+        if not a or not b:
+            break
+
+        seg_a = _DIGITS_OR_LETTERS.match(a).group(0)
+        seg_b = _DIGITS_OR_LETTERS.match(b).group(0)
+        a, b = a[len(seg_a) :], b[len(seg_b) :]
+
+        if seg_a.isdigit() != seg_b.isdigit():
+            return 1 if seg_a.isdigit() else -1
+
+        if seg_a.isdigit():
+            seg_a, seg_b = seg_a.lstrip('0'), seg_b.lstrip('0')
+            if len(seg_a) != len(seg_b):
+                return 1 if len(seg_a) > len(seg_b) else -1
+
+        if seg_a != seg_b:
+            return 1 if seg_a > seg_b else -1
+
+    if not a and not b:
+        return 0
+
+    return 1 if a else -1
+
+
+def compare_rpm_versions(a: str, b: str) -> int:
+    """Compare two `[epoch:]version-release` strings following rpm ordering rules."""
+    epoch_a, rest_a = _split_epoch(a)
+    epoch_b, rest_b = _split_epoch(b)
+    if epoch_a != epoch_b:
+        return 1 if epoch_a > epoch_b else -1
+
+    version_a, _, release_a = rest_a.rpartition('-') if '-' in rest_a else (rest_a, '', '')
+    version_b, _, release_b = rest_b.rpartition('-') if '-' in rest_b else (rest_b, '', '')
+
+    return _rpmvercmp(version_a, version_b) or _rpmvercmp(release_a, release_b)
+
+
+def compare_versions(a: str, b: str, pms: str) -> int:
+    """Compare two versions using the rules of the given package format."""
+    if pms == 'rpm':
+        return compare_rpm_versions(a, b)
+    return compare_deb_versions(a, b)
+
+
+def select_latest(
+    urls: Iterable[str], keep_versions: int = 1, architectures: Optional[Iterable[str]] = None
+) -> List[str]:
+    """
+    Keep only the newest `keep_versions` versions of each package and
+    architecture, optionally restricted to `architectures`.
+
+    Architecture independent packages (`all`, `noarch`) always pass the
+    architecture filter. Files whose name cannot be parsed are kept.
+    Order of the input is preserved.
+    """
+    urls = list(urls)
+    allowed = set(architectures or [])
+    groups: Dict[Tuple[str, str, str], List[Tuple[str, str]]] = {}
+    selected = set()
+
+    for url in urls:
+        package = parse_package_filename(url)
+        if package is None:
+            selected.add(url)
+            continue
+
+        if allowed and package.arch not in allowed and package.arch not in ARCH_INDEPENDENT:
+            continue
+
+        groups.setdefault((package.pms, package.name, package.arch), []).append((package.version, url))
+
+    for (pms, _, _), versions in groups.items():
+        versions.sort(key=cmp_to_key(lambda x, y, pms=pms: compare_versions(x[0], y[0], pms)), reverse=True)
+        selected.update(url for _, url in versions[: max(keep_versions, 1)])
+
+    return [url for url in urls if url in selected]
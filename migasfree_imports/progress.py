@@ -0,0 +1,202 @@
+import logging
+import shutil
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, TextIO
+
+logger = logging.getLogger(__name__)
+
+
+def format_bytes(value: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(value) < 1024:
+            return f'{value:.1f} {unit}'
+        value /= 1024
+    return f'{value:.1f} TB'
+
+
+def format_seconds(value: Optional[float]) -> str:
+    if value is None:
+        return '--:--:--'
+    value = int(value)
+    return f'{value // 3600}:{value // 60 % 60:02d}:{value % 60:02d}'
+
+
+class Phase:
+    """Counters of a phase of the import (crawl, download, upload...)."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.items = 0
+        self.bytes = 0
+        self.total_items = 0
+        self.total_bytes = 0
+        self.sized = 0
+        self.started: Optional[float] = None
+
+    def elapsed(self, now: float) -> float:
+        return now - self.started if self.started is not None else 0.0
+
+    def rate(self, now: float) -> float:
+        elapsed = self.elapsed(now)
+        return self.bytes / elapsed if elapsed > 0 else 0.0
+
+    def eta(self, now: float) -> Optional[float]:
+        elapsed = self.elapsed(now)
+        if elapsed <= 0:
+            return None
+        # the byte total is only trusted once it covers every item (e.g. sizes of queued downloads are unknown)
+        if self.sized >= self.total_items and self.total_bytes > self.bytes and self.bytes:
+            return (self.total_bytes - self.bytes) / (self.bytes / elapsed)
+        if self.total_items > self.items and self.items:
+            return (self.total_items - self.items) / (self.items / elapsed)
+        return None
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        return {
+            'phase': self.name,
+            'items': self.items,
+            'total_items': self.total_items,
+            'bytes': self.bytes,
+            'total_bytes': self.total_bytes,
+            'rate': self.rate(now),
+            'eta': self.eta(now),
+        }
+
+
+class Progress:
+    """
+    Aggregates progress of concurrent downloads and uploads.
+
+    Updating counters only takes a lock; output is produced by a single
+    thread, redrawing a status line `interval` times per second on a TTY or
+    logging a structured line every `log_interval` seconds otherwise.
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None, interval: float = 0.2, log_interval: float = 30.0) -> None:
+        self.stream = stream
+        self.interval = interval
+        self.log_interval = log_interval
+        self.phases: Dict[str, Phase] = {}
+        self.message = ''
+        self._lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._depth = 0
+
+    @property
+    def is_tty(self) -> bool:
+        stream = self.stream or sys.stdout
+        return hasattr(stream, 'isatty') and stream.isatty()
+
+    def _phase(self, name: str) -> Phase:
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = Phase(name)
+        return phase
+
+    def add_total(self, phase: str, items: int = 0, size: int = 0, sized: Optional[int] = None) -> None:
+        """
+        Add to the totals of a phase. `sized` is the number of items whose
+        size is part of `size`: all of `items` if a size is given, by default.
+        """
+        with self._lock:
+            current = self._phase(phase)
+            current.total_items += items
+            current.total_bytes += size
+            current.sized += (items if size else 0) if sized is None else sized
+
+    def advance(self, phase: str, items: int = 0, size: int = 0) -> None:
+        with self._lock:
+            current = self._phase(phase)
+            if current.started is None:
+                current.started = time.monotonic()
+            current.items += items
+            current.bytes += size
+
+    def status(self, message: str) -> None:
+        """Set the label shown at the end of the status line (e.g. the current URL)."""
+        self.message = message
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return [phase.snapshot(now) for phase in self.phases.values()]
+
+    def render(self) -> str:
+        parts = []
+        for phase in self.snapshot():
+            items = f'{phase["items"]}/{phase["total_items"]}' if phase['total_items'] else str(phase['items'])
+            text = f'{phase["phase"]} {items}'
+            if phase['bytes']:
+                text += f' {format_bytes(phase["bytes"])} {format_bytes(phase["rate"])}/s'
+            if phase['eta'] is not None:
+                text += f' ETA {format_seconds(phase["eta"])}'
+            parts.append(text)
+
+        return ' | '.join(parts + ([self.message] if self.message else []))
+
+    def log(self) -> None:
+        for phase in self.snapshot():
+            logger.info(
+                'progress phase=%s items=%d/%d bytes=%d/%d rate=%.0f eta=%s',
+                phase['phase'],
+                phase['items'],
+                phase['total_items'],
+                phase['bytes'],
+                phase['total_bytes'],
+                phase['rate'],
+                format_seconds(phase['eta']),
+            )
+
+    def draw(self) -> None:
+        stream = self.stream or sys.stdout
+        columns = shutil.get_terminal_size().columns - 1
+        stream.write(f'\033[K{self.render()[:columns]}\r')
+        stream.flush()
+
+    def _run(self) -> None:
+        tty = self.is_tty
+        interval = self.interval if tty else self.log_interval
+        while not self._stop.wait(interval):
+            if tty:
+                self.draw()
+            else:
+                self.log()
+
+    def start(self) -> None:
+        """Start the render thread. Nested start/stop pairs are allowed; only the outermost one counts."""
+        with self._state_lock:
+            self._depth += 1
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='progress', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        with self._state_lock:
+            self._depth = max(self._depth - 1, 0)
+            if self._thread is None or self._depth:
+                return
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+        if self.is_tty:
+            self.draw()
+            (self.stream or sys.stdout).write('\n')
+        else:
+            self.log()
+
+    def __enter__(self) -> 'Progress':
+        self.start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.stop()
+
+
+progress = Progress()
@@ -0,0 +1,125 @@
+import asyncio
+import re
+import threading
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Sequence, Tuple
+
+DEFAULT_MAX_TRANSFERS = 4
+
+_UNITS = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3}
+
+
+def parse_rate(value: Optional[str]) -> float:
+    """
+    Parse a bandwidth in bytes per second: `500K`, `10M`, `1.5G` or a plain
+    number. Empty or zero means unlimited (0).
+    """
+    if not value:
+        return 0.0
+
+    match = re.fullmatch(r'\s*([0-9.]+)\s*([KMG]?)(?:i?B)?(?:/s)?\s*', value, re.IGNORECASE)
+    if not match:
+        raise ValueError(f'Invalid bandwidth: {value}')
+
+    return float(match.group(1)) * _UNITS[match.group(2).upper()]
+
+
+class TokenBucket:
+    """
+    Token bucket limiting throughput to `rate` bytes per second, allowing
+    bursts of up to `burst` bytes (one second worth by default). A rate of 0
+    means unlimited.
+    """
+
+    def __init__(self, rate: float = 0.0, burst: Optional[float] = None) -> None:
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: int) -> float:
+        """Take `amount` bytes from the bucket and return the seconds to wait before transferring them."""
+        if not self.rate or amount <= 0:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # go into debt, so amounts larger than the burst are possible too
+            self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def consume(self, amount: int) -> None:
+        """Block until `amount` bytes may be transferred."""
+        wait = self.reserve(amount)
+        if wait:
+            time.sleep(wait)
+
+
+class TransferScheduler:
+    """
+    Global limits for downloads and uploads: bandwidth caps (separate token
+    buckets for each direction) and the cap on concurrent transfers, which
+    `transfers` enforces. Batches run largest-first (see `order`), which keeps
+    big transfers from ending up last and minimizes the total run time.
+    """
+
+    def __init__(
+        self, max_transfers: int = DEFAULT_MAX_TRANSFERS, download_limit: float = 0.0, upload_limit: float = 0.0
+    ) -> None:
+        self.configure(max_transfers, download_limit, upload_limit)
+
+    def configure(
+        self, max_transfers: int = DEFAULT_MAX_TRANSFERS, download_limit: float = 0.0, upload_limit: float = 0.0
+    ) -> None:
+        self.max_transfers = max(max_transfers, 1)
+        self.download = TokenBucket(download_limit)
+        self.upload = TokenBucket(upload_limit)
+
+    @staticmethod
+    def order(jobs: Sequence[Tuple[Optional[int], Any]]) -> List[int]:
+        """Indexes of `(size, func)` jobs, largest first (unknown sizes last)."""
+        return sorted(range(len(jobs)), key=lambda i: -(jobs[i][0] or -1))
+
+
+scheduler = TransferScheduler()
+
+
+class AsyncTransferScheduler:
+    """
+    Enforces the `max_transfers` cap and bandwidth buckets of `scheduler`
+    from the running event loop, with a semaphore of that loop.
+    """
+
+    def __init__(self) -> None:
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def slot(self) -> asyncio.Semaphore:
+        """Semaphore holding one of the `max_transfers` transfer slots."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._slots = loop, asyncio.Semaphore(scheduler.max_transfers)
+        return self._slots
+
+    @staticmethod
+    async def consume(bucket: TokenBucket, amount: int) -> None:
+        """Wait until `amount` bytes may be transferred."""
+        wait = bucket.reserve(amount)
+        if wait:
+            await asyncio.sleep(wait)
+
+    async def run(self, jobs: Sequence[Tuple[Optional[int], Callable[[], Awaitable[Any]]]]) -> List[Any]:
+        """
+        Run `(size, coroutine function)` jobs concurrently, largest first
+        (unknown sizes last). Results are returned in the order of `jobs`.
+        """
+        order = scheduler.order(jobs)
+        # tasks start in this order, so they queue for the transfer slots in it too
+        results = await asyncio.gather(*(jobs[i][1]() for i in order))
+        return [result for _, result in sorted(zip(order, results), key=lambda item: item[0])]
+
+
+transfers = AsyncTransferScheduler()
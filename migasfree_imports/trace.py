@@ -0,0 +1,87 @@
+import asyncio
+import contextlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Tuple
+
+
+class Tracer:
+    """
+    Records spans as Chrome trace events (viewable in Perfetto or chrome://tracing).
+
+    Disabled by default: `span` then only costs a flag check.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._threads: Dict[int, str] = {}
+
+    def enable(self) -> None:
+        self.enabled = True
+        self._origin = time.perf_counter()
+
+    def _now(self) -> float:
+        return (time.perf_counter() - self._origin) * 1e6  # microseconds
+
+    @staticmethod
+    def _track() -> Tuple[int, str]:
+        """Timeline row of the caller: its asyncio task if any (they interleave in one thread), else its thread."""
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+
+        if task is not None:
+            return id(task), task.get_name()
+
+        thread = threading.current_thread()
+        return thread.ident, thread.name
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str = '', **args: Any) -> Iterator[Dict[str, Any]]:
+        """
+        Record the duration of the block. The yielded dict is stored as the
+        span arguments, so the block can add values known at the end (e.g. bytes).
+        """
+        if not self.enabled:
+            yield args
+            return
+
+        tid, track = self._track()
+        start = self._now()
+        try:
+            yield args
+        finally:
+            event = {
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': start,
+                'dur': self._now() - start,
+                'pid': os.getpid(),
+                'tid': tid,
+                'args': args,
+            }
+            with self._lock:
+                self.events.append(event)
+                self._threads[tid] = track
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            metadata = [
+                {'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}}
+                for tid, name in self._threads.items()
+            ]
+            return {'traceEvents': metadata + list(self.events), 'displayTimeUnit': 'ms'}
+
+    def write(self, path: str) -> None:
+        with open(path, 'w') as file:
+            json.dump(self.to_dict(), file, default=str)
+
+
+tracer = Tracer()
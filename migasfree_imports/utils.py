@@ -1,25 +1,29 @@
+import codecs
 import getpass
+import hashlib
 import logging
 import os
 import re
 import unicodedata
-from typing import Any, Dict, List, Optional, Set
-from urllib.parse import urljoin
+from html.parser import HTMLParser
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from urllib.parse import unquote, urljoin
 
 import requests
-from bs4 import BeautifulSoup
+
+from .checksums import IntegrityError, Verifier, is_checksum_file, load_checksums, lookup
+from .packages import select_latest
+from .progress import progress
+from .scheduler import scheduler
+from .trace import tracer
 
 EXTENSIONS = ('.deb', '.rpm')
+LISTING_CHUNK_SIZE = 64 * 1024
+DOWNLOAD_ATTEMPTS = 3
 
 logger = logging.getLogger(__name__)
 
 
-def print_inplace(*args: Any) -> None:
-    """Prints a message in-place on the terminal."""
-    print('\033[K', end='')
-    print(''.join(map(str, args)), end='\r', flush=True)
-
-
 def select_distro(distros: List[Dict[str, Any]]) -> Dict[str, Any]:
     distro_name = os.getenv('DISTRO_BASE') or select_option('Distro Base', [distro['name'] for distro in distros])
     selected_distro = next((distro for distro in distros if distro['name'] == distro_name), None)
@@ -77,10 +81,96 @@ def input_password(prompt: str) -> str:
             return value
 
 
-def download_packages(
-    url: str, destination_directory: str, repository_url: str = '', visited: Optional[Set[str]] = None
-) -> None:
-    """Recursively download packages from a repository."""
+class LinkExtractor(HTMLParser):
+    """Incremental `<a href>` extractor: it is fed chunks and collects hrefs without building a tree."""
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.hrefs: List[str] = []
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        if tag == 'a':
+            href = dict(attrs).get('href')
+            if href is not None:
+                self.hrefs.append(href)
+
+
+class CountingIterator:
+    """Iterate over byte chunks counting their total size."""
+
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        self.chunks = iter(chunks)
+        self.size = 0
+
+    def __iter__(self) -> Iterator[bytes]:
+        return self
+
+    def __next__(self) -> bytes:
+        chunk = next(self.chunks)
+        self.size += len(chunk)
+        return chunk
+
+
+class ListingParser:
+    """
+    Incremental parser of a directory listing: `feed` it byte chunks as they
+    arrive and it returns `(href, absolute_url)` of each new link that is not
+    a query, anchor or parent directory link and stays inside `repository_url`.
+    """
+
+    def __init__(self, base_url: str, repository_url: str, encoding: Optional[str] = None) -> None:
+        self.base_url = base_url
+        self.repository_url = repository_url
+        self._decoder = codecs.getincrementaldecoder(encoding or 'utf-8')('replace')
+        self._parser = LinkExtractor()
+
+    def _drain(self) -> List[Tuple[str, str]]:
+        links = []
+        for href in self._parser.hrefs:
+            if '?' in href or href.startswith('#') or href.lower() == 'parent directory':
+                continue
+
+            resource_url = urljoin(self.base_url + '/', href)
+            if resource_url.startswith(self.repository_url):
+                links.append((href, resource_url))
+
+        self._parser.hrefs.clear()
+        return links
+
+    def feed(self, chunk: bytes) -> List[Tuple[str, str]]:
+        self._parser.feed(self._decoder.decode(chunk))
+        return self._drain()
+
+    def close(self) -> List[Tuple[str, str]]:
+        self._parser.feed(self._decoder.decode(b'', final=True))
+        self._parser.close()
+        return self._drain()
+
+
+def iter_links(
+    chunks: Iterable[bytes], base_url: str, repository_url: str, encoding: Optional[str] = None
+) -> Iterator[Tuple[str, str]]:
+    """
+    Parse a directory listing while it arrives, yielding `(href, absolute_url)`
+    of each link that is not a query, anchor or parent directory link and
+    stays inside `repository_url`.
+    """
+    parser = ListingParser(base_url, repository_url, encoding)
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+
+    yield from parser.close()
+
+
+def find_packages(
+    url: str, repository_url: str = '', visited: Optional[Set[str]] = None, metadata: Optional[List[str]] = None
+) -> List[str]:
+    """
+    Recursively collect package URLs from a repository directory listing.
+
+    If `metadata` is given, the URLs of checksum files found on the way
+    (repository metadata, `SHA256SUMS`, sidecar files) are appended to it.
+    """
     if not repository_url:
         repository_url = url
 
@@ -89,45 +179,210 @@ def download_packages(
 
     normalized_url = url.rstrip('/')
     if normalized_url in visited:
-        return
+        return []
     visited.add(normalized_url)
 
-    os.makedirs(destination_directory, exist_ok=True)
+    packages = []
+    directories = []
+    try:
+        progress.status(f'Accessing: {normalized_url}')
+        with tracer.span('crawl', 'transfer', url=normalized_url) as span, requests.get(
+            normalized_url, stream=True
+        ) as response:
+            response.raise_for_status()
+            chunks = CountingIterator(response.iter_content(chunk_size=LISTING_CHUNK_SIZE))
+
+            for href, resource_url in iter_links(chunks, normalized_url, repository_url, response.encoding):
+                if any(href.endswith(ext) for ext in EXTENSIONS):
+                    packages.append(resource_url)
+                elif href.endswith('/'):
+                    directories.append(resource_url)
+                elif metadata is not None and is_checksum_file(href):
+                    metadata.append(resource_url)
+
+            span['bytes'] = chunks.size
+        progress.advance('crawl', items=1)
+
+        # subdirectories are crawled once this listing is closed
+        for directory in directories:
+            packages.extend(find_packages(directory, repository_url, visited, metadata))
+
+    except requests.RequestException as e:
+        logger.error('Error accessing the URL or downloading files: %s', e)
 
+    return packages
+
+
+def package_directory(directory: str, url: str) -> str:
+    """
+    Directory of `directory` where the package at `url` is stored: each URL
+    gets its own, so packages with the same file name in several
+    repositories (or folders of one) do not overwrite each other.
+    """
+    return os.path.join(directory, hashlib.sha256(url.encode()).hexdigest()[:16])
+
+
+def download_package(url: str, destination_directory: str, checksum: Optional[Tuple[str, str]] = None) -> str:
+    """Download a single package file and return its local path (see `download_verified`)."""
+    return download_verified(url, destination_directory, checksum)[0]
+
+
+class VerifiedDownload:
+    """
+    Bookkeeping of the attempts to download one package, shared by the
+    blocking and asyncio package caches: each attempt is hashed while it is
+    written, the expected size counts in the progress once, the bytes of a
+    rejected attempt are undone and a rejected download is tried again up to
+    `DOWNLOAD_ATTEMPTS` times.
+    """
+
+    def __init__(self, url: str, file_path: str, checksum: Optional[Tuple[str, str]] = None) -> None:
+        self.url = url
+        self.file_path = file_path
+        self.checksum = checksum
+        self.attempt = 0
+        self.verifier = Verifier(checksum)
+
+    def start(self) -> None:
+        """Start an attempt, before its request is sent."""
+        self.attempt += 1
+        self.verifier = Verifier(self.checksum)
+        progress.status(f'Downloading {self.url}')
+
+    def size(self, size: Optional[int]) -> None:
+        """Count the size of the response (None or 0 if unknown) in the progress totals, on the first attempt."""
+        if self.attempt == 1:
+            progress.add_total('download', size=size or 0, sized=1 if size else 0)
+
+    def write(self, file: Any, chunk: bytes) -> None:
+        file.write(chunk)
+        self.verifier.update(chunk)
+        progress.advance('download', size=len(chunk))
+
+    def finish(self, expected_size: Optional[int]) -> Optional[str]:
+        """
+        Return the sha256 of the attempt, or None if it was rejected and the
+        package has to be downloaded again. After the last attempt the file is
+        removed and `IntegrityError` is raised.
+        """
+        try:
+            sha256 = self.verifier.verify(self.url, expected_size)
+        except IntegrityError as e:
+            # the bytes of a rejected download do not count: it is downloaded again or given up
+            progress.advance('download', size=-self.verifier.size)
+            if self.attempt >= DOWNLOAD_ATTEMPTS:
+                os.remove(self.file_path)
+                raise
+            logger.warning('%s, downloading it again', e)
+            return None
+
+        progress.advance('download', items=1)
+        return sha256
+
+
+def download_verified(
+    url: str, destination_directory: str, checksum: Optional[Tuple[str, str]] = None
+) -> Tuple[str, str]:
+    """
+    Download a single package file, hashing it while it is written, and
+    return its local path and sha256.
+
+    A truncated download or one that does not match `checksum`
+    (`(algorithm, hex digest)`) is downloaded again, up to
+    `DOWNLOAD_ATTEMPTS` times; then `IntegrityError` is raised.
+    """
+    download = VerifiedDownload(url, os.path.join(destination_directory, unquote(os.path.basename(url))), checksum)
+    while True:
+        sha256 = _download(download)
+        if sha256:
+            return download.file_path, sha256
+
+
+def _download(download: VerifiedDownload) -> Optional[str]:
+    """One download attempt (see `VerifiedDownload.finish`)."""
+    download.start()
+    with tracer.span('download', 'transfer', url=download.url) as span, requests.get(
+        download.url, stream=True
+    ) as file_response:
+        file_response.raise_for_status()
+        download.size(int(file_response.headers.get('Content-Length') or 0))
+        with open(download.file_path, 'wb') as file:
+            for chunk in file_response.iter_content(chunk_size=8192):
+                scheduler.download.consume(len(chunk))
+                download.write(file, chunk)
+        span['bytes'] = download.verifier.size
+
+    return download.finish(content_length(file_response.headers))
+
+
+def content_length(headers: Any) -> Optional[int]:
+    """Expected size of a response body, None if unknown or the body is encoded (e.g. gzip)."""
+    if headers.get('Content-Encoding', 'identity') != 'identity':
+        return None
     try:
-        print_inplace(f'    Accessing: {normalized_url}')
-        response = requests.get(normalized_url)
-        response.raise_for_status()
+        return int(headers['Content-Length'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def list_packages(
+    url: str,
+    keep_versions: int = 0,
+    architectures: Optional[List[str]] = None,
+    repository_url: str = '',
+    visited: Optional[Set[str]] = None,
+    metadata: Optional[List[str]] = None,
+) -> List[str]:
+    """
+    Return the package URLs of a repository.
 
-        soup = BeautifulSoup(response.text, 'html.parser')
-        for link in soup.find_all('a', href=True):
-            href = link['href']
+    If `keep_versions` is set, only the newest `keep_versions` versions of each
+    package and architecture are returned. `architectures` restricts the
+    result to those architectures (plus architecture independent packages).
+    Checksum files are collected in `metadata` (see `find_packages`).
+    """
+    packages = find_packages(url, repository_url, visited, metadata)
+    return select_packages(url, packages, keep_versions, architectures)
 
-            if '?' in href or href.startswith('#') or href.lower() == 'parent directory':
-                continue
 
-            resource_url = urljoin(normalized_url + '/', href)
+def select_packages(
+    url: str, packages: List[str], keep_versions: int = 0, architectures: Optional[List[str]] = None
+) -> List[str]:
+    """Apply the `keep_versions` and `architectures` selection of `list_packages` to the packages of `url`."""
+    if keep_versions or architectures:
+        selected = select_latest(packages, keep_versions or len(packages), architectures)
+        logger.debug('Selected %d of %d packages from %s', len(selected), len(packages), url)
+        packages = selected
 
-            if not resource_url.startswith(repository_url):
-                continue
+    return packages
 
-            if any(href.endswith(ext) for ext in EXTENSIONS):
-                file_name = os.path.basename(href)
-                file_path = os.path.join(destination_directory, file_name)
 
-                print_inplace(f'    Downloading {resource_url}...')
-                with requests.get(resource_url, stream=True) as file_response:
-                    file_response.raise_for_status()
-                    with open(file_path, 'wb') as file:
-                        for chunk in file_response.iter_content(chunk_size=8192):
-                            file.write(chunk)
-                print_inplace(f'    Saved to {file_path}')
+def download_packages(
+    url: str,
+    destination_directory: str,
+    repository_url: str = '',
+    visited: Optional[Set[str]] = None,
+    keep_versions: int = 0,
+    architectures: Optional[List[str]] = None,
+) -> None:
+    """
+    Recursively download packages from a repository, verified against the
+    checksums published in the repository, if any.
+
+    `keep_versions` and `architectures` restrict the packages downloaded (see `list_packages`).
+    """
+    os.makedirs(destination_directory, exist_ok=True)
 
-            elif href.endswith('/'):
-                download_packages(resource_url, destination_directory, repository_url, visited)
+    metadata: List[str] = []
+    packages = list_packages(url, keep_versions, architectures, repository_url, visited, metadata)
+    checksums = load_checksums(metadata)
+    progress.add_total('download', items=len(packages))
 
-    except requests.RequestException as e:
-        logger.error('Error accessing the URL or downloading files: %s', e)
+    for package_url in packages:
+        try:
+            download_package(package_url, destination_directory, lookup(checksums, package_url))
+        except requests.RequestException as e:
+            logger.error('Error accessing the URL or downloading files: %s', e)
 
 
 # Copied from django.utils.text.slugify
@@ -0,0 +1,428 @@
+import asyncio
+import base64
+import hashlib
+import os
+from unittest.mock import MagicMock
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+
+from aiohttp import web  # noqa: E402
+from aiohttp.test_utils import TestServer  # noqa: E402
+
+from migasfree_imports import utils  # noqa: E402
+from migasfree_imports.aio import AsyncMigasfreeImport, AsyncPackageCache, form_fields  # noqa: E402
+from migasfree_imports.bundle import BundlePackageCache, export_bundle  # noqa: E402
+from migasfree_imports.hedge import HedgePolicy  # noqa: E402
+from migasfree_imports.importer import AsyncMigasfreeImporter, ThreadedPackageCache  # noqa: E402
+from migasfree_imports.utils import DOWNLOAD_ATTEMPTS, package_directory  # noqa: E402
+
+REPOSITORY = {
+    'pool/': {
+        'foo_1.0_all.deb': b'foo 1',
+        'foo_2.0_all.deb': b'foo 2',
+        'bar_1.0_amd64.deb': b'bar 1',
+    },
+}
+
+
+class FakeMigasfree:
+    """
+    Minimal migasfree API (list, filter, create and patch any endpoint) plus a
+    package repository. Like `get_or_post` expects, empty lookups return an empty list.
+    """
+
+    def __init__(self) -> None:
+        self.objects = {}
+        self.requests = []
+        self.next_id = 1
+        self.stalls = {}  # path -> seconds the next GET of it stalls
+        self.failures = set()
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/token-auth/', self.token)
+        app.router.add_route('*', '/api/v1/token/{endpoint:.*}', self.api)
+        app.router.add_get('/repo{path:.*}', self.repo)
+        return app
+
+    def count(self, method, path):
+        return self.requests.count((method, path))
+
+    def create(self, endpoint, **fields):
+        element = {'id': self.next_id, **fields}
+        self.next_id += 1
+        self.objects.setdefault(endpoint, []).append(element)
+        return element
+
+    async def token(self, request):
+        data = await request.json()
+        if data['password'] != 'secret':
+            return web.Response(status=400, text='bad credentials')
+        return web.json_response({'token': 'tok'})
+
+    async def api(self, request):
+        self.requests.append((request.method, request.path))
+        assert request.headers['Authorization'] == 'Token tok'
+        endpoint, _, element_id = request.match_info['endpoint'].rstrip('/').rpartition('/')
+        if not element_id.isdigit():
+            endpoint, element_id = f'{endpoint}/{element_id}'.lstrip('/'), ''
+
+        if request.method == 'GET':
+            results = [
+                element
+                for element in self.objects.get(endpoint, [])
+                if all(
+                    str(element.get(key.split('__')[0])) == value
+                    for key, value in request.query.items()
+                    if key != 'page'
+                )
+            ]
+            await asyncio.sleep(self.stalls.pop(request.path, 0.01))  # keep concurrent requests in flight together
+            if request.path in self.failures:
+                self.failures.remove(request.path)
+                return web.Response(status=503, text='overloaded')
+            if not results:
+                return web.json_response([])
+            return web.json_response({'count': len(results), 'next': None, 'results': results})
+
+        if request.content_type == 'application/json':
+            fields = await request.json()
+            form = {}
+        else:
+            form = await request.post()
+            fields = {}
+        for key in form:
+            values = form.getall(key)
+            if hasattr(values[0], 'filename'):
+                fields['fullname'] = values[0].filename
+            else:
+                fields[key] = values if len(values) > 1 or key == 'available_packages' else values[0]
+
+        if request.method == 'PATCH':
+            element = next(element for element in self.objects[endpoint] if str(element['id']) == element_id)
+            element.update(fields)
+            return web.json_response(element)
+
+        return web.json_response(self.create(endpoint, **fields))
+
+    async def repo(self, request):
+        self.requests.append((request.method, request.path))
+        node = REPOSITORY
+        for part in filter(None, request.match_info['path'].split('/')):
+            node = node.get(part) or node[f'{part}/']
+
+        if isinstance(node, bytes):
+            return web.Response(body=node)
+
+        links = ['<a href="../">Parent Directory</a>'] + [f'<a href="{name}">{name}</a>' for name in node]
+        return web.Response(text=f'<html><body>{"".join(links)}</body></html>', content_type='text/html')
+
+
+def serve(fake, test):
+    """Run `test(address)` against the fake server in a new event loop."""
+
+    async def main():
+        async with TestServer(fake.app()) as server:
+            return await test(f'127.0.0.1:{server.port}')
+
+    return asyncio.run(main())
+
+
+def client(address, **kwargs):
+    return AsyncMigasfreeImport(server=address, username='admin', password='secret', **kwargs)
+
+
+def test_form_fields():
+    assert form_fields({'a': [1, 2], 'b': None, 'c': True, 'd': 'x'}) == [
+        ('a', '1'),
+        ('a', '2'),
+        ('c', 'True'),
+        ('d', 'x'),
+    ]
+    assert form_fields(None) == []
+
+
+def test_get_token_bad_credentials():
+    async def test(address):
+        with pytest.raises(ConnectionError, match='bad credentials'):
+            async with AsyncMigasfreeImport(server=address, username='admin', password='wrong'):
+                pass
+
+    serve(FakeMigasfree(), test)
+
+
+def test_get_or_post_collapses_concurrent_calls():
+    fake = FakeMigasfree()
+
+    async def test(address):
+        async with client(address) as api:
+            payload = {'name': 'Linux'}
+            return await asyncio.gather(
+                *(api.get_or_post('/api/v1/token/platforms/', params=payload, data=payload) for _ in range(5))
+            )
+
+    results = serve(fake, test)
+
+    assert all(result == [{'id': 1, 'name': 'Linux'}] for result in results)
+    assert fake.count('GET', '/api/v1/token/platforms/') == 1
+    assert fake.count('POST', '/api/v1/token/platforms/') == 1
+
+
+def test_get_hedges_stalled_request():
+    fake = FakeMigasfree()
+    fake.create('projects', name='production')
+    fake.stalls['/api/v1/token/projects/'] = 2.0
+    policy = HedgePolicy(budget=1.0, min_samples=1)
+    policy.record(0.05)
+
+    async def test(address):
+        async with client(address, hedge=policy) as api:
+            start = asyncio.get_running_loop().time()
+            response = await api.get('/api/v1/token/projects/')
+            return response, asyncio.get_running_loop().time() - start
+
+    response, elapsed = serve(fake, test)
+
+    assert response['results'] == [{'id': 1, 'name': 'production'}]
+    assert elapsed < 1.0
+    assert fake.count('GET', '/api/v1/token/projects/') == 2
+    assert (policy.hedges, policy.wins) == (1, 1)
+    # the cancelled original is not learned
+    assert len(policy.latencies) == 2
+
+
+def test_get_hedge_error_does_not_win():
+    fake = FakeMigasfree()
+    fake.create('projects', name='production')
+    fake.stalls['/api/v1/token/projects/'] = 0.3
+    fake.failures.add('/api/v1/token/projects/')
+    policy = HedgePolicy(budget=1.0, min_samples=1)
+    policy.record(0.05)
+
+    async def test(address):
+        async with client(address, hedge=policy) as api:
+            return await api.get('/api/v1/token/projects/')
+
+    response = serve(fake, test)
+
+    assert response['results'] == [{'id': 1, 'name': 'production'}]
+    assert (policy.hedges, policy.wins) == (1, 0)
+    # the failed hedge is not learned
+    assert len(policy.latencies) == 2
+
+
+def test_upload_package(tmp_path):
+    fake = FakeMigasfree()
+    package = tmp_path / 'foo_1.0_all.deb'
+    package.write_bytes(b'foo')
+
+    async def test(address):
+        async with client(address) as api:
+            return await api.upload_package(str(package), 3, 4)
+
+    response = serve(fake, test)
+
+    assert response == {'id': 1, 'project': '3', 'store': '4', 'fullname': 'foo_1.0_all.deb'}
+
+
+def test_package_cache_list_and_fetch(tmp_path):
+    fake = FakeMigasfree()
+
+    async def test(address):
+        cache = AsyncPackageCache(str(tmp_path / 'packages'))
+        try:
+            urls = await cache.list(f'http://{address}/repo/', keep_versions=1)
+            paths = await asyncio.gather(*(cache.fetch(urls[0]) for _ in range(3)))
+            return urls, paths
+        finally:
+            await cache.close()
+
+    urls, paths = serve(fake, test)
+
+    assert [os.path.basename(url) for url in urls] == ['foo_2.0_all.deb', 'bar_1.0_amd64.deb']
+    assert len(set(paths)) == 1
+    assert os.path.dirname(paths[0]) == package_directory(str(tmp_path / 'packages'), urls[0])
+    with open(paths[0], 'rb') as file:
+        assert file.read() == b'foo 2'
+    assert fake.count('GET', '/repo/pool/foo_2.0_all.deb') == 1
+
+
+def test_package_cache_verifies_downloads(tmp_path, monkeypatch):
+    fake = FakeMigasfree()
+    sums = (
+        f'{hashlib.sha256(b"foo 2").hexdigest()}  foo_2.0_all.deb\n'
+        f'{hashlib.sha256(b"good").hexdigest()}  bar_1.0_amd64.deb\n'
+    )
+    monkeypatch.setitem(REPOSITORY, 'pool/', {**REPOSITORY['pool/'], 'SHA256SUMS': sums.encode()})
+    monkeypatch.setattr('migasfree_imports.utils.progress', MagicMock())
+
+    async def test(address):
+        cache = AsyncPackageCache(str(tmp_path / 'packages'))
+        try:
+            foo, bar = await cache.list(f'http://{address}/repo/', keep_versions=1)
+            return cache, await cache.fetch(foo), await cache.fetch(bar)
+        finally:
+            await cache.close()
+
+    cache, foo, bar = serve(fake, test)
+
+    assert cache.digests == {os.path.abspath(foo): hashlib.sha256(b'foo 2').hexdigest()}
+    assert bar is None
+    assert fake.count('GET', '/repo/pool/bar_1.0_amd64.deb') == DOWNLOAD_ATTEMPTS
+    assert not list((tmp_path / 'packages').rglob('bar_1.0_amd64.deb'))
+    # sizes are counted once per package and the bytes of rejected downloads are undone
+    sizes = [call.kwargs['size'] for call in utils.progress.add_total.call_args_list if 'size' in call.kwargs]
+    assert len(sizes) == 2
+    assert sum(call.kwargs.get('size', 0) for call in utils.progress.advance.call_args_list) == len(b'foo 2')
+
+
+def template(address):
+    icon = 'data:image/png;base64,' + base64.b64encode(b'png').decode()
+    return {
+        'distros': [{'name': 'debian', 'platform': 'Linux', 'pms': 'apt', 'architecture': 'amd64'}],
+        'deployments': {
+            'debian': [
+                {
+                    'name': 'external',
+                    'source': 'E',
+                    'enabled': True,
+                    'base_url': 'http://deb.debian.org/debian',
+                    'options': '',
+                    'suite': 'bookworm',
+                    'components': 'main',
+                    'frozen': False,
+                    'included_attributes': [1],
+                },
+                {
+                    'name': 'internal',
+                    'source': 'I',
+                    'store': 'thirds',
+                    'url_download': f'http://{address}/repo/',
+                    'keep_versions': 1,
+                    'enabled': True,
+                    'included_attributes': [1],
+                    'packages_to_install': 'foo',
+                    'packages_to_remove': '',
+                },
+                {'name': 'ignored', 'source': 'E', 'ignored': True},
+            ]
+        },
+        'applications': [
+            {
+                'name': 'Foo',
+                'category': 'Tools',
+                'icon': icon,
+                'level': 'U',
+                'score': 3,
+                'description': 'foo',
+                'available_for_attributes': [1],
+                'packages_to_install': ['foo'],
+            }
+        ],
+    }
+
+
+def test_import_project(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    fake = FakeMigasfree()
+
+    async def test(address):
+        async with client(address) as api:
+            importer = AsyncMigasfreeImporter(api, template(address))
+            await importer.import_project(importer.template['distros'][0], 'production')
+            return importer.report
+
+    report = serve(fake, test)
+
+    assert report == {'deployments': 2, 'applications': 1, 'uploaded': 2}
+    assert sorted(package['fullname'] for package in fake.objects['packages']) == [
+        'bar_1.0_amd64.deb',
+        'foo_2.0_all.deb',
+    ]
+    deployments = {deployment['name']: deployment for deployment in fake.objects['deployments']}
+    assert deployments['external']['source'] == 'E'
+    assert sorted(deployments['internal']['available_packages']) == sorted(
+        str(package['id']) for package in fake.objects['packages']
+    )
+    assert fake.objects['catalog/apps'][0]['fullname'] == 'icon.png'
+    assert not (tmp_path / 'packages').exists()
+
+
+def test_import_project_from_bundle(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    fake = FakeMigasfree()
+    output = str(tmp_path / 'bundle.tar')
+
+    async def test(address):
+        exported = template(address)
+        await asyncio.get_running_loop().run_in_executor(None, export_bundle, exported, exported['distros'][0], output)
+        exported_requests = len(fake.requests)
+
+        cache = BundlePackageCache(output, directory=str(tmp_path / 'packages'))
+        try:
+            async with client(address) as api:
+                importer = AsyncMigasfreeImporter(api, cache.template, ThreadedPackageCache(cache))
+                await importer.import_project(cache.template['distros'][0], 'production')
+        finally:
+            cache.close()
+        return importer.report, fake.requests[exported_requests:]
+
+    report, requests = serve(fake, test)
+
+    assert report['uploaded'] == 2
+    assert not [path for _, path in requests if path.startswith('/repo')]
+    assert sorted(package['fullname'] for package in fake.objects['packages']) == [
+        'bar_1.0_amd64.deb',
+        'foo_2.0_all.deb',
+    ]
+
+
+def test_import_project_syncs_existing_deployment(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    fake = FakeMigasfree()
+    project = fake.create('projects', name='production')
+    store = fake.create('stores', name='thirds', project=project['id'])
+    stored = fake.create('packages', fullname='foo_2.0_all.deb', project=project['id'], store=store['id'])
+    deployment = fake.create('deployments', name='internal', project=project['id'], available_packages=[])
+
+    async def test(address):
+        async with client(address) as api:
+            importer = AsyncMigasfreeImporter(api, template(address))
+            importer.template['applications'] = []
+            await importer._process_deployment(
+                importer.template['deployments']['debian'][1], importer.template['distros'][0], project
+            )
+            return importer.report
+
+    report = serve(fake, test)
+
+    assert report['uploaded'] == 1
+    assert fake.count('GET', '/repo/pool/foo_2.0_all.deb') == 0
+    uploaded = next(package for package in fake.objects['packages'] if package['fullname'] == 'bar_1.0_amd64.deb')
+    assert deployment['available_packages'] == [stored['id'], uploaded['id']]
+
+
+def test_import_project_prunes_every_package_gone_upstream(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(REPOSITORY, 'pool/', {})
+    fake = FakeMigasfree()
+    project = fake.create('projects', name='production')
+    store = fake.create('stores', name='thirds', project=project['id'])
+    stored = fake.create('packages', fullname='foo_1.0_all.deb', project=project['id'], store=store['id'])
+    deployment = fake.create('deployments', name='internal', project=project['id'], available_packages=[stored['id']])
+
+    async def test(address):
+        async with client(address) as api:
+            importer = AsyncMigasfreeImporter(api, template(address))
+            await importer._process_deployment(
+                {**importer.template['deployments']['debian'][1], 'prune': True},
+                importer.template['distros'][0],
+                project,
+            )
+
+    serve(fake, test)
+
+    assert fake.count('PATCH', f'/api/v1/token/deployments/{deployment["id"]}/') == 1
+    assert deployment['available_packages'] == []
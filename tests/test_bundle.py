@@ -0,0 +1,82 @@
+import hashlib
+import os
+from unittest.mock import patch
+
+import pytest
+
+from migasfree_imports.bundle import BundlePackageCache, export_bundle
+
+
+@pytest.fixture
+def template():
+    return {
+        'distros': [{'name': 'debian_12'}, {'name': 'ubuntu_24'}],
+        'deployments': {
+            'debian_12': [
+                {'name': 'BASE', 'source': 'E'},
+                {'name': 'migasfree', 'source': 'I', 'url_download': 'http://example.com/d12/'},
+                {'name': 'extra', 'source': 'I', 'url_download': 'http://example.com/all/'},
+                {'name': 'old', 'source': 'I', 'url_download': 'http://example.com/old/', 'ignored': True},
+            ],
+            'ubuntu_24': [],
+        },
+        'applications': [{'name': 'app', 'icon': 'data:image/png;base64,AAAA'}],
+    }
+
+
+def fake_download(url, directory, checksum=None):
+    file_path = os.path.join(directory, os.path.basename(url))
+    with open(file_path, 'wb') as file:
+        file.write(url.encode())
+    return file_path, hashlib.sha256(url.encode()).hexdigest()
+
+
+def test_export_and_import_bundle(template, tmp_path):
+    listings = {
+        'http://example.com/d12/': ['http://example.com/d12/foo_1.0_all.deb', 'http://example.com/d12/bar_2.0_all.deb'],
+        'http://example.com/all/': ['http://example.com/d12/foo_1.0_all.deb'],
+    }
+    output = str(tmp_path / 'bundle.tar')
+
+    with patch(
+        'migasfree_imports.importer.list_packages', side_effect=lambda url, *args, **kwargs: listings[url]
+    ), patch('migasfree_imports.importer.download_verified', side_effect=fake_download) as mock_download:
+        index = export_bundle(template, template['distros'][0], output)
+
+    assert mock_download.call_count == 2  # shared package is downloaded once
+    assert list(index['repositories']) == ['http://example.com/d12/', 'http://example.com/all/']
+    assert index['template']['distros'] == [{'name': 'debian_12'}]
+    assert index['template']['applications'][0]['icon'].startswith('data:image/')
+
+    cache = BundlePackageCache(output, directory=str(tmp_path / 'packages'))
+    try:
+        assert cache.template == index['template']
+        assert cache.list('http://example.com/all/') == ['http://example.com/d12/foo_1.0_all.deb']
+        assert cache.list('http://example.com/unknown/') == []
+
+        file_path = cache.fetch('http://example.com/d12/bar_2.0_all.deb')
+        with open(file_path, 'rb') as file:
+            assert file.read() == b'http://example.com/d12/bar_2.0_all.deb'
+        assert cache.digests == {
+            os.path.abspath(file_path): hashlib.sha256(b'http://example.com/d12/bar_2.0_all.deb').hexdigest()
+        }
+        assert cache.fetch('http://example.com/d12/missing.deb') is None
+    finally:
+        cache.clear()
+        cache.close()
+
+    assert not os.path.exists(str(tmp_path / 'packages'))
+
+    # a damaged bundle is detected while extracting
+    entry = index['repositories']['http://example.com/all/'][0]
+    with open(output, 'r+b') as file:
+        file.seek(entry['offset'])
+        file.write(b'X')
+
+    cache = BundlePackageCache(output, directory=str(tmp_path / 'packages'))
+    try:
+        assert cache.fetch('http://example.com/d12/foo_1.0_all.deb') is None
+        assert cache.digests == {}
+    finally:
+        cache.clear()
+        cache.close()
@@ -0,0 +1,164 @@
+import gzip
+import hashlib
+import lzma
+
+import pytest
+import zstandard
+
+from migasfree_imports.checksums import (
+    IntegrityError,
+    Verifier,
+    is_checksum_file,
+    lookup,
+    parse_checksums,
+    select_checksum_files,
+)
+
+PACKAGES = """Package: foo
+Version: 1.0
+Filename: pool/main/f/foo/foo_1.0_all.deb
+MD5sum: 0123
+SHA256: ABCD
+
+Package: bar
+Filename: pool/main/b/bar/bar%2B1_1.0_all.deb
+MD5sum: 4567
+
+Package: broken
+SHA256: ffff
+"""
+
+PRIMARY = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://linux.duke.edu/metadata/common" xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="3">
+<package type="rpm">
+  <name>foo</name>
+  <checksum type="sha256" pkgid="YES">aaaa</checksum>
+  <location href="Packages/foo-1.0-1.x86_64.rpm"/>
+</package>
+<package type="rpm">
+  <name>bar</name>
+  <checksum type="sha" pkgid="YES">BBBB</checksum>
+  <location href="Packages/bar-1.0-1.x86_64.rpm"/>
+</package>
+<package type="rpm">
+  <name>baz</name>
+  <checksum type="unknown" pkgid="YES">cccc</checksum>
+  <location href="Packages/baz-1.0-1.x86_64.rpm"/>
+</package>
+</metadata>
+"""
+
+
+@pytest.mark.parametrize(
+    'name, expected',
+    [
+        ('Packages', True),
+        ('Packages.xz', True),
+        ('0123abcd-primary.xml.gz', True),
+        ('0123abcd-primary.xml.zst', True),
+        ('primary.xml', True),
+        ('SHA256SUMS', True),
+        ('foo_1.0_all.deb.sha256', True),
+        ('filelists.xml.gz', False),
+        ('Release', False),
+        ('foo_1.0_all.deb', False),
+    ],
+)
+def test_is_checksum_file(name, expected):
+    assert is_checksum_file(f'http://example.com/repo/{name}') is expected
+
+
+def test_select_checksum_files_keeps_one_packages_file_per_directory():
+    urls = [
+        'http://example.com/dists/main/Packages',
+        'http://example.com/dists/main/Packages.gz',
+        'http://example.com/dists/main/Packages.xz',
+        'http://example.com/dists/contrib/Packages.bz2',
+        'http://example.com/pool/SHA256SUMS',
+    ]
+
+    assert select_checksum_files(urls) == [
+        'http://example.com/pool/SHA256SUMS',
+        'http://example.com/dists/main/Packages.xz',
+        'http://example.com/dists/contrib/Packages.bz2',
+    ]
+
+
+def test_parse_deb_packages_relative_to_archive_root():
+    url = 'http://example.com/debian/dists/stable/main/binary-amd64/Packages.xz'
+
+    checksums = parse_checksums(url, lzma.compress(PACKAGES.encode()))
+
+    assert checksums == {
+        'http://example.com/debian/pool/main/f/foo/foo_1.0_all.deb': ('sha256', 'abcd'),
+        'http://example.com/debian/pool/main/b/bar/bar+1_1.0_all.deb': ('md5', '4567'),
+    }
+    assert lookup(checksums, 'http://example.com/debian/pool/main/b/bar/bar%2B1_1.0_all.deb') == ('md5', '4567')
+
+
+def test_parse_deb_packages_flat_repository():
+    checksums = parse_checksums('http://example.com/repo/Packages', PACKAGES.encode())
+    assert 'http://example.com/repo/pool/main/f/foo/foo_1.0_all.deb' in checksums
+
+
+def test_parse_rpm_primary():
+    url = 'http://example.com/el9/repodata/0123-primary.xml.gz'
+
+    checksums = parse_checksums(url, gzip.compress(PRIMARY.encode()))
+
+    assert checksums == {
+        'http://example.com/el9/Packages/foo-1.0-1.x86_64.rpm': ('sha256', 'aaaa'),
+        'http://example.com/el9/Packages/bar-1.0-1.x86_64.rpm': ('sha1', 'bbbb'),
+    }
+
+
+def test_parse_rpm_primary_zstd():
+    url = 'http://example.com/f40/repodata/0123-primary.xml.zst'
+
+    checksums = parse_checksums(url, zstandard.ZstdCompressor().compress(PRIMARY.encode()))
+
+    assert checksums['http://example.com/f40/Packages/foo-1.0-1.x86_64.rpm'] == ('sha256', 'aaaa')
+
+
+def test_parse_sums_and_sidecar():
+    sums = b'AAAA  foo_1.0_all.deb\nbbbb *bar_1.0_all.deb\n\n'
+    assert parse_checksums('http://example.com/repo/SHA256SUMS', sums) == {
+        'http://example.com/repo/foo_1.0_all.deb': ('sha256', 'aaaa'),
+        'http://example.com/repo/bar_1.0_all.deb': ('sha256', 'bbbb'),
+    }
+
+    sidecar = b'cccc  some/other/name.deb\n'
+    assert parse_checksums('http://example.com/repo/foo_1.0_all.deb.sha512', sidecar) == {
+        'http://example.com/repo/foo_1.0_all.deb': ('sha512', 'cccc'),
+    }
+
+
+def test_verifier_accepts_matching_download():
+    data = b'package data'
+    verifier = Verifier(('md5', hashlib.md5(data).hexdigest()))
+    verifier.update(data[:5])
+    verifier.update(data[5:])
+
+    assert verifier.verify('http://example.com/foo.deb', len(data)) == hashlib.sha256(data).hexdigest()
+
+
+def test_verifier_without_checksum_returns_sha256():
+    verifier = Verifier()
+    verifier.update(b'data')
+    assert verifier.verify('http://example.com/foo.deb') == hashlib.sha256(b'data').hexdigest()
+
+
+def test_verifier_rejects_corrupted_download():
+    verifier = Verifier(('sha256', hashlib.sha256(b'good').hexdigest()))
+    verifier.update(b'evil')
+
+    with pytest.raises(IntegrityError, match='sha256 mismatch'):
+        verifier.verify('http://example.com/foo.deb', 4)
+
+
+def test_verifier_rejects_truncated_download():
+    verifier = Verifier()
+    verifier.update(b'da')
+
+    with pytest.raises(IntegrityError, match='got 2 of 4 bytes'):
+        verifier.verify('http://example.com/foo.deb', 4)
@@ -1,9 +1,16 @@
+import email
 import os
-from unittest.mock import MagicMock, mock_open, patch
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
 
 import pytest
+import requests
 
-from migasfree_imports.client import MigasfreeImport
+from migasfree_imports.client import UPLOAD_CHUNK_SIZE, MigasfreeImport, UploadBody, parse_servers
+from migasfree_imports.hedge import HedgePolicy
+from migasfree_imports.scheduler import scheduler
 
 
 @pytest.fixture
@@ -112,6 +119,7 @@ def test_request_methods(client):
             data=None,
             params=None,
             files=None,
+            json=None,
             verify=False,
         )
 
@@ -124,6 +132,7 @@ def test_request_methods(client):
             data={'d': 1},
             params=None,
             files=None,
+            json=None,
             verify=False,
         )
 
@@ -136,6 +145,7 @@ def test_request_methods(client):
             data={'d': 2},
             params=None,
             files=None,
+            json=None,
             verify=False,
         )
 
@@ -148,6 +158,20 @@ def test_request_methods(client):
             data={'d': 3},
             params=None,
             files=None,
+            json=None,
+            verify=False,
+        )
+
+        # PATCH with a JSON body (an empty list is sent too)
+        client.patch('/endpoint', json={'ids': []})
+        mock_req.assert_called_with(
+            method='PATCH',
+            url='http://migasfree.test/endpoint',
+            headers=client.headers,
+            data=None,
+            params=None,
+            files=None,
+            json={'ids': []},
             verify=False,
         )
 
@@ -167,15 +191,249 @@ def test_get_or_post_new(client):
         mock_post.assert_called_once_with('/endpoint', data={'a': 1}, files=None)
 
 
-def test_upload_package(client):
-    with patch('builtins.open', mock_open(read_data=b'data')), patch.object(
+def test_upload_package(client, tmp_path):
+    package = tmp_path / 'pkg.deb'
+    package.write_bytes(b'data')
+    sent = {}
+
+    def post(endpoint, data, headers):
+        sent['body'] = b''.join(data)
+        sent['headers'] = headers
+        return {'id': 99}
+
+    with patch.object(client, 'post', side_effect=post) as mock_post:
+        assert client.upload_package(str(package), 1, 2) == {'id': 99}
+
+    assert mock_post.call_args[0] == ('/api/v1/token/packages/',)
+    assert sent['headers']['Content-Length'] == str(len(sent['body']))
+    message = email.message_from_bytes(
+        f'Content-Type: {sent["headers"]["Content-Type"]}\r\n\r\n'.encode() + sent['body']
+    )
+    fields = {part.get_param('name', header='content-disposition'): part for part in message.get_payload()}
+    assert fields['project'].get_payload() == '1'
+    assert fields['store'].get_payload() == '2'
+    assert fields['files'].get_filename() == 'pkg.deb'
+    assert fields['files'].get_payload(decode=True) == b'data'
+
+
+def test_upload_body_paces_every_chunk(tmp_path):
+    package = tmp_path / 'pkg.deb'
+    package.write_bytes(b'x' * (2 * UPLOAD_CHUNK_SIZE + 1))
+
+    with open(package, 'rb') as file, patch.object(scheduler.upload, 'consume') as mock_consume:
+        body = UploadBody({'project': 1}, 'files', file)
+        content = b''.join(body)
+
+    assert len(content) == len(body)
+    assert [call.args[0] for call in mock_consume.call_args_list] == [
+        len(body.head),
+        UPLOAD_CHUNK_SIZE,
+        UPLOAD_CHUNK_SIZE,
+        1,
+        len(body.tail),
+    ]
+
+
+def test_get_all_follows_pages(client):
+    pages = [
+        {'results': [{'id': 1}], 'next': 'http://migasfree.test/endpoint?page=2'},
+        {'results': [{'id': 2}], 'next': None},
+    ]
+    with patch.object(client, 'get', side_effect=pages) as mock_get:
+        assert client.get_all('/endpoint', params={'a': 1}) == [{'id': 1}, {'id': 2}]
+        mock_get.assert_any_call('/endpoint', params={'a': 1, 'page': 1})
+        mock_get.assert_any_call('/endpoint', params={'a': 1, 'page': 2})
+
+
+def test_upload_package_skips_already_uploaded(client):
+    client.index = MagicMock()
+    client.index.lookup.return_value = {'sha256': 'abc'}
+    client.index.uploaded.return_value = 42
+
+    with patch.object(client, '_call', return_value={'id': 42}) as mock_call, patch.object(client, 'post') as mock_post:
+        assert client.upload_package('pkg.deb', 1, 2) == {'id': 42}
+        mock_post.assert_not_called()
+        mock_call.assert_called_once_with('GET', '/api/v1/token/packages/42/')
+        client.index.uploaded.assert_called_once_with('abc', 'migasfree.test', 1, 2)
+
+
+def test_upload_package_uploads_again_when_gone(client, tmp_path):
+    client.index = MagicMock()
+    client.index.lookup.return_value = {'sha256': 'abc'}
+    client.index.uploaded.return_value = 42
+    package = tmp_path / 'pkg.deb'
+    package.write_bytes(b'data')
+
+    with patch.object(client, '_call', side_effect=requests.HTTPError('404 Error')), patch.object(
         client, 'post', return_value={'id': 99}
     ) as mock_post:
-        res = client.upload_package('pkg.deb', 1, 2)
-        assert res == {'id': 99}
-
-        # Check if post was called (params verification is a bit complex due to file object)
-        mock_post.assert_called()
-        _, kwargs = mock_post.call_args
-        assert kwargs['data'] == {'project': 1, 'store': 2}
-        assert 'files' in kwargs
+        assert client.upload_package(str(package), 1, 2) == {'id': 99}
+        mock_post.assert_called_once()
+        client.index.forget_upload.assert_called_once_with('abc', 'migasfree.test', 1, 2)
+        client.index.record_upload.assert_called_once_with('abc', 'migasfree.test', 1, 2, 99)
+
+
+def test_upload_package_records_upload(client, tmp_path):
+    client.index = MagicMock()
+    client.index.lookup.return_value = {'sha256': 'abc'}
+    client.index.uploaded.return_value = None
+    package = tmp_path / 'pkg.deb'
+    package.write_bytes(b'data')
+
+    with patch.object(client, 'post', return_value={'id': 99}):
+        assert client.upload_package(str(package), 1, 2) == {'id': 99}
+        client.index.record_upload.assert_called_once_with('abc', 'migasfree.test', 1, 2, 99)
+
+
+def test_parse_servers():
+    assert parse_servers('prod.test, admin:secret@pre.test,') == [
+        {'server': 'prod.test', 'username': None, 'password': None},
+        {'server': 'pre.test', 'username': 'admin', 'password': 'secret'},
+    ]
+
+
+def test_get_token_uses_own_credentials(mock_migasfree_env):
+    with patch('requests.post') as mock_post:
+        mock_post.return_value.status_code = 200
+        mock_post.return_value.json.return_value = {'token': 'site-token'}
+
+        client = MigasfreeImport(server='site.test', username='site', password='pass')
+
+        assert client.token == 'site-token'
+        mock_post.assert_called_with(
+            'http://site.test/token-auth/', json={'username': 'site', 'password': 'pass'}, verify=False
+        )
+
+
+def test_get_collapses_identical_inflight_requests(client):
+    calls = []
+    release = threading.Event()
+
+    def slow_request(method, endpoint, params=None, **kwargs):
+        calls.append((method, endpoint, params))
+        release.wait(1)
+        return {'results': [{'id': len(calls)}]}
+
+    with patch.object(client, '_request', side_effect=slow_request), ThreadPoolExecutor(max_workers=5) as executor:
+        futures = [executor.submit(client.get, '/endpoint', {'name': 'x'}) for _ in range(4)]
+        futures.append(executor.submit(client.get, '/endpoint', {'name': 'y'}))
+        time.sleep(0.1)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert len(calls) == 2
+    assert results[:4] == [results[0]] * 4
+
+
+def test_get_or_post_concurrent_creates_once(client):
+    release = threading.Event()
+
+    def slow_post(endpoint, data=None, files=None):
+        release.wait(1)
+        return {'id': 5}
+
+    with patch.object(client, '_request', return_value={}), patch.object(
+        client, 'post', side_effect=slow_post
+    ) as mock_post, ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(client.get_or_post, '/endpoint', {'name': 'x'}, {'name': 'x'}) for _ in range(3)]
+        time.sleep(0.1)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert results == [[{'id': 5}]] * 3
+    mock_post.assert_called_once()
+
+
+def test_get_does_not_cache_after_completion(client):
+    with patch.object(client, '_request', return_value={'id': 1}) as mock_request:
+        client.get('/endpoint')
+        client.get('/endpoint')
+        assert mock_request.call_count == 2
+
+
+@pytest.fixture
+def hedged_client(mock_migasfree_env):
+    policy = HedgePolicy(budget=1.0, min_samples=1)
+    policy.record(0.05)
+    with patch.object(MigasfreeImport, 'get_token', return_value='fake-token'):
+        return MigasfreeImport(hedge=policy)
+
+
+def test_get_hedges_slow_request(hedged_client):
+    calls = []
+
+    def request(method, endpoint, params=None, **kwargs):
+        calls.append(endpoint)
+        if len(calls) == 1:
+            time.sleep(0.5)  # stalled behind a slow worker
+            return {'id': 'slow'}
+        return {'id': 'fast'}
+
+    with patch.object(hedged_client, '_call', side_effect=request):
+        start = time.perf_counter()
+        assert hedged_client.get('/endpoint') == {'id': 'fast'}
+        assert time.perf_counter() - start < 0.4
+
+    assert calls == ['/endpoint', '/endpoint']
+    assert (hedged_client.hedge.hedges, hedged_client.hedge.wins) == (1, 1)
+
+
+def test_get_does_not_hedge_fast_request(hedged_client):
+    with patch.object(hedged_client, '_call', return_value={'id': 1}) as mock_request:
+        assert hedged_client.get('/endpoint') == {'id': 1}
+
+    mock_request.assert_called_once()
+    assert hedged_client.hedge.hedges == 0
+
+
+def test_get_waits_for_original_when_budget_is_spent(hedged_client):
+    hedged_client.hedge.budget = 0.0
+
+    def slow_request(method, endpoint, params=None, **kwargs):
+        time.sleep(0.1)
+        return {'id': 1}
+
+    with patch.object(hedged_client, '_call', side_effect=slow_request) as mock_request:
+        assert hedged_client.get('/endpoint') == {'id': 1}
+
+    mock_request.assert_called_once()
+
+
+def test_get_hedge_survives_failed_original(hedged_client):
+    calls = []
+
+    def request(method, endpoint, params=None, **kwargs):
+        calls.append(endpoint)
+        if len(calls) == 1:
+            time.sleep(0.2)
+            raise ConnectionError('reset')
+        time.sleep(0.3)
+        return {'id': 'hedge'}
+
+    with patch.object(hedged_client, '_call', side_effect=request):
+        assert hedged_client.get('/endpoint') == {'id': 'hedge'}
+
+
+def test_get_hedge_error_response_does_not_win(hedged_client):
+    calls = []
+
+    def request(method, endpoint, params=None, **kwargs):
+        calls.append(endpoint)
+        if len(calls) == 1:
+            time.sleep(0.3)
+            return {'id': 'slow'}
+        raise requests.HTTPError('503 Error for url: /endpoint')
+
+    with patch.object(hedged_client, '_call', side_effect=request):
+        assert hedged_client.get('/endpoint') == {'id': 'slow'}
+
+    assert (hedged_client.hedge.hedges, hedged_client.hedge.wins) == (1, 0)
+    # only the successful request is learned
+    assert len(hedged_client.hedge.latencies) == 2
+
+
+def test_get_hedged_errors_give_empty_result(hedged_client):
+    with patch.object(hedged_client, '_call', side_effect=requests.HTTPError('500 Error for url: /endpoint')):
+        assert hedged_client.get('/endpoint') == {}
+
+    assert len(hedged_client.hedge.latencies) == 1
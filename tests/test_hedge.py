@@ -0,0 +1,46 @@
+from migasfree_imports.hedge import HedgePolicy, percentile
+
+
+def test_percentile():
+    assert percentile([], 0.5) == 0.0
+    assert percentile([0.1, 0.2, 0.3, 0.4], 0.5) == 0.2
+    assert percentile([0.1, 0.2, 0.3, 0.4], 0.99) == 0.4
+
+
+def test_no_delay_until_enough_samples():
+    policy = HedgePolicy(min_samples=3)
+    policy.record(0.1)
+    policy.record(0.2)
+    assert policy.delay() is None
+
+    policy.record(0.3)
+    assert policy.delay() == 0.3
+
+
+def test_delay_is_the_percentile_of_recent_latencies():
+    policy = HedgePolicy(percentile=0.9, min_samples=1, window=10)
+    for latency in range(100):
+        policy.record(latency / 100)
+
+    # only the last 10 latencies (0.90 .. 0.99) are kept
+    assert policy.delay() == 0.98
+
+
+def test_min_delay():
+    policy = HedgePolicy(min_samples=1, min_delay=0.05)
+    policy.record(0.001)
+    assert policy.delay() == 0.05
+
+
+def test_budget_limits_hedges():
+    policy = HedgePolicy(budget=0.1, min_samples=1)
+    policy.record(0.1)
+
+    for _ in range(9):
+        policy.delay()
+    assert not policy.acquire()
+
+    policy.delay()
+    assert policy.acquire()
+    assert not policy.acquire()
+    assert (policy.requests, policy.hedges) == (10, 1)
@@ -1,8 +1,19 @@
+import asyncio
+from concurrent.futures.process import BrokenProcessPool
 from unittest.mock import MagicMock, patch
 
 import pytest
+import requests
 
-from migasfree_imports.importer import MigasfreeImporter, decode_icon, load_template
+from migasfree_imports.importer import (
+    AsyncMigasfreeImporter,
+    MigasfreeImporter,
+    MultiServerImporter,
+    PackageCache,
+    decode_icon,
+    load_template,
+)
+from migasfree_imports.utils import package_directory
 
 
 @pytest.fixture
@@ -56,8 +67,8 @@ def test_run_flow(importer, mock_client):
         }
         mock_select_project.return_value = 'TestProject'
 
-        with patch.object(importer, '_import_deployments') as mock_deployments, patch.object(
-            importer, '_import_applications'
+        with patch.object(importer.engine, '_import_deployments') as mock_deployments, patch.object(
+            importer.engine, '_import_applications'
         ) as mock_applications:
             importer.run()
 
@@ -112,3 +123,178 @@ def test_load_template():
     # Verify icons are data URIs
     for app in template['applications']:
         assert app['icon'].startswith('data:image/')
+
+
+@pytest.fixture
+def internal_deployment():
+    return {
+        'name': 'migasfree',
+        'enabled': True,
+        'url_download': 'http://example.com/repo/',
+        'store': 'thirds',
+        'source': 'I',
+        'included_attributes': [1],
+        'packages_to_install': [],
+        'packages_to_remove': [],
+    }
+
+
+def test_process_deployment_existing_uploads_only_missing(importer, mock_client, internal_deployment):
+    mock_client.get_or_post.return_value = [{'id': 7}]
+    mock_client.get.return_value = {'results': [{'id': 50, 'available_packages': [1, 2]}]}
+    mock_client.get_all.return_value = [
+        {'id': 1, 'fullname': 'foo_1.0_all.deb'},
+        {'id': 2, 'fullname': 'bar_1.0_all.deb'},
+    ]
+    mock_client.upload_package.return_value = {'id': 3}
+
+    with patch(
+        'migasfree_imports.importer.list_packages',
+        return_value=['http://example.com/repo/foo_1.0_all.deb', 'http://example.com/repo/baz_1.0_all.deb'],
+    ), patch(
+        'migasfree_imports.importer.download_verified', return_value=('./packages/baz_1.0_all.deb', 'digest')
+    ) as mock_dl, patch('os.makedirs'), patch('os.path.getsize', return_value=10), patch(
+        'requests.head', side_effect=requests.ConnectionError
+    ), patch('shutil.rmtree'):
+        asyncio.run(
+            importer.engine._process_deployment(
+                internal_deployment, {'name': 'Focal'}, {'id': 100, 'name': 'TestProject'}
+            )
+        )
+
+    mock_dl.assert_called_once_with(
+        'http://example.com/repo/baz_1.0_all.deb',
+        package_directory('./packages', 'http://example.com/repo/baz_1.0_all.deb'),
+        None,
+    )
+    mock_client.upload_package.assert_called_once_with('./packages/baz_1.0_all.deb', 100, 7)
+    mock_client.patch.assert_called_once_with('/api/v1/token/deployments/50/', json={'available_packages': [1, 2, 3]})
+    mock_client.post.assert_not_called()
+
+
+def test_process_deployment_continues_when_indexing_fails(importer, mock_client, internal_deployment):
+    mock_client.get_or_post.return_value = [{'id': 7}]
+    mock_client.get.return_value = {'results': [{'id': 50, 'available_packages': []}]}
+    mock_client.get_all.return_value = []
+    mock_client.upload_package.return_value = {'id': 3}
+    mock_client.index.add.side_effect = BrokenProcessPool('no main guard')
+
+    with patch(
+        'migasfree_imports.importer.list_packages', return_value=['http://example.com/repo/baz_1.0_all.deb']
+    ), patch(
+        'migasfree_imports.importer.download_verified', return_value=('./packages/baz_1.0_all.deb', 'digest')
+    ), patch('os.makedirs'), patch('os.path.getsize', return_value=10), patch('shutil.rmtree'):
+        asyncio.run(
+            importer.engine._process_deployment(
+                internal_deployment, {'name': 'Focal'}, {'id': 100, 'name': 'TestProject'}
+            )
+        )
+
+    mock_client.index.add.assert_called_once_with(['./packages/baz_1.0_all.deb'], digests=importer.packages.digests)
+    mock_client.upload_package.assert_called_once_with('./packages/baz_1.0_all.deb', 100, 7)
+    mock_client.patch.assert_called_once_with('/api/v1/token/deployments/50/', json={'available_packages': [3]})
+
+
+def test_process_deployment_existing_prune(importer, mock_client, internal_deployment):
+    internal_deployment['prune'] = True
+    mock_client.get_or_post.return_value = [{'id': 7}]
+    mock_client.get.return_value = {'results': [{'id': 50, 'available_packages': [{'id': 1}, {'id': 2}, {'id': 9}]}]}
+    mock_client.get_all.return_value = [
+        {'id': 1, 'fullname': 'foo_1.0_all.deb'},
+        {'id': 2, 'fullname': 'bar_1.0_all.deb'},
+    ]
+
+    with patch('migasfree_imports.importer.list_packages', return_value=['http://example.com/repo/foo_1.0_all.deb']):
+        asyncio.run(
+            importer.engine._process_deployment(
+                internal_deployment, {'name': 'Focal'}, {'id': 100, 'name': 'TestProject'}
+            )
+        )
+
+    mock_client.upload_package.assert_not_called()
+    mock_client.patch.assert_called_once_with('/api/v1/token/deployments/50/', json={'available_packages': [1, 9]})
+
+
+def test_process_deployment_existing_prune_everything_gone(importer, mock_client, internal_deployment):
+    internal_deployment['prune'] = True
+    mock_client.get_or_post.return_value = [{'id': 7}]
+    mock_client.get.return_value = {'results': [{'id': 50, 'available_packages': [{'id': 1}, {'id': 2}]}]}
+    mock_client.get_all.return_value = [
+        {'id': 1, 'fullname': 'foo_1.0_all.deb'},
+        {'id': 2, 'fullname': 'bar_1.0_all.deb'},
+    ]
+
+    with patch('migasfree_imports.importer.list_packages', return_value=[]):
+        asyncio.run(
+            importer.engine._process_deployment(
+                internal_deployment, {'name': 'Focal'}, {'id': 100, 'name': 'TestProject'}
+            )
+        )
+
+    mock_client.patch.assert_called_once_with('/api/v1/token/deployments/50/', json={'available_packages': []})
+
+
+def test_package_cache_downloads_once(tmp_path):
+    cache = PackageCache(str(tmp_path / 'packages'))
+    with patch('migasfree_imports.importer.download_verified', return_value=('/tmp/foo.deb', 'digest')) as mock_dl:
+        assert cache.fetch('http://example.com/foo.deb') == '/tmp/foo.deb'
+        assert cache.fetch('http://example.com/foo.deb') == '/tmp/foo.deb'
+        mock_dl.assert_called_once()
+    assert cache.digests == {'/tmp/foo.deb': 'digest'}
+
+    with patch('migasfree_imports.importer.list_packages', return_value=['a.deb']) as mock_list:
+        assert cache.list('http://example.com/', keep_versions=1) == ['a.deb']
+        assert cache.list('http://example.com/', keep_versions=1) == ['a.deb']
+        mock_list.assert_called_once_with('http://example.com/', 1, None, metadata=[])
+
+
+def test_multi_server_importer_reports_per_server(sample_template):
+    clients = []
+    for server in ('prod.test', 'pre.test'):
+        client = MagicMock()
+        client.server = server
+        client.get.return_value = {'results': []}
+        clients.append(client)
+
+    multi = MultiServerImporter(clients, template=sample_template)
+    assert all(importer.packages is multi.engine.packages for importer in multi.importers)
+    assert multi.engine.packages.wrapped is multi.packages
+
+    async def import_project(importer, distro_base, project_name):
+        if importer.client.server == 'pre.test':
+            raise ConnectionError('down')
+        importer.report['deployments'] = 2
+
+    with patch('migasfree_imports.importer.select_distro', return_value=sample_template['distros'][0]), patch(
+        'migasfree_imports.importer.select_project', return_value='TestProject'
+    ), patch.object(AsyncMigasfreeImporter, 'import_project', autospec=True, side_effect=import_project) as mock_import:
+        multi.run()
+
+    assert mock_import.call_count == 2
+    assert multi.importers[0].report['deployments'] == 2
+    assert list(multi.errors) == ['pre.test']
+
+
+def test_multi_server_importer_survives_unreachable_server(sample_template):
+    clients = []
+    for server in ('down.test', 'prod.test'):
+        client = MagicMock()
+        client.server = server
+        client.get.return_value = {'results': []}
+        client.get_or_post.return_value = [{'id': 1, 'name': 'TestProject'}]
+        clients.append(client)
+    clients[0].login.side_effect = ConnectionError('refused')
+
+    multi = MultiServerImporter(clients, template=sample_template)
+    with patch('migasfree_imports.importer.select_distro', return_value=sample_template['distros'][0]), patch(
+        'migasfree_imports.importer.select_project', return_value='TestProject'
+    ) as mock_select_project, patch.object(multi.engine, 'log_report') as mock_report:
+        multi.run()
+
+    mock_select_project.assert_called_once_with([])
+    assert list(multi.errors) == ['down.test']
+    clients[0].get_or_post.assert_not_called()
+    clients[1].get_or_post.assert_any_call(
+        '/api/v1/token/platforms/', params={'name': 'Ubuntu 20.04'}, data={'name': 'Ubuntu 20.04'}
+    )
+    mock_report.assert_called_once()
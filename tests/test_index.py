@@ -0,0 +1,132 @@
+import gzip
+import io
+import os
+import struct
+import tarfile
+
+import pytest
+import zstandard
+
+from migasfree_imports.index import PackageIndex, read_deb_control, read_rpm_header, scan_package
+
+
+def make_deb(path, package='foo', version='1.0-1', arch='amd64', compression='gz'):
+    control = f'Package: {package}\nVersion: {version}\nArchitecture: {arch}\nDescription: test\n'.encode()
+    control_tar = io.BytesIO()
+    with tarfile.open(fileobj=control_tar, mode='w') as tar:
+        info = tarfile.TarInfo('./control')
+        info.size = len(control)
+        tar.addfile(info, io.BytesIO(control))
+
+    if compression == 'zst':
+        control_tar = io.BytesIO(zstandard.ZstdCompressor().compress(control_tar.getvalue()))
+    else:
+        control_tar = io.BytesIO(gzip.compress(control_tar.getvalue()))
+
+    def member(name, data):
+        header = f'{name:<16}{0:<12}{0:<6}{0:<6}{"100644":<8}{len(data):<10}`\n'.encode()
+        return header + data + (b'\n' if len(data) % 2 else b'')
+
+    with open(path, 'wb') as file:
+        file.write(b'!<arch>\n')
+        file.write(member('debian-binary', b'2.0\n'))
+        file.write(member(f'control.tar.{compression}', control_tar.getvalue()))
+        file.write(member('data.tar.gz', b''))
+
+
+def make_rpm(path, name='bar', version='2.0', release='3', arch='noarch'):
+    strings = [(1000, name), (1001, version), (1002, release), (1022, arch)]
+    entries, data = b'', b''
+    for tag, value in strings:
+        entries += struct.pack('>IIII', tag, 6, len(data), 1)
+        data += value.encode() + b'\0'
+
+    def header(entries, data, count):
+        return b'\x8e\xad\xe8\x01' + b'\0' * 4 + struct.pack('>II', count, len(data)) + entries + data
+
+    with open(path, 'wb') as file:
+        file.write(b'\xed\xab\xee\xdb' + b'\0' * 92)
+        file.write(header(b'', b'', 0))
+        file.write(header(entries, data, len(strings)))
+
+
+def test_read_deb_control(tmp_path):
+    path = str(tmp_path / 'foo_1.0-1_amd64.deb')
+    make_deb(path)
+    fields = read_deb_control(path)
+    assert fields['Package'] == 'foo'
+    assert fields['Version'] == '1.0-1'
+    assert fields['Architecture'] == 'amd64'
+
+
+def test_read_deb_control_zstd(tmp_path):
+    path = str(tmp_path / 'foo_1.0-1_amd64.deb')
+    make_deb(path, version='2.0-1', compression='zst')
+    assert read_deb_control(path)['Version'] == '2.0-1'
+
+
+def test_read_rpm_header(tmp_path):
+    path = str(tmp_path / 'bar-2.0-3.noarch.rpm')
+    make_rpm(path)
+    assert read_rpm_header(path) == {'Package': 'bar', 'Version': '2.0-3', 'Architecture': 'noarch'}
+
+
+def test_scan_package_falls_back_to_file_name(tmp_path):
+    path = tmp_path / 'baz_3.0_i386.deb'
+    path.write_bytes(b'not a package')
+    entry = scan_package(str(path))
+    assert (entry['name'], entry['version'], entry['arch']) == ('baz', '3.0', 'i386')
+    assert entry['size'] == len(b'not a package')
+    assert len(entry['sha256']) == 64
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = PackageIndex(str(tmp_path / 'index.db'), workers=2)
+    yield index
+    index.close()
+
+
+def test_update_is_incremental(index, tmp_path):
+    packages = tmp_path / 'packages'
+    packages.mkdir()
+    make_deb(str(packages / 'foo_1.0-1_amd64.deb'))
+    make_rpm(str(packages / 'bar-2.0-3.noarch.rpm'))
+
+    assert index.update(str(packages)) == 2
+    assert index.update(str(packages)) == 0
+    assert index.seen('foo', '1.0-1', 'amd64')
+    assert index.seen('bar', '2.0-3', 'noarch')
+
+    make_deb(str(packages / 'foo_1.0-1_amd64.deb'), version='1.0-2')
+    os.utime(str(packages / 'foo_1.0-1_amd64.deb'), (0, 0))
+    assert index.update(str(packages)) == 1
+    assert index.seen('foo', '1.0-2', 'amd64')
+
+    os.remove(str(packages / 'bar-2.0-3.noarch.rpm'))
+    index.update(str(packages))
+    assert index.get(str(packages / 'bar-2.0-3.noarch.rpm')) is None
+
+
+def test_add_indexes_only_the_given_files(index, tmp_path):
+    make_deb(str(tmp_path / 'foo_1.0-1_amd64.deb'))
+    make_rpm(str(tmp_path / 'bar-2.0-3.noarch.rpm'))
+
+    assert index.add([str(tmp_path / 'foo_1.0-1_amd64.deb')]) == 1
+    assert index.add([str(tmp_path / 'foo_1.0-1_amd64.deb')]) == 0
+    assert index.seen('foo', '1.0-1', 'amd64')
+    assert not index.seen('bar', '2.0-3', 'noarch')
+
+
+def test_uploads(index, tmp_path):
+    path = str(tmp_path / 'foo_1.0-1_amd64.deb')
+    make_deb(path)
+    entry = index.lookup(path)
+
+    assert index.uploaded(entry['sha256'], 'migasfree.test', 1, 2) is None
+    index.record_upload(entry['sha256'], 'migasfree.test', 1, 2, 99)
+    assert index.uploaded(entry['sha256'], 'migasfree.test', 1, 2) == 99
+    assert index.uploaded(entry['sha256'], 'other.test', 1, 2) is None
+
+    index.forget_upload(entry['sha256'], 'migasfree.test', 1, 2)
+    assert index.uploaded(entry['sha256'], 'migasfree.test', 1, 2) is None
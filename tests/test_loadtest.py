@@ -0,0 +1,73 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from migasfree_imports.loadtest import LoadTest, endpoint_key, percentile
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Minimal migasfree API: every lookup finds one object, every POST creates one, stores fail."""
+
+    counter = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.startswith('/api/v1/token/stores/'):
+            self._reply(500, {'detail': 'boom'})
+        else:
+            self._reply(200, {'count': 1, 'results': [{'id': 1, 'name': 'found'}]})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path == '/token-auth/':
+            self._reply(200, {'token': 'stand-in'})
+            return
+        StandInHandler.counter += 1
+        self._reply(201, {'id': StandInHandler.counter, 'name': 'created'})
+
+
+@pytest.fixture
+def stand_in_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+
+
+def test_percentile():
+    values = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
+    assert percentile(values, 0.5) == 0.5
+    assert percentile(values, 0.95) == 1.0
+    assert percentile([], 0.5) == 0.0
+
+
+def test_endpoint_key():
+    assert endpoint_key('PATCH', 'http://server:8000/api/v1/token/deployments/50/') == (
+        'PATCH /api/v1/token/deployments/{id}/'
+    )
+    assert endpoint_key('GET', 'http://server/api/v1/token/projects/?name=x') == 'GET /api/v1/token/projects/'
+
+
+def test_load_test_against_stand_in_server(stand_in_server):
+    load_test = LoadTest(stand_in_server, users=3, iterations=2, ramp_up=0.01, username='u', password='p')
+    report = load_test.run()
+
+    endpoints = report['endpoints']
+    assert endpoints['GET /api/v1/token/platforms/']['requests'] == 6
+    assert endpoints['POST /api/v1/token/deployments/']['requests'] == 6
+    assert endpoints['GET /api/v1/token/stores/']['error_rate'] == 1.0
+    assert endpoints['POST /api/v1/token/stores/']['errors'] == 0
+    assert endpoints['POST /api/v1/token/deployments/']['p99'] >= endpoints['POST /api/v1/token/deployments/']['p50']
@@ -0,0 +1,101 @@
+import pytest
+
+from migasfree_imports.packages import (
+    PackageFile,
+    compare_deb_versions,
+    compare_rpm_versions,
+    parse_package_filename,
+    select_latest,
+)
+
+# --- parse_package_filename ---
+
+
+@pytest.mark.parametrize(
+    'file_name, expected',
+    [
+        ('migasfree-client_4.20_all.deb', PackageFile('migasfree-client', '4.20', 'all', 'deb')),
+        ('http://example.com/pool/foo_1.0-1_amd64.deb', PackageFile('foo', '1.0-1', 'amd64', 'deb')),
+        ('foo_1%3a2.0_amd64.deb', PackageFile('foo', '1:2.0', 'amd64', 'deb')),
+        ('migasfree-client-4.20-1.noarch.rpm', PackageFile('migasfree-client', '4.20-1', 'noarch', 'rpm')),
+        ('kernel-core-6.1.0-1.fc38.x86_64.rpm', PackageFile('kernel-core', '6.1.0-1.fc38', 'x86_64', 'rpm')),
+        ('foo.deb', None),
+        ('foo.rpm', None),
+        ('README', None),
+    ],
+)
+def test_parse_package_filename(file_name, expected):
+    assert parse_package_filename(file_name) == expected
+
+
+# --- compare_deb_versions ---
+
+
+@pytest.mark.parametrize(
+    'a, b, expected',
+    [
+        ('1.0', '1.0', 0),
+        ('1.0', '1.1', -1),
+        ('1.10', '1.9', 1),
+        ('1.0~rc1', '1.0', -1),
+        ('1.0', '1.0+b1', -1),
+        ('1:0.9', '2.0', 1),
+        ('1.0-1', '1.0-2', -1),
+        ('1.0-10', '1.0-9', 1),
+        ('1.0a', '1.0', 1),
+        ('1.01', '1.1', 0),
+    ],
+)
+def test_compare_deb_versions(a, b, expected):
+    result = compare_deb_versions(a, b)
+    assert (result > 0) - (result < 0) == expected
+
+
+# --- compare_rpm_versions ---
+
+
+@pytest.mark.parametrize(
+    'a, b, expected',
+    [
+        ('1.0-1', '1.0-1', 0),
+        ('1.0-1', '1.0-2', -1),
+        ('1.10-1', '1.9-1', 1),
+        ('1.0~rc1-1', '1.0-1', -1),
+        ('1.0^git1-1', '1.0-1', 1),
+        ('1.0^git1-1', '1.0.1-1', -1),
+        ('1:1.0-1', '2.0-1', 1),
+        ('1.0a-1', '1.0-1', 1),
+        ('1.0-1.fc38', '1.0-1.fc39', -1),
+    ],
+)
+def test_compare_rpm_versions(a, b, expected):
+    assert compare_rpm_versions(a, b) == expected
+
+
+# --- select_latest ---
+
+
+def test_select_latest_keeps_newest_per_arch():
+    urls = [
+        'http://repo/foo_1.0_amd64.deb',
+        'http://repo/foo_1.10_amd64.deb',
+        'http://repo/foo_1.9_amd64.deb',
+        'http://repo/foo_1.0_i386.deb',
+        'http://repo/bar-2.0-1.noarch.rpm',
+        'http://repo/bar-10.0-1.noarch.rpm',
+    ]
+    assert select_latest(urls) == [
+        'http://repo/foo_1.10_amd64.deb',
+        'http://repo/foo_1.0_i386.deb',
+        'http://repo/bar-10.0-1.noarch.rpm',
+    ]
+
+
+def test_select_latest_keep_versions():
+    urls = ['foo_1.0_amd64.deb', 'foo_3.0_amd64.deb', 'foo_2.0_amd64.deb']
+    assert select_latest(urls, keep_versions=2) == ['foo_3.0_amd64.deb', 'foo_2.0_amd64.deb']
+
+
+def test_select_latest_architectures():
+    urls = ['foo_1.0_amd64.deb', 'foo_1.0_i386.deb', 'bar_1.0_all.deb', 'unparsable.deb']
+    assert select_latest(urls, architectures=['amd64']) == ['foo_1.0_amd64.deb', 'bar_1.0_all.deb', 'unparsable.deb']
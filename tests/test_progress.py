@@ -0,0 +1,79 @@
+import io
+import logging
+from unittest.mock import patch
+
+from migasfree_imports.progress import Progress, format_bytes, format_seconds
+
+
+def test_format_bytes():
+    assert format_bytes(512) == '512.0 B'
+    assert format_bytes(2048) == '2.0 KB'
+    assert format_bytes(3 * 1024**3) == '3.0 GB'
+
+
+def test_format_seconds():
+    assert format_seconds(None) == '--:--:--'
+    assert format_seconds(3725) == '1:02:05'
+
+
+def test_render_aggregates_phases():
+    progress = Progress(stream=io.StringIO())
+    progress.add_total('download', items=4, size=400)
+    with patch('time.monotonic', side_effect=[0.0, 10.0]):
+        progress.advance('download', items=1, size=100)
+        progress.advance('download', items=1, size=100)
+        text = progress.render()
+
+    assert text == 'download 2/4 200.0 B 20.0 B/s ETA 0:00:10'
+
+
+def test_render_shows_status():
+    progress = Progress(stream=io.StringIO())
+    progress.advance('crawl', items=3)
+    progress.status('Accessing: http://example.com/repo')
+    assert progress.render() == 'crawl 3 | Accessing: http://example.com/repo'
+
+
+def test_stop_logs_when_not_a_tty(caplog):
+    progress = Progress(stream=io.StringIO(), log_interval=60)
+    progress.add_total('upload', items=1, size=10)
+    with caplog.at_level(logging.INFO, logger='migasfree_imports.progress'), progress:
+        progress.advance('upload', items=1, size=10)
+
+    assert 'progress phase=upload items=1/1 bytes=10/10' in caplog.text
+
+
+def test_stop_draws_on_a_tty():
+    stream = io.StringIO()
+    stream.isatty = lambda: True
+    progress = Progress(stream=stream, interval=60)
+    with progress:
+        progress.advance('upload', items=1)
+
+    assert stream.getvalue() == '\033[Kupload 1\r\n'
+
+
+def test_eta_counts_queued_downloads_of_unknown_size():
+    progress = Progress(stream=io.StringIO())
+    progress.add_total('download', items=100)
+    with patch('time.monotonic', side_effect=[0.0, 10.0]):
+        # only the downloads already started know their size
+        for _ in range(3):
+            progress.add_total('download', size=10 * 1024**2, sized=1)
+        progress.advance('download', items=2, size=20 * 1024**2)
+        progress.advance('download', size=1024**2)
+        snapshot = progress.snapshot()
+
+    assert snapshot[0]['eta'] == 490.0
+
+
+def test_eta_uses_bytes_once_every_size_is_known():
+    progress = Progress(stream=io.StringIO())
+    progress.add_total('download', items=2)
+    with patch('time.monotonic', side_effect=[0.0, 10.0]):
+        progress.add_total('download', size=100, sized=1)
+        progress.add_total('download', size=300, sized=1)
+        progress.advance('download', items=1, size=100)
+        snapshot = progress.snapshot()
+
+    assert snapshot[0]['eta'] == 30.0
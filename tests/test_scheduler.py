@@ -0,0 +1,74 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from migasfree_imports.scheduler import TokenBucket, TransferScheduler, parse_rate, scheduler, transfers
+
+
+@pytest.mark.parametrize(
+    'value, expected',
+    [
+        (None, 0.0),
+        ('', 0.0),
+        ('0', 0.0),
+        ('2048', 2048.0),
+        ('500K', 500 * 1024.0),
+        ('10M', 10 * 1024.0**2),
+        ('1.5g', 1.5 * 1024.0**3),
+        ('10MB/s', 10 * 1024.0**2),
+    ],
+)
+def test_parse_rate(value, expected):
+    assert parse_rate(value) == expected
+
+
+def test_parse_rate_invalid():
+    with pytest.raises(ValueError, match='Invalid bandwidth'):
+        parse_rate('fast')
+
+
+def test_token_bucket_unlimited_never_waits():
+    with patch('time.sleep') as mock_sleep:
+        TokenBucket(0).consume(10**9)
+        mock_sleep.assert_not_called()
+
+
+def test_token_bucket_waits_for_debt():
+    with patch('time.monotonic', return_value=100.0):
+        bucket = TokenBucket(rate=1000)
+        with patch('time.sleep') as mock_sleep:
+            bucket.consume(1000)  # burst
+            mock_sleep.assert_not_called()
+            bucket.consume(500)
+            mock_sleep.assert_called_once_with(0.5)
+
+
+def test_order_largest_first():
+    assert TransferScheduler.order([(10, None), (None, None), (300, None), (20, None)]) == [2, 3, 0, 1]
+
+
+def test_token_bucket_reserve_returns_wait():
+    with patch('time.monotonic', return_value=100.0):
+        bucket = TokenBucket(rate=1000)
+        assert bucket.reserve(1000) == 0.0
+        assert bucket.reserve(250) == 0.25
+
+
+def test_transfers_run_largest_first():
+    started = []
+
+    async def job(size):
+        async with transfers.slot():
+            started.append(size)
+            await asyncio.sleep(0)
+        return size
+
+    scheduler.configure(max_transfers=1)
+    try:
+        results = asyncio.run(transfers.run([(size, lambda size=size: job(size)) for size in (10, None, 300, 20)]))
+    finally:
+        scheduler.configure()
+
+    assert results == [10, None, 300, 20]
+    assert started == [300, 20, 10, None]
@@ -0,0 +1,83 @@
+import asyncio
+import json
+import threading
+from unittest.mock import MagicMock, patch
+
+from migasfree_imports.client import MigasfreeImport
+from migasfree_imports.trace import Tracer
+
+
+def test_span_disabled_records_nothing():
+    tracer = Tracer()
+    with tracer.span('work', bytes=1) as span:
+        span['bytes'] = 2
+    assert tracer.events == []
+
+
+def test_span_records_complete_event():
+    tracer = Tracer()
+    tracer.enable()
+    with tracer.span('download', 'transfer', url='http://x/a.deb') as span:
+        span['bytes'] = 10
+
+    (event,) = tracer.events
+    assert event['name'] == 'download'
+    assert event['cat'] == 'transfer'
+    assert event['ph'] == 'X'
+    assert event['dur'] >= 0
+    assert event['tid'] == threading.get_ident()
+    assert event['args'] == {'url': 'http://x/a.deb', 'bytes': 10}
+
+
+def test_write_chrome_trace(tmp_path):
+    tracer = Tracer()
+    tracer.enable()
+
+    def upload():
+        with tracer.span('upload'):
+            pass
+
+    thread = threading.Thread(target=upload, name='worker')
+    with tracer.span('phase'):
+        thread.start()
+        thread.join()
+
+    path = tmp_path / 'trace.json'
+    tracer.write(str(path))
+    data = json.loads(path.read_text())
+
+    metadata = [event for event in data['traceEvents'] if event['ph'] == 'M']
+    assert {event['args']['name'] for event in metadata} == {'worker', threading.current_thread().name}
+    assert {event['name'] for event in data['traceEvents'] if event['ph'] == 'X'} == {'phase', 'upload'}
+
+
+def test_client_request_span():
+    tracer = Tracer()
+    tracer.enable()
+    client = MigasfreeImport(server='migasfree.test', token='token')
+
+    response = MagicMock(status_code=200, text='{}', content=b'{}')
+    response.json.return_value = {}
+    with patch('migasfree_imports.client.tracer', tracer), patch('requests.request', return_value=response):
+        client.get('/api/v1/token/projects/')
+
+    (event,) = tracer.events
+    assert event['name'] == 'GET /api/v1/token/projects/'
+    assert event['args'] == {'server': 'migasfree.test', 'status': 200, 'bytes': 2}
+
+
+def test_span_in_asyncio_task_uses_task_track():
+    tracer = Tracer()
+    tracer.enable()
+
+    async def work():
+        with tracer.span('crawl'):
+            await asyncio.sleep(0)
+
+    async def main():
+        await asyncio.gather(asyncio.ensure_future(work()), asyncio.ensure_future(work()))
+
+    asyncio.run(main())
+
+    assert len({event['tid'] for event in tracer.events}) == 2
+    assert all(name.startswith('Task-') for name in tracer._threads.values())
@@ -1,10 +1,16 @@
+import hashlib
 import os
 from unittest.mock import MagicMock, mock_open, patch
 
 import pytest
 
+from migasfree_imports.checksums import IntegrityError
 from migasfree_imports.utils import (
+    DOWNLOAD_ATTEMPTS,
     download_packages,
+    download_verified,
+    iter_links,
+    package_directory,
     select_distro,
     select_option,
     select_project,
@@ -59,14 +65,21 @@ def test_select_option_not_required_empty_input():
 # --- download_packages ---
 
 
+def mock_listing(html):
+    """Mock a streamed directory listing response."""
+    response = MagicMock()
+    response.__enter__.return_value = response
+    response.encoding = None
+    response.iter_content.return_value = [html.encode()]
+    return response
+
+
 @patch('requests.get')
 @patch('builtins.open', new_callable=mock_open)
 @patch('os.makedirs')
 def test_download_packages_file_download(mock_makedirs, mock_file, mock_get, tmp_path):
     # Mock response for the directory listing
-    mock_response_list = MagicMock()
-    mock_response_list.text = '<a href="package.deb">package.deb</a>'
-    mock_response_list.raise_for_status.return_value = None
+    mock_response_list = mock_listing('<a href="package.deb">package.deb</a>')
 
     # Mock response for the file download
     mock_response_file = MagicMock()
@@ -80,7 +93,7 @@ def test_download_packages_file_download(mock_makedirs, mock_file, mock_get, tmp
 
     # Verify requests
     assert mock_get.call_count == 2
-    mock_get.assert_any_call('http://example.com/repo')
+    mock_get.assert_any_call('http://example.com/repo', stream=True)
     mock_get.assert_any_call('http://example.com/repo/package.deb', stream=True)
 
     # Verify file write
@@ -96,12 +109,10 @@ def test_download_packages_file_download(mock_makedirs, mock_file, mock_get, tmp
 @patch('requests.get')
 def test_download_packages_recursive(mock_get, tmp_path):
     # 1. Root: contains subdir/
-    resp_root = MagicMock()
-    resp_root.text = '<a href="subdir/">subdir/</a>'
+    resp_root = mock_listing('<a href="subdir/">subdir/</a>')
 
     # 2. Subdir: contains package.deb
-    resp_subdir = MagicMock()
-    resp_subdir.text = '<a href="package.deb">package.deb</a>'
+    resp_subdir = mock_listing('<a href="package.deb">package.deb</a>')
 
     # 3. File download
     resp_file = MagicMock()
@@ -124,6 +135,111 @@ def test_download_packages_recursive(mock_get, tmp_path):
         assert mock_get.call_count == 3
 
 
+@patch('migasfree_imports.utils.download_package')
+@patch('requests.get')
+def test_download_packages_keep_versions(mock_get, mock_download, tmp_path):
+    resp_root = mock_listing(
+        '<a href="foo_1.0_amd64.deb">foo_1.0_amd64.deb</a>'
+        '<a href="foo_1.1_amd64.deb">foo_1.1_amd64.deb</a>'
+        '<a href="foo_1.1_i386.deb">foo_1.1_i386.deb</a>'
+    )
+    mock_get.return_value = resp_root
+
+    download_packages('http://example.com/repo/', str(tmp_path), keep_versions=1, architectures=['amd64'])
+
+    mock_download.assert_called_once_with('http://example.com/repo/foo_1.1_amd64.deb', str(tmp_path), None)
+
+
+def mock_download(data, headers=None):
+    """Mock a streamed package download response."""
+    response = MagicMock()
+    response.__enter__.return_value = response
+    response.headers = headers or {}
+    response.iter_content.return_value = [data]
+    return response
+
+
+@patch('requests.get')
+def test_download_verified_returns_sha256(mock_get, tmp_path):
+    mock_get.return_value = mock_download(b'data', {'Content-Length': '4'})
+
+    file_path, sha256 = download_verified('http://example.com/repo/foo.deb', str(tmp_path))
+
+    assert file_path == str(tmp_path / 'foo.deb')
+    assert sha256 == hashlib.sha256(b'data').hexdigest()
+
+
+@patch('requests.get')
+def test_download_verified_retries_truncated_download(mock_get, tmp_path):
+    mock_get.side_effect = [mock_download(b'da', {'Content-Length': '4'}), mock_download(b'data')]
+    checksum = ('sha256', hashlib.sha256(b'data').hexdigest())
+
+    file_path, _ = download_verified('http://example.com/repo/foo.deb', str(tmp_path), checksum)
+
+    assert mock_get.call_count == 2
+    with open(file_path, 'rb') as file:
+        assert file.read() == b'data'
+
+
+@patch('requests.get')
+def test_download_verified_counts_progress_once(mock_get, tmp_path):
+    mock_get.side_effect = [
+        mock_download(b'da', {'Content-Length': '4'}),
+        mock_download(b'data', {'Content-Length': '4'}),
+    ]
+
+    with patch('migasfree_imports.utils.progress') as mock_progress:
+        download_verified('http://example.com/repo/foo.deb', str(tmp_path))
+
+    mock_progress.add_total.assert_called_once_with('download', size=4, sized=1)
+    assert sum(call.kwargs.get('size', 0) for call in mock_progress.advance.call_args_list) == 4
+
+
+def test_package_directory_is_unique_per_url():
+    amd64 = package_directory('packages', 'http://example.com/repo/x86_64/foo-1.0.noarch.rpm')
+    arm64 = package_directory('packages', 'http://example.com/repo/aarch64/foo-1.0.noarch.rpm')
+
+    assert amd64 != arm64
+    assert os.path.dirname(amd64) == 'packages'
+    assert package_directory('packages', 'http://example.com/repo/x86_64/foo-1.0.noarch.rpm') == amd64
+
+
+@patch('requests.get')
+def test_download_verified_gives_up_on_checksum_mismatch(mock_get, tmp_path):
+    mock_get.side_effect = lambda *args, **kwargs: mock_download(b'evil')
+    checksum = ('sha256', hashlib.sha256(b'data').hexdigest())
+
+    with pytest.raises(IntegrityError):
+        download_verified('http://example.com/repo/foo.deb', str(tmp_path), checksum)
+
+    assert mock_get.call_count == DOWNLOAD_ATTEMPTS
+    assert not (tmp_path / 'foo.deb').exists()
+
+
+def test_iter_links_applies_skip_rules_across_chunks():
+    html = (
+        '<html><body><a href="../">Parent Directory</a><a href="?C=N;O=D">Name</a><a href="#top">top</a>'
+        '<a href="http://other.example.com/x.deb">x</a><a href="sub/">sub/</a>'
+        '<a href="foo_1.0_all.deb">foo</a><a>no href</a><a href="caf%C3%A9_1.0_all.deb">café</a></body></html>'
+    ).encode()
+    chunks = [html[i : i + 7] for i in range(0, len(html), 7)]
+
+    links = list(iter_links(chunks, 'http://example.com/repo', 'http://example.com/repo/'))
+
+    assert links == [
+        ('sub/', 'http://example.com/repo/sub/'),
+        ('foo_1.0_all.deb', 'http://example.com/repo/foo_1.0_all.deb'),
+        ('caf%C3%A9_1.0_all.deb', 'http://example.com/repo/caf%C3%A9_1.0_all.deb'),
+    ]
+
+
+def test_iter_links_decodes_split_multibyte_characters():
+    html = '<a href="café/">café/</a>'.encode()
+    split = html.index(b'\xa9')
+    links = list(iter_links([html[:split], html[split:]], 'http://example.com', 'http://example.com'))
+    assert links == [('café/', 'http://example.com/café/')]
+
+
 # --- select_project ---
 
 